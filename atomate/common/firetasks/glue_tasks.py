@@ -8,13 +8,16 @@ import glob
 
 from fireworks import explicit_serialize, FiretaskBase, FWAction
 
-from atomate.utils.utils import env_chk, load_class, recursive_get_result
-from atomate.utils.fileio import FileClient
-from monty.shutil import copy_r, gzip_dir
+from atomate.utils.utils import env_chk, get_logger, load_class, recursive_get_result
+from atomate.utils.fileio import FileClient, COPY_THREADS, STAGING_MODES, STAGING_FILES, \
+    GZIP_THREADS, MANIFEST_CHECKSUM, get_manifest, gzip_dir, is_synced
+from monty.shutil import copy_r
 
 __author__ = 'Anubhav Jain'
 __email__ = 'ajain@lbl.gov'
 
+logger = get_logger(__name__)
+
 
 @explicit_serialize
 class PassCalcLocs(FiretaskBase):
@@ -31,16 +34,26 @@ class PassCalcLocs(FiretaskBase):
             defaults to None
         path (str): The path to the directory containing the calculation. defaults to
             current working directory.
+        manifest (bool): whether to record the manifest of the directory (size,
+            modification time and checksum of the files) in the calc_loc, with which
+            CopyFilesFromCalcLoc only copies the files not already at the destination.
+            defaults to False
+        manifest_checksum (str): hashlib algorithm of the checksums of the manifest, or
+            None to record the sizes and modification times only. defaults to "md5"
     """
 
     required_params = ["name"]
-    optional_params = ["filesystem", "path"]
+    optional_params = ["filesystem", "path", "manifest", "manifest_checksum"]
 
     def run_task(self, fw_spec):
         calc_locs = list(fw_spec.get("calc_locs", []))
-        calc_locs.append({"name": self["name"],
-                          "filesystem": env_chk(self.get('filesystem', None), fw_spec),
-                          "path": self.get("path", os.getcwd())})
+        calc_loc = {"name": self["name"],
+                    "filesystem": env_chk(self.get('filesystem', None), fw_spec),
+                    "path": self.get("path", os.getcwd())}
+        if self.get("manifest"):
+            calc_loc["manifest"] = get_manifest(
+                calc_loc["path"], checksum=self.get("manifest_checksum", MANIFEST_CHECKSUM))
+        calc_locs.append(calc_loc)
 
         return FWAction(mod_spec=[{'_push_all': {'calc_locs': calc_locs}}])
 
@@ -94,11 +107,19 @@ class CopyFilesFromCalcLoc(FiretaskBase):
         name_append (str): string to append to destination filenames.
         exclude_files (list): list of file names to be excluded. Accepts glob
             patterns.
+        nthreads (int): number of concurrent copies. Supports env_chk. Defaults to 4.
+        max_bandwidth (float): maximum total bandwidth of the copies in MB/s. Supports
+            env_chk. Defaults to no limit.
+        sync (bool): only copy the files that are not already at the destination with the
+            same size and modification time or checksum, as recorded in the manifest of
+            the calc_loc (see PassCalcLocs) or else read from the source. The files are
+            copied through ".part" files, and an interrupted copy is resumed in the next
+            run. With "$ALL", the subfolders are synced too. Defaults to False.
     """
 
     required_params = ["calc_loc"]
     optional_params = ["filenames", "name_prepend", "name_append",
-                       "exclude_files"]
+                       "exclude_files", "nthreads", "max_bandwidth", "sync"]
 
     def run_task(self, fw_spec=None):
         calc_loc = get_calc_loc(self['calc_loc'], fw_spec["calc_locs"])
@@ -108,6 +129,8 @@ class CopyFilesFromCalcLoc(FiretaskBase):
         fileclient = FileClient(filesystem=filesystem)
         calc_dir = fileclient.abspath(calc_dir)
         filenames = self.get('filenames')
+        sync = self.get("sync", False)
+        manifest = calc_loc.get("manifest")
 
         exclude_files = self.get('exclude_files', [])
         if filenames is None:
@@ -121,27 +144,63 @@ class CopyFilesFromCalcLoc(FiretaskBase):
                     self.get("exclude_files"):
                 raise ValueError('name_prepend, name_append, and exclude_files \
                     options not compatible with "$ALL" option')
-            copy_r(calc_dir, os.getcwd())
-            return
+            if not sync:
+                copy_r(calc_dir, os.getcwd())
+                return
+            manifest = manifest or fileclient.get_manifest(calc_dir)
+            files_to_copy = [entry["file"] for entry in manifest]
         else:
             files_to_copy = []
             for fname in filenames:
-                for f in glob.glob(os.path.join(calc_dir, fname)):
+                for f in fileclient.glob(os.path.join(calc_dir, fname)):
                     files_to_copy.append(os.path.basename(f))
 
         # delete any excluded files
         for fname in exclude_files:
-            for f in glob.glob(os.path.join(calc_dir, fname)):
+            for f in fileclient.glob(os.path.join(calc_dir, fname)):
                 if os.path.basename(f) in files_to_copy:
                     files_to_copy.remove(os.path.basename(f))
 
+        manifest = {entry["file"]: entry for entry in manifest or []}
+        if sync:
+            # the files not in the manifest are stat'ed at once
+            fileclient.stat_many([os.path.join(calc_dir, f) for f in files_to_copy
+                                  if f not in manifest])
+        files = []
         for f in files_to_copy:
             prev_path_full = os.path.join(calc_dir, f)
             dest_fname = self.get('name_prepend', "") + f + self.get(
                 'name_append', "")
             dest_path = os.path.join(os.getcwd(), dest_fname)
+            if sync and is_synced(dest_path, manifest.get(f) or
+                                  get_file_entry(fileclient, prev_path_full)):
+                continue
+            files.append((prev_path_full, dest_path))
+
+        if sync:
+            logger.info("Syncing {} of {} files from {}".format(len(files), len(files_to_copy),
+                                                               calc_dir))
+        fileclient.copy_many(
+            files, nthreads=env_chk(self.get("nthreads"), fw_spec, strict=False,
+                                    default=COPY_THREADS),
+            max_bandwidth=env_chk(self.get("max_bandwidth"), fw_spec, strict=False),
+            resume=sync, manifest={os.path.join(calc_dir, f): entry
+                                   for f, entry in manifest.items()})
+
+
+def get_file_entry(fileclient, path):
+    """
+    Get the manifest entry of a file, without checksum.
+
+    Args:
+        fileclient (FileClient): client of the filesystem of the file
+        path (str): full path of the file
 
-            fileclient.copy(prev_path_full, dest_path)
+    Returns:
+        (dict) the size and modification time of the file
+    """
+    st = fileclient.stat(path)
+    return {"size": st.st_size, "mtime": st.st_mtime}
 
 
 @explicit_serialize
@@ -265,14 +324,27 @@ class CopyFiles(FiretaskBase):
             (e.g., rename 'INCAR' to 'INCAR.precondition')
         continue_on_missing(bool): Whether to continue copying when a file
             in filenames is missing. Defaults to False.
+        nthreads (int): number of concurrent copies. Supports env_chk. Defaults to 4.
+        max_bandwidth (float): maximum total bandwidth of the copies in MB/s. Supports
+            env_chk. Defaults to no limit.
+        staging (str): how the local files are staged: "copy" (default), "hardlink",
+            "reflink" (copy-on-write clone) or "symlink". Falls back to a copy when the
+            filesystem does not support it. Hard links and symlinks share the data with the
+            source files, so only use them for files that are not modified in place.
+            Supports env_chk.
+        staging_files (list): file name patterns of the files staged with the staging mode,
+            with or without a .gz extension. The other files are always copied. Defaults to
+            STAGING_FILES (WAVECAR and CHGCAR).
     """
 
     optional_params = ["from_dir", "to_dir", "filesystem", "files_to_copy", 
-                       "exclude_files", "suffix", "continue_on_missing"]
+                       "exclude_files", "suffix", "continue_on_missing", "nthreads",
+                       "max_bandwidth", "staging", "staging_files"]
 
     def setup_copy(self, from_dir, to_dir=None, filesystem=None, files_to_copy=None,
                    exclude_files=None, from_path_dict=None, suffix=None, 
-                   fw_spec=None, continue_on_missing=False):
+                   fw_spec=None, continue_on_missing=False, nthreads=None,
+                   max_bandwidth=None, staging=None, staging_files=None):
         """
         setup the copy i.e setup the from directory, filesystem, destination directory etc.
 
@@ -288,6 +360,11 @@ class CopyFiles(FiretaskBase):
                 in filenames is missing. Defaults to False.
             from_path_dict (dict): dict specification of the path. If specified must contain atleast
                 the key "path" that specifies the path to the from_dir.
+            nthreads (int): number of concurrent copies
+            max_bandwidth (float): maximum total bandwidth of the copies in MB/s
+            staging (str): staging mode of the local files, one of STAGING_MODES
+            staging_files (list): file name patterns of the files staged with the staging
+                mode, the others are copied. Defaults to STAGING_FILES.
         """
         from_path_dict = from_path_dict or {}
         from_dir = env_chk(from_dir, fw_spec, strict=False) or from_path_dict.get("path", None)
@@ -301,31 +378,40 @@ class CopyFiles(FiretaskBase):
         self.files_to_copy = files_to_copy or [f for f in self.fileclient.listdir(self.from_dir) if f not in exclude_files]
         self.suffix = suffix
         self.continue_on_missing = continue_on_missing
+        self.nthreads = env_chk(nthreads, fw_spec, strict=False, default=COPY_THREADS)
+        self.max_bandwidth = env_chk(max_bandwidth, fw_spec, strict=False)
+        self.staging = env_chk(staging, fw_spec, strict=False, default="copy")
+        if self.staging not in STAGING_MODES:
+            raise ValueError("Unknown staging mode: {}. Use one of {}".format(
+                self.staging, STAGING_MODES))
+        self.staging_files = STAGING_FILES if staging_files is None else staging_files
 
     def copy_files(self):
         """
         Defines the copy operation. Override this to customize copying.
         """
+        files = []
         for f in self.files_to_copy:
             prev_path_full = os.path.join(self.from_dir, f)
             if self.suffix:
-                dest_path = os.path.join(self.to_dir, f,self.suffix)
+                dest_path = os.path.join(self.to_dir, f + self.suffix)
             else:
                 dest_path = os.path.join(self.to_dir, f)
-            try:
-                self.fileclient.copy(prev_path_full, dest_path)
-            except FileNotFoundError as exc:
-                if continue_on_missing:
-                    continue
-                else:
-                    raise exc
+            files.append((prev_path_full, dest_path))
+        self.fileclient.copy_many(files, nthreads=self.nthreads, max_bandwidth=self.max_bandwidth,
+                                  continue_on_missing=self.continue_on_missing,
+                                  mode=self.staging, staging_files=self.staging_files)
 
     def run_task(self, fw_spec):
         self.setup_copy(self.get("from_dir", None), to_dir=self.get("to_dir", None),
                         filesystem=self.get("filesystem", None),
                         files_to_copy=self.get("files_to_copy", None),
                         exclude_files=self.get("exclude_files", []),
-                        suffix=self.get("suffix",None),fw_spec=fw_spec)
+                        suffix=self.get("suffix",None),fw_spec=fw_spec,
+                        continue_on_missing=self.get("continue_on_missing", False),
+                        nthreads=self.get("nthreads"),
+                        max_bandwidth=self.get("max_bandwidth"),
+                        staging=self.get("staging"), staging_files=self.get("staging_files"))
         self.copy_files()
 
 @explicit_serialize
@@ -333,11 +419,16 @@ class GzipDir(FiretaskBase):
     """
     Task to gzip the current directory.
 
+    Optional params:
+        nthreads (int): number of compression threads. The files, and the blocks of the
+            large files, are compressed concurrently into standard .gz files. Supports
+            env_chk. Defaults to 4.
     """
 
     required_params = []
-    optional_params = []
+    optional_params = ["nthreads"]
 
     def run_task(self,fw_spec=None):
         cwd = os.getcwd()
-        gzip_dir(cwd)
\ No newline at end of file
+        nthreads = env_chk(self.get("nthreads"), fw_spec, strict=False, default=GZIP_THREADS)
+        gzip_dir(cwd, nthreads=nthreads)
\ No newline at end of file
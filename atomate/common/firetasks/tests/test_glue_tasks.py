@@ -9,6 +9,7 @@ from fireworks.core.rocket_launcher import rapidfire
 
 from atomate.common.firetasks.glue_tasks import PassCalcLocs, get_calc_loc, CopyFilesFromCalcLoc, CreateFolder, DeleteFiles
 from atomate.vasp.firetasks.glue_tasks import CopyVaspOutputs
+from atomate.utils.fileio import get_manifest
 
 from atomate.utils.testing import AtomateTest
 
@@ -130,6 +131,31 @@ class TestCopyFilesFromCalcLoc(AtomateTest):
         self.assertTrue(os.path.exists(get_calc_loc("fw3", calc_locs)["path"] +
                                        "/POSCAR_1"))
 
+    def test_sync(self):
+        calc_locs = [{"name": "fw1", "filesystem": None, "path": self.plain_outdir,
+                      "manifest": get_manifest(self.plain_outdir)}]
+        ct = CopyFilesFromCalcLoc(calc_loc="fw1", filenames=["$ALL"], sync=True)
+        ct.run_task({"calc_locs": calc_locs})
+        for entry in calc_locs[0]["manifest"]:
+            self.assertTrue(os.path.exists(os.path.join(self.scratch_dir, entry["file"])))
+        inode = os.stat(os.path.join(self.scratch_dir, "INCAR")).st_ino
+
+        # only the modified and partially copied files are copied again
+        with open(os.path.join(self.scratch_dir, "POSCAR"), "w") as f:
+            f.write("modified")
+        with open(os.path.join(self.plain_outdir, "OUTCAR"), "rb") as f_in:
+            data = f_in.read()
+        os.remove(os.path.join(self.scratch_dir, "OUTCAR"))
+        with open(os.path.join(self.scratch_dir, "OUTCAR.part"), "wb") as f_out:
+            f_out.write(data[:100])
+        ct.run_task({"calc_locs": calc_locs})
+        self.assertEqual(os.stat(os.path.join(self.scratch_dir, "INCAR")).st_ino, inode)
+        for f in ["POSCAR", "OUTCAR"]:
+            with open(os.path.join(self.plain_outdir, f)) as f1:
+                with open(os.path.join(self.scratch_dir, f)) as f2:
+                    self.assertEqual(f1.read(), f2.read())
+        self.assertFalse(os.path.exists(os.path.join(self.scratch_dir, "OUTCAR.part")))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -5,9 +5,13 @@
 This module defines a base class for derived database classes that store calculation data.
 """
 
+import os
+import glob
+import pickle
 import datetime
+from collections import OrderedDict
 from abc import ABCMeta, abstractmethod
-from pymongo import MongoClient, ReturnDocument
+from pymongo import MongoClient, ReturnDocument, UpdateOne
 
 from monty.json import jsanitize
 from monty.serialization import loadfn
@@ -71,6 +75,81 @@ class CalcDb(metaclass=ABCMeta):
             d (dict): task document
             update_duplicates (bool): whether to update the duplicates
         """
+        d = self._prepare_insert(d, update_duplicates=update_duplicates)
+        if d is None:
+            return None
+        self.collection.update_one({"dir_name": d["dir_name"]},
+                                   {"$set": d}, upsert=True)
+        return d["task_id"]
+
+    def insert_many(self, docs, update_duplicates=True):
+        """
+        Insert several task documents into the database collection with a fixed number of
+        round trips: a single query for the existing dir_names, a single reservation of a
+        block of task_ids and a single unordered bulk write of the upserts. Duplicates are
+        handled as in insert.
+
+        Args:
+            docs ([dict]): task documents
+            update_duplicates (bool): whether to update the duplicates
+
+        Returns:
+            ([int]) task_ids of the documents, None for the skipped duplicates
+        """
+        if not docs:
+            return []
+        dir_names = list({d["dir_name"] for d in docs})
+        existing = {r["dir_name"]: r["task_id"] for r in
+                    self.collection.find({"dir_name": {"$in": dir_names}}, ["dir_name", "task_id"])}
+
+        # reserve the task_ids of the new documents in one block
+        new_dir_names = {d["dir_name"] for d in docs
+                         if d["dir_name"] not in existing and not d.get("task_id")}
+        next_id = None
+        if new_dir_names:
+            last_id = self.db.counter.find_one_and_update(
+                {"_id": "taskid"}, {"$inc": {"c": len(new_dir_names)}},
+                return_document=ReturnDocument.AFTER)["c"]
+            next_id = last_id - len(new_dir_names) + 1
+
+        requests = []
+        task_ids = []
+        for d in docs:
+            if d["dir_name"] in existing:
+                if not update_duplicates:
+                    logger.info("Skipping duplicate {}".format(d["dir_name"]))
+                    task_ids.append(None)
+                    continue
+                d["task_id"] = existing[d["dir_name"]]
+                logger.info("Updating {} with taskid = {}".format(d["dir_name"], d["task_id"]))
+            else:
+                if not d.get("task_id"):
+                    d["task_id"] = next_id
+                    next_id += 1
+                logger.info("Inserting {} with taskid = {}".format(d["dir_name"], d["task_id"]))
+            # later documents with the same dir_name are duplicates of this one
+            existing[d["dir_name"]] = d["task_id"]
+            d["last_updated"] = datetime.datetime.utcnow()
+            requests.append(UpdateOne({"dir_name": d["dir_name"]},
+                                      {"$set": jsanitize(d, allow_bson=True)}, upsert=True))
+            task_ids.append(d["task_id"])
+
+        if requests:
+            self.collection.bulk_write(requests, ordered=False)
+        return task_ids
+
+    def _prepare_insert(self, d, update_duplicates=True):
+        """
+        Assign the task_id and timestamp of a task document prior to its insertion.
+
+        Args:
+            d (dict): task document
+            update_duplicates (bool): whether to update the duplicates
+
+        Returns:
+            (dict) the sanitized document to upsert or None if it is a duplicate
+            that should be skipped
+        """
         result = self.collection.find_one({"dir_name": d["dir_name"]}, ["dir_name", "task_id"])
         if result is None or update_duplicates:
             d["last_updated"] = datetime.datetime.utcnow()
@@ -83,10 +162,7 @@ class CalcDb(metaclass=ABCMeta):
             elif update_duplicates:
                 d["task_id"] = result["task_id"]
                 logger.info("Updating {} with taskid = {}".format(d["dir_name"], d["task_id"]))
-            d = jsanitize(d, allow_bson=True)
-            self.collection.update_one({"dir_name": d["dir_name"]},
-                                       {"$set": d}, upsert=True)
-            return d["task_id"]
+            return jsanitize(d, allow_bson=True)
         else:
             logger.info("Skipping duplicate {}".format(d["dir_name"]))
             return None
@@ -133,3 +209,131 @@ class CalcDb(metaclass=ABCMeta):
 
         return cls(creds["host"], int(creds.get("port", 27017)), creds["database"], creds["collection"],
                    user, password, **kwargs)
+
+
+class GridFSCache(object):
+    """
+    Two-level LRU cache (in-process, then on-disk) of the objects decoded from GridFS files,
+    keyed by the id of the file. GridFS files are not modified in place (new data is inserted
+    with a new id), so cached objects are only invalidated when a task is overwritten and its
+    previous files are superseded.
+
+    Note that the in-process cache returns the cached object itself: do not modify it.
+    """
+
+    def __init__(self, cache_dir=None, max_size=2 ** 30, memory_size=16):
+        """
+        Args:
+            cache_dir (str): directory of the on-disk cache. If None, only the in-process cache
+                is used.
+            max_size (int): maximum size in bytes of the on-disk cache. The least recently used
+                files are evicted beyond it.
+            memory_size (int): maximum number of objects kept in the in-process cache
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.memory_size = memory_size
+        self._memo = OrderedDict()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key):
+        """
+        Get a cached object.
+
+        Args:
+            key: the id of the GridFS file
+
+        Returns:
+            the cached object or None if it is not in the cache
+        """
+        key = str(key)
+        if key in self._memo:
+            self._memo.move_to_end(key)
+            return self._memo[key]
+        if self.cache_dir:
+            path = self._get_path(key)
+            try:
+                with open(path, "rb") as f:
+                    obj = pickle.load(f)
+                os.utime(path)  # mark as recently used
+            except FileNotFoundError:
+                return None
+            except Exception:
+                logger.warning("Removing unreadable cache file {}".format(path))
+                self._remove(path)
+                return None
+            self._memoize(key, obj)
+            return obj
+        return None
+
+    def put(self, key, obj):
+        """
+        Add an object to the cache.
+
+        Args:
+            key: the id of the GridFS file
+            obj: the decoded object
+        """
+        key = str(key)
+        self._memoize(key, obj)
+        if self.cache_dir:
+            path = self._get_path(key)
+            tmp_path = "{}.{}.tmp".format(path, os.getpid())
+            with open(tmp_path, "wb") as f:
+                pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            self._evict()
+
+    def invalidate(self, keys):
+        """
+        Remove objects from the cache.
+
+        Args:
+            keys (list): ids of the GridFS files
+        """
+        for key in keys:
+            key = str(key)
+            self._memo.pop(key, None)
+            if self.cache_dir:
+                self._remove(self._get_path(key))
+
+    def clear(self):
+        """
+        Remove all the objects from the cache.
+        """
+        self._memo.clear()
+        if self.cache_dir:
+            for path in glob.glob(os.path.join(self.cache_dir, "*.pickle")):
+                self._remove(path)
+
+    def _memoize(self, key, obj):
+        self._memo[key] = obj
+        self._memo.move_to_end(key)
+        while len(self._memo) > self.memory_size:
+            self._memo.popitem(last=False)
+
+    def _evict(self):
+        files = []
+        for path in glob.glob(os.path.join(self.cache_dir, "*.pickle")):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total_size = sum(f[1] for f in files)
+        for mtime, size, path in sorted(files):
+            if total_size <= self.max_size:
+                break
+            self._remove(path)
+            total_size -= size
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, "{}.pickle".format(key))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
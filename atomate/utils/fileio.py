@@ -1,9 +1,22 @@
 # coding: utf-8
 
 
+import errno
+import fnmatch
 import glob
+import gzip
+import hashlib
+import json
 import os
+import posixpath
 import shutil
+import stat
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from atomate.utils.utils import get_logger
 
 """
 This module defines the wrapper class for remote file io using paramiko.
@@ -13,6 +26,37 @@ __author__ = 'Kiran Mathew'
 __credits__ = 'Anubhav Jain <ajain@lbl.gov>'
 __email__ = 'kmathew@lbl.gov'
 
+logger = get_logger(__name__)
+
+# default number of concurrent transfers of FileClient.copy_many
+COPY_THREADS = 4
+
+# size of the chunks of the bandwidth limited copies (in bytes)
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# ways of staging local files: full copy, hard link, copy-on-write clone (reflink) or
+# symbolic link. The links share the data with the source file.
+STAGING_MODES = ("copy", "hardlink", "reflink", "symlink")
+
+# files staged with the links by default: large outputs that are only read by the next
+# calculation. The other files are always copied, since they may be rewritten in place.
+STAGING_FILES = ("WAVECAR", "CHGCAR")
+
+# default number of threads and size of the blocks (in bytes) compressed concurrently by
+# gzip_dir
+GZIP_THREADS = 4
+GZIP_BLOCK_SIZE = 16 * 1024 * 1024
+
+# checksum of the files in the manifests of the calculation directories
+MANIFEST_CHECKSUM = "md5"
+
+# FICLONE ioctl request of Linux, cloning a file on copy-on-write filesystems (btrfs, xfs)
+FICLONE = 0x40049409
+
+# SSH connections shared by the FileClients of a process, by username, host and private key
+_ssh_connections = {}
+_ssh_connections_lock = threading.Lock()
+
 
 class FileClient(object):
     """
@@ -29,6 +73,11 @@ class FileClient(object):
                 connections only). Note: passwordless ssh login must be setup
         """
         self.ssh = None
+        # one SFTP session per thread, over the shared SSH connection
+        self._sftp_sessions = threading.local()
+        # remote directory listings and file attributes, by normalized path
+        self._listdir_cache = {}
+        self._stat_cache = {}
 
         if filesystem:
             if '@' in filesystem:
@@ -38,7 +87,15 @@ class FileClient(object):
                 host = filesystem
 
             self.ssh = FileClient.get_ssh_connection(username, host, private_key)
-            self.sftp = self.ssh.open_sftp()
+
+    @property
+    def sftp(self):
+        """
+        SFTP session of the current thread.
+        """
+        if getattr(self._sftp_sessions, "sftp", None) is None:
+            self._sftp_sessions.sftp = self.ssh.open_sftp()
+        return self._sftp_sessions.sftp
 
     @staticmethod
     def get_ssh_connection(username, host, private_key):
@@ -46,6 +103,9 @@ class FileClient(object):
         Connect to the remote host via paramiko using the private key.
         If the host key is not present it will be added automatically.
 
+        The connections are pooled by username, host and private key, and reused by all the
+        FileClients of the process while they are active.
+
         Args:
             username (str):
             host (str):
@@ -57,13 +117,22 @@ class FileClient(object):
 
         """
         import paramiko
-        private_key = os.path.expanduser(private_key)
-        if not os.path.exists(private_key):
-            raise ValueError("Cannot locate private key file: {}".format(private_key))
+        private_key = os.path.abspath(os.path.expanduser(private_key))
+        key = (username, host, private_key)
+        with _ssh_connections_lock:
+            ssh = _ssh_connections.get(key)
+            if ssh is not None and ssh.get_transport() is not None and \
+                    ssh.get_transport().is_active():
+                return ssh
 
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        return ssh.connect(host, username=username, key_filename=private_key)
+            if not os.path.exists(private_key):
+                raise ValueError("Cannot locate private key file: {}".format(private_key))
+
+            ssh = paramiko.SSHClient()
+            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            ssh.connect(host, username=username, key_filename=private_key)
+            _ssh_connections[key] = ssh
+            return ssh
 
     @staticmethod
     def exists(sftp, path):
@@ -77,7 +146,7 @@ class FileClient(object):
         try:
             sftp.stat(path)
         except IOError as e:
-            if e[0] == 2:
+            if e.errno == errno.ENOENT:
                 return False
             raise
         else:
@@ -96,29 +165,356 @@ class FileClient(object):
         if not self.ssh:
             return os.listdir(ldir)
         else:
-            return self.sftp.listdir()
+            return [a.filename for a in self.listdir_attr(ldir)]
 
-    def copy(self, src, dest):
+    def listdir_attr(self, ldir):
         """
-        Copy from source to destination.
+        Get the attributes of the entries of a remote directory, in a single SFTP request.
+        The listing and the attributes of the entries are cached for the stat calls, until
+        clear_cache is called.
+
+        Args:
+            ldir (str): full path to the directory
+
+        Returns:
+            ([SFTPAttributes]) with the filename of each entry
+        """
+        key = posixpath.normpath(ldir)
+        if key not in self._listdir_cache:
+            # the files listed in a cached listing are not listed again, e.g. by glob
+            if key in self._stat_cache and not stat.S_ISDIR(self._stat_cache[key].st_mode):
+                raise NotADirectoryError(errno.ENOTDIR, "Not a directory", ldir)
+            try:
+                attrs = self.sftp.listdir_attr(ldir)
+            except IOError as exc:
+                raise _remote_error(exc, ldir)
+            for a in attrs:
+                # the attributes of the symlinks are those of the links, not of their targets
+                if not stat.S_ISLNK(a.st_mode):
+                    self._stat_cache[posixpath.join(key, a.filename)] = a
+            self._listdir_cache[key] = attrs
+        return self._listdir_cache[key]
+
+    def walk(self, top):
+        """
+        os.walk() on either the local or remote filesystem, with one listing per directory.
+
+        Args:
+            top (str): full path to the directory
+
+        Returns:
+            iterator of (dirpath, dirnames, filenames)
+        """
+        if not self.ssh:
+            for dirpath, dirnames, filenames in os.walk(top):
+                yield dirpath, dirnames, filenames
+            return
+        dirnames, filenames = [], []
+        for a in self.listdir_attr(top):
+            (dirnames if stat.S_ISDIR(a.st_mode) else filenames).append(a.filename)
+        yield top, dirnames, filenames
+        for d in dirnames:
+            for w in self.walk(posixpath.join(top, d)):
+                yield w
+
+    def get_manifest(self, path):
+        """
+        Get the manifest of a directory on either the local or remote filesystem, without
+        checksums: the size and modification time of all its files, recursively. See
+        get_manifest.
+
+        Args:
+            path (str): full path of the directory
+
+        Returns:
+            ([dict]) the "file" path relative to the directory, "size" and "mtime" of each file
+        """
+        if not stat.S_ISDIR(self.stat(path).st_mode):
+            raise NotADirectoryError(path)
+        if not self.ssh:
+            return get_manifest(path, checksum=None)
+        files = [posixpath.join(dirpath, f) for dirpath, dirnames, filenames in self.walk(path)
+                 for f in sorted(filenames)]
+        manifest = []
+        for f, st in self.stat_many(files).items():
+            if st is not None:
+                manifest.append({"file": posixpath.relpath(f, path), "size": st.st_size,
+                                 "mtime": st.st_mtime})
+        return manifest
+
+    def clear_cache(self):
+        """
+        Clear the cached remote directory listings and file attributes.
+        """
+        self._listdir_cache = {}
+        self._stat_cache = {}
+
+    def copy(self, src, dest, limiter=None, mode="copy"):
+        """
+        Copy from source to destination. For remote filesystems, the source is on the remote
+        filesystem and the destination is local.
 
         Args:
             src (str): source full path
             dest (str): destination file full path
+            limiter (BandwidthLimiter): limits the bandwidth of the copy
+            mode (str): staging mode of local files, one of STAGING_MODES. Falls back to a
+                copy if the link or clone is not supported, e.g. across filesystems. Remote
+                files are always copied.
 
+        Returns:
+            (int) number of bytes copied
         """
+        unlink_staged(dest)
         if not self.ssh:
-            shutil.copy2(src, dest)
+            if mode != "copy" and stage_file(src, dest, mode):
+                return 0
+            if limiter is None:
+                shutil.copy2(src, dest)
+            else:
+                with open(src, "rb") as f_in, open(dest, "wb") as f_out:
+                    for chunk in iter(lambda: f_in.read(COPY_CHUNK_SIZE), b""):
+                        f_out.write(chunk)
+                        limiter.consume(len(chunk))
+                shutil.copystat(src, dest)
+            return os.path.getsize(dest)
 
         else:
-            if os.path.isdir(src):
-                if not FileClient.exists(self.sftp, dest):
-                    self.sftp.mkdir(dest)
-                for f in os.listdir(src):
-                    if os.path.isfile(os.path.join(src, f)):
-                        self.sftp.put(os.path.join(src, f), os.path.join(dest, f))
+            if stat.S_ISDIR(self.stat(src).st_mode):
+                if not os.path.exists(dest):
+                    os.mkdir(dest)
+                nbytes = 0
+                for f in self.listdir_attr(src):
+                    if not stat.S_ISDIR(f.st_mode):
+                        nbytes += self._get(os.path.join(src, f.filename),
+                                            os.path.join(dest, f.filename), limiter)
+                return nbytes
             else:
-                self.sftp.put(src, os.path.join(dest, os.path.basename(src)))
+                return self._get(src, dest, limiter)
+
+    def _get(self, src, dest, limiter=None):
+        transferred = [0]
+
+        def callback(n, total):
+            if limiter is not None:
+                limiter.consume(n - transferred[0])
+            transferred[0] = n
+
+        self.sftp.get(src, dest, callback=callback)
+        return os.path.getsize(dest)
+
+    def copy_resumable(self, src, dest, limiter=None, entry=None):
+        """
+        Copy a file through a "<dest>.part" file renamed to dest when complete, so that an
+        interrupted copy never leaves a truncated dest. The size and modification time of the
+        source are recorded in a "<dest>.part.json" file, and the copy resumes from the end of
+        an existing .part file only if the source did not change since. The modification time
+        of the source is kept.
+
+        Args:
+            src (str): source full path
+            dest (str): destination file full path
+            limiter (BandwidthLimiter): limits the bandwidth of the copy
+            entry (dict): manifest entry of the source (see get_manifest). If it has a checksum
+                and the source did not change since the manifest was recorded, the copy is
+                checked against it.
+
+        Returns:
+            (int) number of bytes copied
+        """
+        src_stat = self.stat(src)
+        if stat.S_ISDIR(src_stat.st_mode):
+            return self.copy(src, dest, limiter)
+        part = dest + ".part"
+        part_info = part + ".json"
+        info = {"src": src, "size": src_stat.st_size, "mtime": src_stat.st_mtime}
+
+        offset = 0
+        if os.path.exists(part) and os.path.exists(part_info):
+            try:
+                with open(part_info) as f:
+                    previous_info = json.load(f)
+            except ValueError:
+                previous_info = None
+            if previous_info == info and os.path.getsize(part) <= src_stat.st_size:
+                offset = os.path.getsize(part)
+        if not offset:
+            with open(part_info, "w") as f:
+                json.dump(info, f)
+
+        f_src = open(src, "rb") if not self.ssh else self.sftp.open(src, "rb")
+        with f_src, open(part, "ab" if offset else "wb") as f_out:
+            f_src.seek(offset)
+            for chunk in iter(lambda: f_src.read(COPY_CHUNK_SIZE), b""):
+                f_out.write(chunk)
+                if limiter is not None:
+                    limiter.consume(len(chunk))
+
+        error = None
+        if os.path.getsize(part) != src_stat.st_size:
+            error = "Size of the copy of {} does not match the source".format(src)
+        elif entry and MANIFEST_CHECKSUM in entry and entry["size"] == src_stat.st_size and \
+                abs(entry["mtime"] - src_stat.st_mtime) < 1 and \
+                get_checksum(part, MANIFEST_CHECKSUM) != entry[MANIFEST_CHECKSUM]:
+            error = "Checksum of the copy of {} does not match the manifest".format(src)
+        if error:
+            os.remove(part)
+            os.remove(part_info)
+            raise IOError(error)
+        os.utime(part, (src_stat.st_atime, src_stat.st_mtime))
+        os.replace(part, dest)
+        os.remove(part_info)
+        return src_stat.st_size - offset
+
+    def stat(self, path):
+        """
+        os.stat() on either the local or remote filesystem. The remote attributes are cached,
+        and taken from the cached listing of the parent directory if any.
+        """
+        if not self.ssh:
+            return os.stat(path)
+        key = posixpath.normpath(path)
+        if key in self._stat_cache:
+            return self._stat_cache[key]
+        parent, name = posixpath.split(key)
+        if parent in self._listdir_cache and \
+                not any(a.filename == name for a in self._listdir_cache[parent]):
+            raise FileNotFoundError(errno.ENOENT, "No such file", path)
+        try:
+            self._stat_cache[key] = self.sftp.stat(path)
+        except IOError as exc:
+            raise _remote_error(exc, path)
+        return self._stat_cache[key]
+
+    def stat_many(self, paths):
+        """
+        Get the attributes of many files, with one listing per parent directory for remote
+        files instead of one request per file.
+
+        Args:
+            paths ([str]): full paths of the files
+
+        Returns:
+            (dict) the os.stat_result or SFTPAttributes of each path, None if it does not
+                exist
+        """
+        if self.ssh:
+            for parent in set(posixpath.dirname(posixpath.normpath(p)) for p in paths):
+                try:
+                    self.listdir_attr(parent)
+                except OSError:
+                    # the files are then stat'ed one by one
+                    pass
+        stats = {}
+        for p in paths:
+            try:
+                stats[p] = self.stat(p)
+            except FileNotFoundError:
+                stats[p] = None
+        return stats
+
+    @staticmethod
+    def isdir(sftp, path):
+        """
+        os.path.isdir() for paramiko's SFTP object
+        """
+        try:
+            return stat.S_ISDIR(sftp.stat(path).st_mode)
+        except IOError:
+            return False
+
+    def copy_decompressed(self, src, dest, limiter=None):
+        """
+        Decompress a gzipped file while copying it, without copying the compressed file first.
+
+        Args:
+            src (str): source full path of the gzipped file
+            dest (str): destination file full path
+            limiter (BandwidthLimiter): limits the bandwidth of the copy
+
+        Returns:
+            (int) number of bytes read from the source
+        """
+        unlink_staged(dest)
+        f_src = open(src, "rb") if not self.ssh else self.sftp.open(src, "rb")
+        with f_src, gzip.GzipFile(fileobj=f_src, mode="rb") as f_in, open(dest, "wb") as f_out:
+            if self.ssh:
+                f_src.prefetch()
+            for chunk in iter(lambda: f_in.read(COPY_CHUNK_SIZE), b""):
+                f_out.write(chunk)
+                if limiter is not None:
+                    limiter.consume(len(chunk))
+            return f_src.tell()
+
+    def copy_many(self, files, nthreads=COPY_THREADS, max_bandwidth=None, callback=None,
+                  continue_on_missing=False, mode="copy", decompress=False, resume=False,
+                  manifest=None, staging_files=STAGING_FILES):
+        """
+        Copy files concurrently, on a thread pool.
+
+        Args:
+            files ([(str, str)]): (source, destination) full paths of the files to copy
+            nthreads (int): number of concurrent copies
+            max_bandwidth (float): maximum total bandwidth of the copies, in MB/s
+            callback (callable): function of the source and destination paths called in the
+                worker thread when a file is copied
+            continue_on_missing (bool): whether to skip the missing files instead of raising
+                FileNotFoundError
+            mode (str): staging mode of the local files, one of STAGING_MODES
+            staging_files ([str]): file name patterns of the files staged with mode, with or
+                without a .gz extension. The other files are copied. All the files are
+                staged with mode if None.
+            decompress (bool): whether to decompress the gzipped sources (.gz or .GZ) while
+                copying them. The destination paths are those of the decompressed files.
+                The decompressed files are always written in full, whatever the mode: only
+                the sources left uncompressed (see gzip_dir) or copied without decompress
+                are staged with links.
+            resume (bool): whether to copy the files with copy_resumable, creating the
+                destination directories
+            manifest (dict): manifest entries of the sources, by source path, against which
+                the resumable copies are checked
+
+        Returns:
+            (dict) the number of files and bytes copied, the time taken and the throughput in
+                MB/s
+        """
+        limiter = BandwidthLimiter(max_bandwidth * 1e6) if max_bandwidth else None
+
+        def copy(paths):
+            src, dest = paths
+            try:
+                if decompress and src.endswith((".gz", ".GZ")):
+                    nbytes = self.copy_decompressed(src, dest, limiter)
+                elif resume:
+                    os.makedirs(os.path.dirname(dest), exist_ok=True)
+                    nbytes = self.copy_resumable(src, dest, limiter,
+                                                 (manifest or {}).get(src))
+                else:
+                    nbytes = self.copy(src, dest, limiter,
+                                       mode if is_staged(dest, staging_files) else "copy")
+            except FileNotFoundError:
+                if continue_on_missing:
+                    return 0, 0
+                raise
+            if callback is not None:
+                callback(src, dest)
+            return 1, nbytes
+
+        t0 = time.time()
+        nthreads = max(1, min(nthreads or 1, len(files)))
+        if nthreads > 1:
+            with ThreadPoolExecutor(nthreads) as executor:
+                results = list(executor.map(copy, files))
+        else:
+            results = [copy(paths) for paths in files]
+        t = time.time() - t0
+
+        stats = {"n_files": sum(r[0] for r in results), "bytes": sum(r[1] for r in results),
+                 "time": t}
+        stats["throughput"] = stats["bytes"] / 1e6 / t if t else 0.
+        logger.info("Copied {n_files} files ({mb:.1f} MB) in {time:.2f} s: "
+                    "{throughput:.1f} MB/s".format(mb=stats["bytes"] / 1e6, **stats))
+        return stats
 
     def abspath(self, path):
         """
@@ -130,12 +526,19 @@ class FileClient(object):
         if not self.ssh:
             return os.path.abspath(path)
 
-        else:
+        elif "$" in path:
+            # environment variables are only expanded by the remote shell
             command = ". ./.bashrc; readlink -f {}".format(path)
             stdin, stdout, stderr = self.ssh.exec_command(command)
             full_path = [l.split('\n')[0] for l in stdout]
             return full_path[0]
 
+        else:
+            # the SFTP session starts in the home directory
+            if path == "~" or path.startswith("~/"):
+                path = path[2:] or "."
+            return self.sftp.normalize(path)
+
     def glob(self, path):
         """
         return the glob
@@ -145,7 +548,290 @@ class FileClient(object):
         """
         if not self.ssh:
             return glob.glob(path)
-        else:
-            command = ". ./.bashrc; for i in $(ls {}); do readlink -f $i; done".format(path)
-            stdin, stdout, stderr = self.ssh.exec_command(command)
-            return [l.split('\n')[0] for l in stdout]
+        if not _has_magic(path):
+            return [path] if self.stat_many([path])[path] is not None else []
+
+        dirname, basename = posixpath.split(path)
+        dirs = self.glob(dirname) if _has_magic(dirname) else [dirname]
+        paths = []
+        for d in dirs:
+            try:
+                names = self.listdir(d or ".")
+            except OSError:
+                # as glob, the paths that are not readable directories are ignored
+                continue
+            # as glob, the wildcards do not match the hidden files
+            if not basename.startswith("."):
+                names = [n for n in names if not n.startswith(".")]
+            paths.extend(posixpath.join(d, n) for n in sorted(fnmatch.filter(names, basename)))
+        return paths
+
+
+def _has_magic(path):
+    return any(c in path for c in "*?[")
+
+
+def _remote_error(exc, path):
+    """
+    Convert the IOError of a missing remote file to FileNotFoundError.
+    """
+    if exc.errno == errno.ENOENT and not isinstance(exc, FileNotFoundError):
+        return FileNotFoundError(errno.ENOENT, str(exc), path)
+    return exc
+
+
+def unlink_staged(path):
+    """
+    Remove a file staged with a symlink or hard link, so that writing a copy in its place
+    does not modify the file it is linked to.
+
+    Args:
+        path (str): local path of the file
+    """
+    if os.path.islink(path) or (os.path.isfile(path) and os.stat(path).st_nlink > 1):
+        os.remove(path)
+
+
+def is_staged(path, staging_files=STAGING_FILES):
+    """
+    Whether a file is staged with the links rather than copied.
+
+    Args:
+        path (str): path of the file
+        staging_files ([str]): file name patterns of the staged files, with or without a .gz
+            extension. All the files are staged if None.
+
+    Returns:
+        (bool)
+    """
+    if staging_files is None:
+        return True
+    name = os.path.basename(path)
+    if name.endswith((".gz", ".GZ")):
+        name = name[:-3]
+    return any(fnmatch.fnmatch(name, pattern) for pattern in staging_files)
+
+
+def stage_file(src, dest, mode):
+    """
+    Hard link, clone or symlink a local file.
+
+    Hard links and symlinks share the data with the source, so that writing the staged file
+    in place also modifies the source: use them for the files only read, e.g. a WAVECAR or
+    CHGCAR used as a starting point that is not written again. Clones (reflinks) are
+    copy-on-write and safe.
+
+    Args:
+        src (str): source full path
+        dest (str): destination file full path
+        mode (str): "hardlink", "reflink" or "symlink"
+
+    Returns:
+        (bool) whether the file was staged, False if the filesystem does not support the mode
+    """
+    if mode not in STAGING_MODES:
+        raise ValueError("Unknown staging mode: {}. Use one of {}".format(mode, STAGING_MODES))
+    if not os.path.exists(src):
+        raise FileNotFoundError(src)
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        if mode == "hardlink":
+            os.link(src, dest)
+        elif mode == "symlink":
+            os.symlink(os.path.abspath(src), dest)
+        elif mode == "reflink":
+            import fcntl
+            try:
+                with open(src, "rb") as f_in, open(dest, "wb") as f_out:
+                    fcntl.ioctl(f_out.fileno(), FICLONE, f_in.fileno())
+            except OSError:
+                os.remove(dest)
+                raise
+            shutil.copystat(src, dest)
+    except (OSError, ImportError, NotImplementedError) as exc:
+        logger.debug("Cannot {} {}, copying it instead: {}".format(mode, src, exc))
+        return False
+    return True
+
+
+def get_manifest(path, checksum=MANIFEST_CHECKSUM):
+    """
+    Get the manifest of a local directory: the size, modification time and checksum of all
+    its files, recursively.
+
+    Args:
+        path (str): path of the directory
+        checksum (str): hashlib algorithm of the checksums, or None for no checksums
+
+    Returns:
+        ([dict]) the "file" path relative to the directory, "size", "mtime" and checksum of
+            each file
+    """
+    manifest = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for f in sorted(files):
+            full_path = os.path.join(root, f)
+            st = os.stat(full_path)
+            entry = {"file": os.path.relpath(full_path, path), "size": st.st_size,
+                     "mtime": st.st_mtime}
+            if checksum:
+                entry[checksum] = get_checksum(full_path, checksum)
+            manifest.append(entry)
+    return manifest
+
+
+def get_checksum(path, checksum=MANIFEST_CHECKSUM):
+    """
+    Get the hex digest of a local file.
+    """
+    h = hashlib.new(checksum)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def is_synced(path, entry, checksum=MANIFEST_CHECKSUM):
+    """
+    Whether a local file is identical to a file of a manifest: same size and either the
+    same modification time or the same checksum, if in the manifest.
+
+    Args:
+        path (str): path of the local file
+        entry (dict): manifest entry of the file, with at least the "size" and "mtime"
+        checksum (str): hashlib algorithm of the checksums
+
+    Returns:
+        bool
+    """
+    if not os.path.isfile(path):
+        return False
+    st = os.stat(path)
+    if st.st_size != entry["size"]:
+        return False
+    # the remote modification times are in seconds
+    if abs(st.st_mtime - entry["mtime"]) < 1:
+        return True
+    return checksum in entry and get_checksum(path, checksum) == entry[checksum]
+
+
+def gzip_dir(path, compresslevel=6, nthreads=GZIP_THREADS, block_size=GZIP_BLOCK_SIZE,
+             exclude=None):
+    """
+    Gzip all the files of a directory (not recursive) and remove the original files, as
+    monty.shutil.gzip_dir but compressing on a thread pool. See gzip_files.
+
+    Args:
+        path (str): path of the directory
+        compresslevel (int): level of compression, from 1 to 9
+        nthreads (int): number of compression threads
+        block_size (int): size of the blocks compressed concurrently, in bytes
+        exclude ([str]): file name patterns of the files left uncompressed, e.g.
+            STAGING_FILES so that the next calculation can stage them with links
+
+    Returns:
+        (dict) the number of files, the bytes read and written and the time taken
+    """
+    files = [os.path.join(path, f) for f in os.listdir(path)
+             if os.path.isfile(os.path.join(path, f)) and not f.lower().endswith("gz")
+             and not any(fnmatch.fnmatch(f, pattern) for pattern in exclude or [])]
+    return gzip_files(files, compresslevel=compresslevel, nthreads=nthreads,
+                      block_size=block_size)
+
+
+def gzip_files(files, compresslevel=6, nthreads=GZIP_THREADS, block_size=GZIP_BLOCK_SIZE):
+    """
+    Gzip files to "<file>.gz" and remove the original files.
+
+    The files are split in blocks compressed concurrently as separate gzip members, so that
+    both the small files and the blocks of the large ones (e.g. CHGCAR or WAVECAR) are
+    compressed in parallel. The concatenated members are a standard gzip file, which gunzip,
+    the gzip module and zopen read as a whole. Only a few blocks per thread are held in
+    memory.
+
+    Args:
+        files ([str]): paths of the files
+        compresslevel (int): level of compression, from 1 to 9
+        nthreads (int): number of compression threads
+        block_size (int): size of the blocks compressed concurrently, in bytes
+
+    Returns:
+        (dict) the number of files, the bytes read and written and the time taken
+    """
+    t0 = time.time()
+    nthreads = max(1, nthreads or 1)
+    stats = {"n_files": 0, "bytes_in": 0, "bytes_out": 0}
+    # (file, compressed block future) in the order of the output, None marking the end of a file
+    pending = deque()
+    out = []
+
+    def write_next():
+        f, future = pending.popleft()
+        if not out:
+            out.append(open(f + ".gz", "wb"))
+        try:
+            if future is not None:
+                stats["bytes_out"] += out[0].write(future.result())
+                return
+            out.pop().close()
+        except Exception:
+            out.pop().close()
+            os.remove(f + ".gz")
+            raise
+        shutil.copystat(f, f + ".gz")
+        os.remove(f)
+        stats["n_files"] += 1
+
+    with ThreadPoolExecutor(nthreads) as executor:
+        for f in files:
+            with open(f, "rb") as f_in:
+                for block in iter(lambda: f_in.read(block_size), b""):
+                    stats["bytes_in"] += len(block)
+                    pending.append((f, executor.submit(gzip.compress, block, compresslevel)))
+                    while len(pending) > 2 * nthreads:
+                        write_next()
+                if not f_in.tell():
+                    # an empty file is a gzip member without data
+                    pending.append((f, executor.submit(gzip.compress, b"", compresslevel)))
+            pending.append((f, None))
+        while pending:
+            write_next()
+
+    stats["time"] = time.time() - t0
+    logger.info("Gzipped {n_files} files ({mb:.1f} MB) in {time:.2f} s".format(
+        mb=stats["bytes_in"] / 1e6, **stats))
+    return stats
+
+
+class BandwidthLimiter(object):
+    """
+    Token bucket limiting the total bandwidth of concurrent transfers.
+    """
+
+    def __init__(self, bytes_per_second, burst=None):
+        """
+        Args:
+            bytes_per_second (float): maximum bandwidth
+            burst (float): number of bytes that can be transferred at once. Defaults to a
+                tenth of a second of transfer.
+        """
+        self.rate = float(bytes_per_second)
+        self.burst = burst or max(self.rate / 10, COPY_CHUNK_SIZE)
+        self._tokens = self.burst
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes):
+        """
+        Wait until nbytes can be transferred.
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= nbytes
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
@@ -0,0 +1,49 @@
+# coding: utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from atomate.utils.database import GridFSCache
+
+
+class GridFSCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_memory_cache(self):
+        cache = GridFSCache(memory_size=2)
+        obj = {"a": 1}
+        cache.put("id1", obj)
+        self.assertIs(cache.get("id1"), obj)
+        cache.put("id2", 2)
+        cache.get("id1")
+        cache.put("id3", 3)  # evicts the least recently used, id2
+        self.assertIsNone(cache.get("id2"))
+        self.assertEqual(cache.get("id1"), {"a": 1})
+        cache.invalidate(["id1"])
+        self.assertIsNone(cache.get("id1"))
+
+    def test_disk_cache(self):
+        cache = GridFSCache(self.cache_dir, max_size=2500, memory_size=0)
+        cache.put("id1", b"1" * 1000)
+        cache.put("id2", b"2" * 1000)
+        os.utime(os.path.join(self.cache_dir, "id2.pickle"), (0, 0))
+        self.assertEqual(cache.get("id1"), b"1" * 1000)
+        cache.put("id3", b"3" * 1000)  # evicts id2, the least recently used
+        self.assertIsNone(cache.get("id2"))
+        self.assertEqual(cache.get("id3"), b"3" * 1000)
+
+        # the on-disk cache is shared between instances
+        self.assertEqual(GridFSCache(self.cache_dir).get("id1"), b"1" * 1000)
+        cache.clear()
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
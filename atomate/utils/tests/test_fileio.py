@@ -0,0 +1,372 @@
+# coding: utf-8
+
+import errno
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+from collections import Counter
+from unittest import mock
+
+from atomate.utils import fileio
+from atomate.utils.fileio import FileClient, BandwidthLimiter, stage_file, gzip_dir, \
+    get_manifest, STAGING_FILES
+
+
+class FileClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch_dir = tempfile.mkdtemp()
+        self.from_dir = os.path.join(self.scratch_dir, "from")
+        self.to_dir = os.path.join(self.scratch_dir, "to")
+        os.makedirs(self.from_dir)
+        os.makedirs(self.to_dir)
+        for i in range(5):
+            with open(os.path.join(self.from_dir, "f{}".format(i)), "wb") as f:
+                f.write(os.urandom(10000))
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch_dir)
+
+    def test_copy_many(self):
+        files = [(os.path.join(self.from_dir, "f{}".format(i)),
+                  os.path.join(self.to_dir, "f{}".format(i))) for i in range(5)]
+        copied = []
+        stats = FileClient().copy_many(files, nthreads=3,
+                                       callback=lambda src, dest: copied.append(dest))
+        self.assertEqual(stats["n_files"], 5)
+        self.assertEqual(stats["bytes"], 50000)
+        self.assertEqual(sorted(copied), sorted(f[1] for f in files))
+        for src, dest in files:
+            with open(src, "rb") as f1, open(dest, "rb") as f2:
+                self.assertEqual(f1.read(), f2.read())
+
+        missing = [(os.path.join(self.from_dir, "missing"), os.path.join(self.to_dir, "missing"))]
+        self.assertRaises(FileNotFoundError, FileClient().copy_many, files[:1] + missing)
+        stats = FileClient().copy_many(files[:1] + missing, continue_on_missing=True,
+                                       max_bandwidth=100)
+        self.assertEqual(stats["n_files"], 1)
+
+    def test_stat_many(self):
+        fc = FileClient()
+        paths = [os.path.join(self.from_dir, "f0"), os.path.join(self.from_dir, "missing")]
+        stats = fc.stat_many(paths)
+        self.assertEqual(stats[paths[0]].st_size, 10000)
+        self.assertIsNone(stats[paths[1]])
+        self.assertEqual(sorted(fc.glob(os.path.join(self.from_dir, "f[0-1]"))), paths[:1] +
+                         [os.path.join(self.from_dir, "f1")])
+        walk = list(fc.walk(self.scratch_dir))
+        self.assertEqual(sorted(walk[0][1]), ["from", "to"])
+
+    def test_copy_resumable(self):
+        fc = FileClient()
+        src = os.path.join(self.from_dir, "f0")
+        dest = os.path.join(self.to_dir, "f0")
+        with open(src, "rb") as f:
+            data = f.read()
+
+        # an interrupted copy of the same source is resumed
+        fc.copy_resumable(src, dest)
+        shutil.move(dest, dest + ".part")
+        with open(dest + ".part", "r+b") as f:
+            f.truncate(4000)
+        with open(dest + ".part.json", "w") as f:
+            json.dump({"src": src, "size": 10000, "mtime": os.stat(src).st_mtime}, f)
+        self.assertEqual(fc.copy_resumable(src, dest), 6000)
+        with open(dest, "rb") as f:
+            self.assertEqual(f.read(), data)
+        self.assertFalse(os.path.exists(dest + ".part.json"))
+
+        # a stale .part of another source is started over
+        with open(dest + ".part", "wb") as f:
+            f.write(b"B" * 500)
+        self.assertEqual(fc.copy_resumable(src, dest), 10000)
+        with open(dest, "rb") as f:
+            self.assertEqual(f.read(), data)
+
+        # the copy is checked against the checksum of the manifest
+        entry = get_manifest(self.from_dir)[0]
+        self.assertEqual(fc.copy_many([(src, dest)], resume=True, manifest={src: entry})["bytes"],
+                         10000)
+        entry["md5"] = "0" * 32
+        self.assertRaises(IOError, fc.copy_resumable, src, dest, entry=entry)
+        self.assertFalse(os.path.exists(dest + ".part"))
+
+    def test_stage_file(self):
+        src = os.path.join(self.from_dir, "f0")
+        dest = os.path.join(self.to_dir, "f0")
+        self.assertTrue(stage_file(src, dest, "hardlink"))
+        self.assertTrue(os.path.samefile(src, dest))
+        self.assertTrue(stage_file(src, dest, "symlink"))
+        self.assertEqual(os.readlink(dest), src)
+        self.assertRaises(ValueError, stage_file, src, dest, "move")
+
+        # only the staging_files are linked by copy_many
+        FileClient().copy_many([(src, dest), (src, os.path.join(self.to_dir, "WAVECAR.gz"))],
+                               mode="symlink", staging_files=["WAVECAR"])
+        self.assertFalse(os.path.islink(dest))
+        self.assertTrue(os.path.islink(os.path.join(self.to_dir, "WAVECAR.gz")))
+
+        # the copies are used as a fallback
+        FileClient().copy(src, dest, mode="reflink")
+        self.assertFalse(os.path.islink(dest))
+        with open(src, "rb") as f1, open(dest, "rb") as f2:
+            self.assertEqual(f1.read(), f2.read())
+
+    def test_copy_decompressed(self):
+        src = os.path.join(self.from_dir, "f0.gz")
+        with gzip.open(src, "wb") as f:
+            f.write(b"data" * 1000)
+        stats = FileClient().copy_many([(src, os.path.join(self.to_dir, "f0"))],
+                                       decompress=True)
+        self.assertEqual(stats["bytes"], os.path.getsize(src))
+        with open(os.path.join(self.to_dir, "f0"), "rb") as f:
+            self.assertEqual(f.read(), b"data" * 1000)
+
+    def test_gzip_dir(self):
+        data = {}
+        for i in range(5):
+            with open(os.path.join(self.from_dir, "f{}".format(i)), "rb") as f:
+                data["f{}.gz".format(i)] = f.read()
+        open(os.path.join(self.from_dir, "empty"), "w").close()
+        data["empty.gz"] = b""
+        stats = gzip_dir(self.from_dir, nthreads=3, block_size=3000)
+        self.assertEqual(stats["n_files"], 6)
+        self.assertEqual(sorted(os.listdir(self.from_dir)), sorted(data))
+        # the blocks are concatenated gzip members, read as a whole
+        for f, d in data.items():
+            with gzip.open(os.path.join(self.from_dir, f), "rb") as f_in:
+                self.assertEqual(f_in.read(), d)
+
+        # the excluded files are left uncompressed, e.g. to be staged with links
+        for f in ["WAVECAR", "CHGCAR", "OUTCAR"]:
+            with open(os.path.join(self.to_dir, f), "w") as f_out:
+                f_out.write(f)
+        self.assertEqual(gzip_dir(self.to_dir, exclude=STAGING_FILES)["n_files"], 1)
+        self.assertEqual(sorted(os.listdir(self.to_dir)), ["CHGCAR", "OUTCAR.gz", "WAVECAR"])
+
+    def test_bandwidth_limiter(self):
+        limiter = BandwidthLimiter(1e6, burst=1e5)
+        t0 = time.time()
+        for _ in range(4):
+            limiter.consume(1e5)
+        # the burst is available at once, the rest at 1 MB/s
+        self.assertGreater(time.time() - t0, 0.25)
+
+
+class FakeSFTPClient(object):
+    """
+    SFTP session on a local directory, the "home" of the remote user, counting the requests.
+    """
+
+    def __init__(self, home, requests):
+        self.home = home
+        self.requests = requests
+
+    def _request(self, name, path):
+        self.requests[name] += 1
+        if not os.path.lexists(path):
+            raise IOError(errno.ENOENT, "No such file")
+
+    @staticmethod
+    def _attrs(path, filename=None):
+        st = os.lstat(path)
+        return types.SimpleNamespace(filename=filename, st_mode=st.st_mode, st_size=st.st_size,
+                                     st_mtime=st.st_mtime, st_atime=st.st_atime)
+
+    def listdir_attr(self, path):
+        self._request("listdir_attr", path)
+        return [self._attrs(os.path.join(path, f), f) for f in os.listdir(path)]
+
+    def stat(self, path):
+        self._request("stat", path)
+        return self._attrs(path)
+
+    def get(self, src, dest, callback=None):
+        self._request("get", src)
+        size = os.path.getsize(src)
+        with open(src, "rb") as f_in, open(dest, "wb") as f_out:
+            for chunk in iter(lambda: f_in.read(3000), b""):
+                f_out.write(chunk)
+                if callback:
+                    callback(f_out.tell(), size)
+
+    def open(self, path, mode="r"):
+        self._request("open", path)
+        f = open(path, mode)
+        f.prefetch = lambda: None
+        return f
+
+    def normalize(self, path):
+        self.requests["normalize"] += 1
+        return os.path.normpath(os.path.join(self.home, path))
+
+
+class FakeSSHClient(object):
+
+    def __init__(self, home, requests):
+        self.home = home
+        self.requests = requests
+        self.sftp_sessions = []
+        self.transport = mock.Mock()
+        self.transport.is_active.return_value = True
+
+    def set_missing_host_key_policy(self, policy):
+        pass
+
+    def connect(self, host, username=None, key_filename=None):
+        self.requests["connect"] += 1
+
+    def get_transport(self):
+        return self.transport
+
+    def open_sftp(self):
+        sftp = FakeSFTPClient(self.home, self.requests)
+        self.sftp_sessions.append((threading.current_thread(), sftp))
+        return sftp
+
+
+class RemoteFileClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        self.from_dir = os.path.join(self.home, "from")
+        self.to_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.from_dir, "sub"))
+        for i in range(5):
+            with open(os.path.join(self.from_dir, "f{}".format(i)), "wb") as f:
+                f.write(os.urandom(10000))
+        open(os.path.join(self.from_dir, ".hidden"), "w").close()
+        open(os.path.join(self.from_dir, "sub", "f5"), "w").close()
+        self.private_key = os.path.join(self.home, "id_rsa")
+        open(self.private_key, "w").close()
+
+        self.requests = Counter()
+        self.clients = []
+
+        def ssh_client():
+            self.clients.append(FakeSSHClient(self.home, self.requests))
+            return self.clients[-1]
+
+        paramiko = types.ModuleType("paramiko")
+        paramiko.SSHClient = ssh_client
+        paramiko.AutoAddPolicy = mock.Mock
+        patches = [mock.patch.dict(sys.modules, {"paramiko": paramiko}),
+                   mock.patch.dict(fileio._ssh_connections, clear=True)]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.home)
+        shutil.rmtree(self.to_dir)
+
+    def get_client(self, filesystem="user@host", private_key=None):
+        return FileClient(filesystem, private_key=private_key or self.private_key)
+
+    def test_ssh_connections(self):
+        fc = self.get_client()
+        # the connections are shared by username, host and private key
+        self.assertIs(self.get_client().ssh, fc.ssh)
+        other_key = os.path.join(self.home, "other_key")
+        open(other_key, "w").close()
+        self.assertIsNot(self.get_client(private_key=other_key).ssh, fc.ssh)
+        self.assertIsNot(self.get_client("other@host").ssh, fc.ssh)
+        self.assertEqual(self.requests["connect"], 3)
+        # inactive connections are replaced
+        fc.ssh.transport.is_active.return_value = False
+        self.assertIsNot(self.get_client().ssh, fc.ssh)
+        self.assertRaises(ValueError, self.get_client, private_key="/missing_key")
+
+    def test_sftp_sessions(self):
+        fc = self.get_client()
+        self.assertIs(fc.sftp, fc.sftp)
+        files = [(os.path.join(self.from_dir, "f{}".format(i)),
+                  os.path.join(self.to_dir, "f{}".format(i))) for i in range(5)]
+        stats = fc.copy_many(files, nthreads=3)
+        self.assertEqual(stats["bytes"], 50000)
+        for src, dest in files:
+            with open(src, "rb") as f1, open(dest, "rb") as f2:
+                self.assertEqual(f1.read(), f2.read())
+        # one SFTP session per thread
+        threads = [t for t, _ in fc.ssh.sftp_sessions]
+        self.assertEqual(len(threads), len(set(threads)))
+        self.assertLessEqual(len(threads), 4)
+        self.assertEqual(self.requests["get"], 5)
+
+    def test_bandwidth(self):
+        limiter = mock.Mock()
+        fc = self.get_client()
+        self.assertEqual(fc.copy(os.path.join(self.from_dir, "f0"),
+                                 os.path.join(self.to_dir, "f0"), limiter), 10000)
+        # the progress callbacks of the SFTP get are consumed as increments
+        consumed = [c[0][0] for c in limiter.consume.call_args_list]
+        self.assertEqual(sum(consumed), 10000)
+        self.assertEqual(len(consumed), 4)
+
+    def test_stat_cache(self):
+        fc = self.get_client()
+        paths = [os.path.join(self.from_dir, "f{}".format(i)) for i in range(5)]
+        stats = fc.stat_many(paths + [os.path.join(self.from_dir, "missing")])
+        self.assertEqual([stats[p].st_size for p in paths], [10000] * 5)
+        self.assertIsNone(stats[os.path.join(self.from_dir, "missing")])
+        # a single listing of the directory, the entries are stat'ed from it
+        self.assertEqual(self.requests, {"connect": 1, "listdir_attr": 1})
+        self.assertEqual(fc.stat(paths[0] + "/").st_size, 10000)
+        self.assertEqual(sorted(fc.listdir(self.from_dir)),
+                         [".hidden", "f0", "f1", "f2", "f3", "f4", "sub"])
+        self.assertRaises(FileNotFoundError, fc.stat, os.path.join(self.from_dir, "f5"))
+        self.assertEqual(self.requests, {"connect": 1, "listdir_attr": 1})
+
+        # the files of other directories are stat'ed one by one
+        self.assertRaises(FileNotFoundError, fc.stat, os.path.join(self.home, "missing"))
+        self.assertRaises(FileNotFoundError, fc.listdir, os.path.join(self.home, "missing"))
+        self.assertEqual(self.requests["stat"], 1)
+        fc.clear_cache()
+        fc.stat(paths[0])
+        self.assertEqual(self.requests["stat"], 2)
+
+    def test_glob_walk(self):
+        fc = self.get_client()
+        self.assertEqual(fc.glob(os.path.join(self.from_dir, "f[0-1]")),
+                         [os.path.join(self.from_dir, "f0"), os.path.join(self.from_dir, "f1")])
+        # the paths that are not directories, e.g. the private key, are ignored
+        self.assertEqual(fc.glob(os.path.join(self.home, "*", "*", "f5")),
+                         [os.path.join(self.from_dir, "sub", "f5")])
+        # as glob, the wildcards do not match the hidden files, and a path without wildcards
+        # is returned if it exists
+        self.assertEqual(fc.glob(os.path.join(self.from_dir, "*hidden")), [])
+        self.assertEqual(fc.glob(os.path.join(self.from_dir, ".h*")),
+                         [os.path.join(self.from_dir, ".hidden")])
+        self.assertEqual(fc.glob(os.path.join(self.from_dir, "f0")),
+                         [os.path.join(self.from_dir, "f0")])
+        self.assertEqual(fc.glob(os.path.join(self.from_dir, "missing")), [])
+
+        walk = list(fc.walk(self.from_dir))
+        self.assertEqual([(d, sorted(dirs), sorted(files)) for d, dirs, files in walk],
+                         [(self.from_dir, ["sub"], [".hidden", "f0", "f1", "f2", "f3", "f4"]),
+                          (os.path.join(self.from_dir, "sub"), [], ["f5"])])
+        manifest = fc.get_manifest(self.from_dir)
+        self.assertEqual(sorted(e["file"] for e in manifest),
+                         [".hidden", "f0", "f1", "f2", "f3", "f4", "sub/f5"])
+        # one listing per directory, no request per file
+        self.assertEqual(self.requests, {"connect": 1, "listdir_attr": 3})
+        self.assertRaises(NotADirectoryError, fc.get_manifest, os.path.join(self.from_dir, "f0"))
+
+    def test_abspath(self):
+        fc = self.get_client()
+        # the paths are resolved by the SFTP server, relative to the home directory
+        self.assertEqual(fc.abspath("~/from/sub/.."), self.from_dir)
+        self.assertEqual(fc.abspath("from"), self.from_dir)
+        self.assertEqual(fc.abspath(self.from_dir), self.from_dir)
+        self.assertEqual(self.requests, {"connect": 1, "normalize": 3})
+
+
+if __name__ == "__main__":
+    unittest.main()
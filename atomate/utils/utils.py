@@ -5,6 +5,7 @@ import logging
 import os
 import sys
 import socket
+from functools import lru_cache
 from random import randint
 from time import time
 
@@ -326,11 +327,18 @@ def get_uri(dir_name):
         Full URI path, e.g., fileserver.host.com:/full/path/of/dir_name.
     """
     fullpath = os.path.abspath(dir_name)
+    return "{}:{}".format(get_hostname(), fullpath)
+
+
+@lru_cache(maxsize=1)
+def get_hostname():
+    """
+    Returns the fully qualified name of the host, resolved only once per process.
+    """
     try:
-        hostname = socket.gethostbyaddr(socket.gethostname())[0]
+        return socket.gethostbyaddr(socket.gethostname())[0]
     except:
-        hostname = socket.gethostname()
-    return "{}:{}".format(hostname, fullpath)
+        return socket.gethostname()
 
 
 def get_database(config_file=None, settings=None, admin=False, **kwargs):
@@ -1,7 +1,7 @@
 
-from tqdm import tqdm
 import math
 from atomate.utils.utils import get_logger, get_database
+from atomate.vasp.builders.base import AbstractBuilder
 
 logger = get_logger(__name__)
 
@@ -18,8 +18,8 @@ for gaps approximately ~2 eV and higher. Smaller gaps are less accurate. Prelimi
 """
 
 
-class BandgapEstimationBuilder:
-    def __init__(self, materials_write):
+class BandgapEstimationBuilder(AbstractBuilder):
+    def __init__(self, materials_write, update_all=False, nproc=1):
         """
         Starting with an existing materials collection with dielectric constant data, adds
         estimated band gaps that may be more accurate than typical GGA calculations.
@@ -28,36 +28,29 @@ class BandgapEstimationBuilder:
 
         Args:
             materials_write: mongodb collection for materials (write access needed)
+            update_all: (bool) - if true, updates all docs. If false, only updates the docs
+                whose dielectric averages were updated by the DielectricBuilder since the last
+                run and those without the estimation
+            nproc: (int) number of processes
         """
         self._materials = materials_write
+        self.update_all = update_all
+        self.nproc = nproc
 
     def run(self):
         logger.info("{} starting...".format(self.__class__.__name__))
-        q = {"dielectric.epsilon_static_avg": {"$gt": 0}, "bandgap_estimation": {"$exists": False}}
-
-        for m in tqdm(self._materials.find(q, projection=["material_id", "dielectric"])):
-            try:
-                eps = m["dielectric"]["epsilon_static_avg"]  # electronic portion of eps ("eps_static") approximates eps_inf
-                n = math.sqrt(eps)  # sqrt(eps_inf) to get refractive index
-                d = {}
-                d["gap_moss"] = (95 / n**4) if n > 0 else None
-                d["gap_gupta-ravindra"] = (4.16-n)/0.85 if n <= 4.16 else None
-                d["gap_reddy-anjaneyulu"] = 36.3/math.exp(n)
-                d["gap_reddy-ahamed"] = 154/n**4+0.365 if n > 0 else None
-                d["gap_herve_vandamme"] = 13.47/math.sqrt(n**2-1)-3.47 if n > 1 else None
-
-                d = {"bandgap_estimation": d}
-                self._materials.update_one({"material_id": m["material_id"]}, {"$set": d})
-
-            except:
-                import traceback
-                logger.exception(traceback.format_exc())
-
+        q = {"dielectric.epsilon_static_avg": {"$gt": 0}}
+        self.process_documents(self._materials, q, get_bandgap_estimation,
+                               projection=["material_id", "dielectric"], key="material_id",
+                               watermark_field="_dielectricbuilder.updated_at",
+                               missing_field="bandgap_estimation",
+                               update_all=self.update_all, nproc=self.nproc)
         logger.info("{} finished.".format(self.__class__.__name__))
 
     def reset(self):
         logger.info("Resetting {} starting!".format(self.__class__.__name__))
         self._materials.update_many({}, {"$unset": {"bandgap_estimation": 1}})
+        self.reset_watermark(self._materials)
         logger.info("Resetting {} finished!".format(self.__class__.__name__))
 
     @staticmethod
@@ -74,4 +67,25 @@ class BandgapEstimationBuilder:
             BandgapEstimationBuilder
         """
         db_write = get_database(db_file, admin=True)
-        return BandgapEstimationBuilder(db_write[m], **kwargs)
\ No newline at end of file
+        return BandgapEstimationBuilder(db_write[m], **kwargs)
+
+
+def get_bandgap_estimation(m):
+    """
+    Get the band gaps estimated from the dielectric constant of a material.
+
+    Args:
+        m (dict): material document with the "dielectric.epsilon_static_avg" key
+
+    Returns:
+        (dict) the fields to set in the material document
+    """
+    eps = m["dielectric"]["epsilon_static_avg"]  # electronic portion of eps ("eps_static") approximates eps_inf
+    n = math.sqrt(eps)  # sqrt(eps_inf) to get refractive index
+    d = {}
+    d["gap_moss"] = (95 / n**4) if n > 0 else None
+    d["gap_gupta-ravindra"] = (4.16-n)/0.85 if n <= 4.16 else None
+    d["gap_reddy-anjaneyulu"] = 36.3/math.exp(n)
+    d["gap_reddy-ahamed"] = 154/n**4+0.365 if n > 0 else None
+    d["gap_herve_vandamme"] = 13.47/math.sqrt(n**2-1)-3.47 if n > 1 else None
+    return {"bandgap_estimation": d}
@@ -1,16 +1,49 @@
 # coding: utf-8
 
+import json
+import multiprocessing
+import time
+import traceback
 from abc import ABCMeta, abstractmethod
+from functools import wraps
+from itertools import islice
+
+from pymongo import UpdateOne
+from pymongo.operations import DeleteOne, InsertOne, ReplaceOne, UpdateMany
+from tqdm import tqdm
+
+from atomate.utils.utils import get_logger, get_mongolike
+from atomate.vasp.builders.instrumentation import BuilderProfiler, instrument_collections, \
+    get_active_profiler, set_active_profiler
 
 __author__ = "Kiran Mathew"
 __email__ = "kmathew@lbl.gov"
 
+logger = get_logger(__name__)
+
+WRITE_OPERATIONS = (UpdateOne, UpdateMany, InsertOne, ReplaceOne, DeleteOne)
+
 
 class AbstractBuilder(metaclass=ABCMeta):
     """
     Abstract builder class. Defines the contract and must be subclassed by all builders.
+
+    It also provides process_documents, a shared engine for the builders that update documents
+    from the documents of a source collection: change detection with a watermark, chunked
+    iteration of the source documents, optional process pool and batched bulk writes.
+
+    Builders can be instrumented with instrument() to profile their runs and to do dry runs.
     """
 
+    _profiler = None
+    _dry_run = False
+    _profile_file = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "run" in cls.__dict__:
+            cls.run = _profiled(cls.__dict__["run"])
+
     @abstractmethod
     def run(self):
         """
@@ -32,3 +65,353 @@ class AbstractBuilder(metaclass=ABCMeta):
         Set the builder from a config file, e.g., a db file
         """
         pass
+
+    def instrument(self, dry_run=False, profile_file=None):
+        """
+        Record the time spent in the MongoDB reads and writes of the builder collections and
+        in the structure deserialization, matching and compute sections during run(), and emit
+        a JSON profile at the end of run().
+
+        Args:
+            dry_run (bool): compute the updates without writing them. Later items do not see
+                the updates of earlier ones, e.g. no new material is created for matching.
+            profile_file (str): file the JSON profile is written to. If None, the profile is
+                logged.
+
+        Returns:
+            the builder
+        """
+        self._profiler = BuilderProfiler()
+        self._dry_run = dry_run
+        self._profile_file = profile_file
+        instrument_collections(self, self._profiler, dry_run)
+        return self
+
+    def get_profile(self):
+        """
+        Get the profile of the last instrumented run.
+
+        Returns:
+            (dict) the time and number of calls of each section, and the statistics of the
+                process_documents calls
+        """
+        if self._profiler is None:
+            return None
+        return {"builder": self.__class__.__name__, "dry_run": self._dry_run,
+                "sections": self._profiler.sections, "process_documents": self._profiler.stats}
+
+    def process_documents(self, source, query, process, projection=None, target=None,
+                          key="_id", watermark_field=None, watermark_name=None, update_all=False,
+                          chunk_size=1000, nproc=1, missing_field=None):
+        """
+        Process the documents of a collection and write the results in bulk.
+
+        Args:
+            source (pymongo.collection): collection of the documents to process
+            query (dict): query of the documents to process
+            process (callable): function of a source document returning None (no update), an
+                update of the target document with the same key, either a dict of fields to
+                $set or a dict of update operators, or a pymongo write operation (or a list
+                of them). Must be picklable, e.g. a module level function, if nproc > 1.
+            projection (dict/list): projection of the source documents
+            target (pymongo.collection): collection to update. Defaults to source.
+            key (str): field identifying the target document of a source document, when
+                process returns an update
+            watermark_field (str): field of the source documents, e.g. a "last_updated"
+                date, increasing when a document changes. If set, only the documents with a
+                value greater than the largest one processed in the previous runs, and those
+                that failed in the previous run, are processed. The keys of the failed
+                documents are recorded in the state of the builder.
+            watermark_name (str): name of the watermark, if the builder processes several
+                sources into the same target collection
+            update_all (bool): process all the documents matching the query, regardless of
+                the watermark
+            chunk_size (int): number of documents processed and written at a time
+            nproc (int): number of processes applying process to the documents
+            missing_field (str/[str]): field(s) of the source documents written by process.
+                The documents without one of them are processed regardless of the watermark,
+                e.g. those not ready or failed in the previous runs, so their failures are not
+                recorded.
+
+        Returns:
+            (dict) statistics of the run: number of documents, updates and errors, time spent
+                reading, processing and writing
+        """
+        target = target if target is not None else source
+        missing_fields = [missing_field] if isinstance(missing_field, str) else \
+            list(missing_field or [])
+        watermark = self.get_watermark(target, watermark_name) if watermark_field else None
+        query = self.get_process_query(query, target, watermark_field, watermark_name,
+                                       update_all, missing_fields, key)
+
+        stats = {"n_docs": 0, "n_updates": 0, "n_errors": 0, "time_read": 0.,
+                 "time_process": 0., "time_write": 0.}
+        t_start = time.time()
+        # the watermark moves past all the documents processed, the failed ones being retried
+        # by key
+        max_value = None
+        failed = []
+
+        if projection is not None:
+            projection = _add_projection_fields(projection,
+                                                [key, watermark_field] + missing_fields)
+        cursor = source.find(query, projection).batch_size(chunk_size)
+        pool = multiprocessing.Pool(nproc) if nproc > 1 else None
+        pbar = tqdm()
+        try:
+            while True:
+                t0 = time.time()
+                docs = list(islice(cursor, chunk_size))
+                stats["time_read"] += time.time() - t0
+                if not docs:
+                    break
+
+                t0 = time.time()
+                jobs = [(process, doc) for doc in docs]
+                # the documents are sent to the workers in batches
+                results = pool.map(_process_document, jobs,
+                                   chunksize=max(1, len(jobs) // (4 * nproc))) if pool else \
+                    [_process_document(job) for job in jobs]
+                stats["time_process"] += time.time() - t0
+                if get_active_profiler():
+                    get_active_profiler().add("compute", time.time() - t0, count=len(jobs))
+
+                requests = []
+                for doc, (result, error) in zip(docs, results):
+                    value = _get_value(doc, watermark_field) if watermark_field else None
+                    if value is not None and (max_value is None or value > max_value):
+                        max_value = value
+                    if error:
+                        stats["n_errors"] += 1
+                        logger.error("There was an error processing {}: {}\n{}".format(
+                            key, doc.get(key), error))
+                        if not any(_is_missing(doc, f) for f in missing_fields):
+                            failed.append(doc.get(key))
+                        continue
+                    requests.extend(_get_requests(result, doc, key))
+
+                t0 = time.time()
+                if requests:
+                    target.bulk_write(requests, ordered=False)
+                stats["time_write"] += time.time() - t0
+                stats["n_docs"] += len(docs)
+                stats["n_updates"] += len(requests)
+                pbar.update(len(docs))
+        finally:
+            pbar.close()
+            if pool:
+                pool.close()
+                pool.join()
+
+        if watermark_field:
+            # the documents failed in the previous run were all processed again
+            if failed:
+                self.set_state(target, _get_failed_name(watermark_name), failed)
+            elif self.get_state(target, _get_failed_name(watermark_name)) is not None:
+                self.reset_state(target, _get_failed_name(watermark_name))
+            if max_value is not None and (watermark is None or max_value > watermark):
+                self.set_watermark(target, max_value, watermark_name)
+
+        stats["time_total"] = time.time() - t_start
+        stats["docs_per_s"] = stats["n_docs"] / stats["time_total"] \
+            if stats["time_total"] else 0.
+        logger.info("{}: processed {n_docs} documents with {n_updates} updates and {n_errors} "
+                    "errors in {time_total:.1f} s ({docs_per_s:.1f} docs/s; read {time_read:.1f} "
+                    "s, process {time_process:.1f} s, write {time_write:.1f} s)".format(
+                        self.__class__.__name__, **stats))
+        if self._profiler is not None:
+            self._profiler.stats.append(stats)
+        return stats
+
+    def get_process_query(self, query, target, watermark_field=None, watermark_name=None,
+                          update_all=False, missing_field=None, key="_id"):
+        """
+        Get the query of the documents processed by process_documents, e.g. to check whether
+        there is anything to process. The arguments are those of process_documents.
+
+        Returns:
+            (dict) the query
+        """
+        query = dict(query)
+        missing_fields = [missing_field] if isinstance(missing_field, str) else \
+            list(missing_field or [])
+        if watermark_field and not update_all:
+            watermark = self.get_watermark(target, watermark_name)
+            if watermark is not None:
+                retried = [{f: {"$exists": False}} for f in missing_fields]
+                failed = self.get_state(target, _get_failed_name(watermark_name))
+                if failed:
+                    retried.append({key: {"$in": failed}})
+                if retried:
+                    query = {"$and": [query, {"$or": [{watermark_field: {"$gt": watermark}}] +
+                                              retried}]}
+                else:
+                    query[watermark_field] = {"$gt": watermark}
+        return query
+
+    def get_watermark(self, target, name=None):
+        """
+        Get the watermark of the builder for a target collection.
+
+        Args:
+            target (pymongo.collection): the collection updated by the builder
+            name (str): name of the watermark
+
+        Returns:
+            the largest watermark field value processed, or None
+        """
+        doc = _get_state_collection(target).find_one({"_id": self._get_watermark_id(target, name)})
+        return doc["watermark"] if doc else None
+
+    def set_watermark(self, target, value, name=None):
+        """
+        Set the watermark of the builder for a target collection.
+        """
+        if self._dry_run:
+            return
+        _get_state_collection(target).update_one({"_id": self._get_watermark_id(target, name)},
+                                                 {"$set": {"watermark": value}}, upsert=True)
+
+    def reset_watermark(self, target, name=None):
+        """
+        Remove the watermark of the builder for a target collection, and the keys of the
+        documents that failed, e.g. when the builder is reset, so that all the documents are
+        processed in the next run.
+        """
+        if self._dry_run:
+            return
+        _get_state_collection(target).delete_one({"_id": self._get_watermark_id(target, name)})
+        self.reset_state(target, _get_failed_name(name))
+
+    def _get_watermark_id(self, target, name=None):
+        return "{}.{}{}".format(self.__class__.__name__, target.name,
+                                ".{}".format(name) if name else "")
+
+    def get_state(self, target, name):
+        """
+        Get a state document of the builder for a target collection, other than the
+        watermarks, e.g. measurements kept across runs.
+
+        Args:
+            target (pymongo.collection): the collection updated by the builder
+            name (str): name of the state
+
+        Returns:
+            (dict) the state, or None
+        """
+        doc = _get_state_collection(target).find_one({"_id": self._get_state_id(target, name)})
+        return doc["state"] if doc else None
+
+    def set_state(self, target, name, state):
+        """
+        Set a state document of the builder for a target collection.
+        """
+        if self._dry_run:
+            return
+        _get_state_collection(target).update_one({"_id": self._get_state_id(target, name)},
+                                                 {"$set": {"state": state}}, upsert=True)
+
+    def reset_state(self, target, name):
+        """
+        Remove a state document of the builder for a target collection.
+        """
+        if self._dry_run:
+            return
+        _get_state_collection(target).delete_one({"_id": self._get_state_id(target, name)})
+
+    def _get_state_id(self, target, name):
+        # distinct from the watermark ids, which have no ":"
+        return "{}.{}:{}".format(self.__class__.__name__, target.name, name)
+
+
+def _profiled(run):
+    """
+    Wrap the run method of a builder to emit the profile of instrumented builders.
+    """
+    @wraps(run)
+    def profiled_run(self, *args, **kwargs):
+        profiler = self._profiler
+        # runs of the parent classes are part of the outermost run
+        if profiler is None or get_active_profiler() is profiler:
+            return run(self, *args, **kwargs)
+        profiler.reset()
+        set_active_profiler(profiler)
+        t0 = time.time()
+        try:
+            return run(self, *args, **kwargs)
+        finally:
+            set_active_profiler(None)
+            profile = self.get_profile()
+            profile["time_total"] = time.time() - t0
+            if self._profile_file:
+                with open(self._profile_file, "w") as f:
+                    json.dump(profile, f, indent=2)
+            else:
+                logger.info("Profile: {}".format(json.dumps(profile)))
+    return profiled_run
+
+
+def _get_state_collection(target):
+    # the watermarks are stored in the database of the collection updated
+    return target.database["builder_state"]
+
+
+def _process_document(job):
+    process, doc = job
+    try:
+        return process(doc), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def _get_requests(result, doc, key):
+    """
+    Get the pymongo write operations from the result of a process function.
+    """
+    if result is None:
+        return []
+    if isinstance(result, WRITE_OPERATIONS):
+        return [result]
+    if isinstance(result, list):
+        return result
+    if not result:
+        return []
+    update = result if all(k.startswith("$") for k in result) else {"$set": result}
+    return [UpdateOne({key: doc[key]}, update)]
+
+
+def _get_failed_name(watermark_name):
+    # the state with the keys of the documents that failed, for each watermark
+    return "failed.{}".format(watermark_name) if watermark_name else "failed"
+
+
+def _get_value(doc, field):
+    try:
+        return get_mongolike(doc, field)
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+def _is_missing(doc, field):
+    try:
+        get_mongolike(doc, field)
+        return False
+    except (KeyError, IndexError, TypeError):
+        return True
+
+
+def _add_projection_fields(projection, fields):
+    # the fields within a projected field are already projected, and projecting both is
+    # a path collision
+    def covered(f, paths):
+        return any(f == p or f.startswith(p + ".") for p in paths)
+
+    fields = [f for f in fields if f and f != "_id"]
+    if isinstance(projection, dict):
+        projection = dict(projection)
+        included = [k for k in projection if k != "_id" and projection[k]]
+        if included:
+            projection.update({f: 1 for f in fields if not covered(f, included)})
+        return projection
+    projection = list(projection)
+    return projection + [f for f in fields if not covered(f, projection)]
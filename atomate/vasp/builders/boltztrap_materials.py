@@ -1,15 +1,16 @@
 # coding: utf-8
 
 
-from tqdm import tqdm
+from pymongo import UpdateOne
 
 from atomate.utils.utils import get_logger , get_database
 
 from pymatgen import Structure
-from pymatgen.analysis.structure_matcher import StructureMatcher, ElementComparator
 from pymatgen.electronic_structure.boltztrap import BoltztrapAnalyzer
 
 from atomate.vasp.builders.base import AbstractBuilder
+from atomate.vasp.builders.instrumentation import profile_section
+from atomate.vasp.builders.utils import MaterialsIndex
 
 logger = get_logger(__name__)
 
@@ -27,88 +28,97 @@ class BoltztrapMaterialsBuilder(AbstractBuilder):
         """
         self._materials = materials_write
         self._boltztrap = boltztrap_read
+        self._previous_oids = set()
+        self._index = MaterialsIndex()
+        self._formulas = set()
 
     def run(self):
         logger.info("BoltztrapMaterialsBuilder starting...")
-        logger.info("Initializing list of all new boltztrap ids to process ...")
-        previous_oids = []
-        for m in self._materials.find({}, {"_boltztrapbuilder.all_object_ids": 1}):
-            if '_boltztrapbuilder' in m:
-                previous_oids.extend(m["_boltztrapbuilder"]["all_object_ids"])
-
-        if not previous_oids:
-            self._build_indexes()
-
-        all_btrap_ids = [i["_id"] for i in self._boltztrap.find({}, {"_id": 1})]
-        new_btrap_ids = [o_id for o_id in all_btrap_ids if o_id not in previous_oids]
-
-        logger.info("There are {} new boltztrap ids to process.".format(len(new_btrap_ids)))
-
-        pbar = tqdm(new_btrap_ids)
-        for o_id in pbar:
-            pbar.set_description("Processing object_id: {}".format(o_id))
-            try:
-                doc = self._boltztrap.find_one({"_id": o_id})
-                m_id = self._match_material(doc)
-                if not m_id:
-                    raise ValueError("Cannot find matching material for object_id: {}".format(o_id))
-                self._update_material(m_id, doc)
-            except:
-                import traceback
-                logger.exception("<---")
-                logger.exception("There was an error processing task_id: {}".format(o_id))
-                logger.exception(traceback.format_exc())
-                logger.exception("--->")
+        self._index = MaterialsIndex()
+        self._formulas = set()
+        self._previous_oids = set()
+        if self.get_watermark(self._materials) is None:
+            # materials built before the watermark was recorded
+            logger.info("Initializing list of all previous boltztrap ids ...")
+            for m in self._materials.find({"_boltztrapbuilder": {"$exists": True}},
+                                          {"_boltztrapbuilder.all_object_ids": 1}):
+                self._previous_oids.update(m["_boltztrapbuilder"]["all_object_ids"])
+            if not self._previous_oids:
+                self._build_indexes()
+
+        # ObjectIds increase with the insertion time, so that they can be used as watermark
+        self.process_documents(self._boltztrap, {}, self._get_material_update,
+                               target=self._materials, watermark_field="_id", chunk_size=50)
 
         logger.info("BoltztrapMaterialsBuilder finished processing.")
 
+    def _get_material_update(self, doc):
+        """
+        Get the update of the material matching a boltztrap document.
+
+        Args:
+            doc (dict): a JSON-like Boltztrap document
+
+        Returns:
+            (UpdateOne) the update of the material, or None if the document was already
+                processed
+        """
+        if doc["_id"] in self._previous_oids:
+            return None
+        m_id = self._match_material(doc)
+        if not m_id:
+            raise ValueError("Cannot find matching material for object_id: {}".format(doc["_id"]))
+        return self._update_material(m_id, doc)
+
     def reset(self):
         logger.info("Resetting BoltztrapMaterialsBuilder")
         self._materials.update_many({}, {"$unset": {"_boltztrapbuilder": 1,
                                                     "transport": 1}})
+        self.reset_watermark(self._materials)
         self._build_indexes()
         logger.info("Finished resetting BoltztrapMaterialsBuilder")
 
-    def _match_material(self, doc, ltol=0.2, stol=0.3, angle_tol=5):
+    def _match_material(self, doc):
         """
         Returns the material_id that has the same structure as this doc as
          determined by the structure matcher. Returns None if no match.
 
+        The materials of each formula are loaded once per run in an index shared by all the
+        documents, which deserializes their structures only once.
+
         Args:
             doc (dict): a JSON-like document
-            ltol (float): StructureMatcher tuning parameter
-            stol (float): StructureMatcher tuning parameter
-            angle_tol (float): StructureMatcher tuning parameter
 
         Returns:
             (int) matching material_id or None
         """
         formula = doc["formula_reduced_abc"]
-        sgnum = doc["spacegroup"]["number"]
-
-        for m in self._materials.find({"formula_reduced_abc": formula, "sg_number": sgnum},
-                                      {"structure": 1, "material_id": 1}):
-
-            m_struct = Structure.from_dict(m["structure"])
-            t_struct = Structure.from_dict(doc["structure"])
-
-            sm = StructureMatcher(ltol=ltol, stol=stol, angle_tol=angle_tol,
-                                  primitive_cell=True, scale=True,
-                                  attempt_supercell=False, allow_subset=False,
-                                  comparator=ElementComparator())
-
-            if sm.fit(m_struct, t_struct):
-                return m["material_id"]
-
-        return None
+        if formula not in self._formulas:
+            for m in self._materials.find({"formula_reduced_abc": formula},
+                                          {"structure": 1, "material_id": 1, "sg_number": 1,
+                                           "parent_structure.spacegroup": 1,
+                                           "_tasksbuilder.fingerprint": 1}):
+                # the stored fingerprint is the one of the parent structure, if any
+                fingerprint = None if "parent_structure" in m else \
+                    m.get("_tasksbuilder", {}).get("fingerprint")
+                self._index.add(m["material_id"], formula, m["sg_number"], m["structure"],
+                                fingerprint=fingerprint)
+            self._formulas.add(formula)
+
+        with profile_section("structure_deserialization"):
+            structure = Structure.from_dict(doc["structure"])
+        return self._index.match(formula, doc["spacegroup"]["number"], structure)
 
     def _update_material(self, m_id, doc):
         """
-        Update a material document based on a new task
+        Get the update of a material document based on a new task
 
         Args:
             m_id (int): material_id for material document to update
             doc (dict): a JSON-like Boltztrap document
+
+        Returns:
+            (UpdateOne) the update of the material
         """
         bta = BoltztrapAnalyzer.from_dict(doc)
         d = {}
@@ -119,9 +129,9 @@ class BoltztrapMaterialsBuilder(AbstractBuilder):
         d["kappa_max"] = bta.get_extreme("kappa")
         d["kappa_min"] = bta.get_extreme("kappa", maximize=False)
 
-        self._materials.update_one({"material_id": m_id}, {"$set": {"transport": d}})
-        self._materials.update_one({"material_id": m_id},
-                                   {"$push": {"_boltztrapbuilder.all_object_ids": doc["_id"]}})
+        return UpdateOne({"material_id": m_id},
+                         {"$set": {"transport": d},
+                          "$addToSet": {"_boltztrapbuilder.all_object_ids": doc["_id"]}})
 
     def _build_indexes(self):
         """
@@ -1,52 +1,43 @@
-from tqdm import tqdm
+from datetime import datetime
 
 from atomate.utils.utils import get_logger
 
 import numpy as np
 
 from atomate.utils.utils import get_database
+from atomate.vasp.builders.base import AbstractBuilder
 
 logger = get_logger(__name__)
 
 __author__ = 'Shyue Ping Ong <ongsp@uscd.edu>, Anubhav Jain <ajain@lbl.gov>'
 
 
-class DielectricBuilder:
+class DielectricBuilder(AbstractBuilder):
 
-    def __init__(self, materials_write):
+    def __init__(self, materials_write, update_all=False, nproc=1):
         """
         Starting with an existing materials collection, adds some averages and 
         eigenvalues for dielectric constants rather than just the tensor
         
         Args:
             materials_write: mongodb collection for materials (write access needed)
+            update_all: (bool) - if true, updates all docs. If false, only updates the docs
+                updated by the TasksMaterialsBuilder since the last run and those without
+                the averages
+            nproc: (int) number of processes
         """
         self._materials = materials_write
+        self.update_all = update_all
+        self.nproc = nproc
 
     def run(self):
         logger.info("EpsilonBuilder starting...")
-        q = {"dielectric": {"$exists": True}, "dielectric.eps_ionic_avg": {"$exists": False}}
-
-        for m in tqdm(self._materials.find(q, projection=["material_id", "dielectric"])):
-            try:
-                eps = m["dielectric"]
-                d = {}
-                eig_ionic = np.linalg.eig(eps["epsilon_ionic"])[0]
-                eig_static = np.linalg.eig(eps["epsilon_static"])[0]
-
-                d["dielectric.epsilon_ionic_avg"] = float(np.average(eig_ionic))
-                d["dielectric.epsilon_static_avg"] = float(np.average(eig_static))
-                d["dielectric.epsilon_avg"] = d["dielectric.epsilon_ionic_avg"] + \
-                                              d["dielectric.epsilon_static_avg"]
-                d["dielectric.has_neg_eps"] = bool(np.any(eig_ionic < -0.1) or
-                                                   np.any(eig_static < -0.1))
-
-                self._materials.update_one({"material_id": m["material_id"]}, {"$set": d})
-
-            except:
-                import traceback
-                logger.exception(traceback.format_exc())
-
+        q = {"dielectric": {"$exists": True}}
+        self.process_documents(self._materials, q, get_dielectric_averages,
+                               projection=["material_id", "dielectric"], key="material_id",
+                               watermark_field="_tasksbuilder.updated_at",
+                               missing_field="dielectric.epsilon_ionic_avg",
+                               update_all=self.update_all, nproc=self.nproc)
         logger.info("EpsilonBuilder finished processing.")
 
     def reset(self):
@@ -54,9 +45,11 @@ class DielectricBuilder:
         keys = ["dielectric.epsilon_ionic_avg",
                 "dielectric.epsilon_static_avg",
                 "dielectric.epsilon_avg",
-                "dielectric.has_neg_eps"]
+                "dielectric.has_neg_eps",
+                "_dielectricbuilder"]
 
         self._materials.update_many({}, {"$unset": {k: "" for k in keys}})
+        self.reset_watermark(self._materials)
         logger.info("Finished resetting EpsilonBuilder")
 
     @staticmethod
@@ -74,3 +67,29 @@ class DielectricBuilder:
         """
         db_write = get_database(db_file, admin=True)
         return DielectricBuilder(db_write[m], **kwargs)
+
+
+def get_dielectric_averages(m):
+    """
+    Get the averages of the eigenvalues of the dielectric tensors of a material.
+
+    Args:
+        m (dict): material document with the "dielectric" key
+
+    Returns:
+        (dict) the fields to set in the material document
+    """
+    eps = m["dielectric"]
+    d = {}
+    eig_ionic = np.linalg.eig(eps["epsilon_ionic"])[0]
+    eig_static = np.linalg.eig(eps["epsilon_static"])[0]
+
+    d["dielectric.epsilon_ionic_avg"] = float(np.average(eig_ionic))
+    d["dielectric.epsilon_static_avg"] = float(np.average(eig_static))
+    d["dielectric.epsilon_avg"] = d["dielectric.epsilon_ionic_avg"] + \
+                                  d["dielectric.epsilon_static_avg"]
+    d["dielectric.has_neg_eps"] = bool(np.any(eig_ionic < -0.1) or
+                                       np.any(eig_static < -0.1))
+    # the watermark of the BandgapEstimationBuilder
+    d["_dielectricbuilder.updated_at"] = datetime.utcnow()
+    return d
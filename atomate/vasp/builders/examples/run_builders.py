@@ -22,11 +22,12 @@ if __name__ == "__main__":
     dbfile = os.path.join(module_dir, "db.json")  # make sure to modify w/your db details
 
     build_sequence = [FixTasksBuilder, TasksMaterialsBuilder, TagsBuilder,
-                      MaterialsDescriptorBuilder, BandgapEstimationBuilder, DielectricBuilder,
+                      MaterialsDescriptorBuilder, DielectricBuilder, BandgapEstimationBuilder,
                       BoltztrapMaterialsBuilder]
     for cls in build_sequence:
         b = cls.from_file(dbfile)
         # b.reset()  # uncomment if you want to start a builder from scratch!
+        # b.instrument(dry_run=True)  # uncomment to profile the builder without writing
         b.run()
 
     # Uncomment below to run MP Ehull builder
@@ -1,6 +1,11 @@
 # coding: utf-8
 
+import hashlib
+import os
+from collections import OrderedDict
+from functools import lru_cache
 
+from pymongo import UpdateOne
 from tqdm import tqdm
 
 from atomate.utils.utils import get_database
@@ -14,59 +19,152 @@ logger = get_logger(__name__)
 
 __author__ = 'Anubhav Jain <ajain@lbl.gov>'
 
+# number of bytes at the start of the data file hashed to check that a checkpoint belongs to it
+CHECKPOINT_BLOCK_SIZE = 64 * 1024
+
 
 class FileMaterialsBuilder(AbstractBuilder):
-    def __init__(self, materials_write, data_file, delimiter=",", header_lines=0):
+    def __init__(self, materials_write, data_file, delimiter=",", header_lines=0,
+                 chunk_size=10000, resume=True):
         """
         Updates the database using a data file. Format of file must be:
         <material_id or formula>, <property>, <value>
 
         Comment lines should *start* with '#'.
 
+        The file is streamed and processed in chunks of lines. The byte offset of the last
+        chunk written is recorded until the end of the run, so that an interrupted run can be
+        resumed. The checkpoint also records the size, modification time and a hash of the
+        first block of the file: a run on a file modified since starts over.
+
         Args:
             materials_write: mongodb collection for materials (write access needed)
             data_file (str): path to data file
             delimiter (str): delimiter for file parsing
             header_lines (int): number of header lines to skip in data file
+            chunk_size (int): number of lines processed at a time
+            resume (bool): whether to resume from the checkpoint of a previous run on the same
+                data file
         """
         self._materials = materials_write
         self._data_file = data_file
         self._delimiter = delimiter
         self.header_lines = header_lines
+        self.chunk_size = chunk_size
+        self.resume = resume
 
     def run(self):
         logger.info("Starting FileMaterials Builder.")
-        with open(self._data_file, 'rt') as f:
-            line_no = 0
-            lines = [line for line in f]  # only good for smaller files
-            pbar = tqdm(lines)
-            for line in pbar:
-                line = line.strip()
-                if line and not line.startswith("#"):
-                    line_no += 1
-                    if line_no > self.header_lines:
-                        line = line.split(self._delimiter)
-                        if "-" in line[0]:
-                            search_val = line[0]
-                            search_key = "material_id"
-                        else:
-                            search_key = "formula_reduced_abc"
-                            search_val = Composition(line[0]).\
-                                reduced_composition.alphabetical_formula
-
-                        key = line[1]
-                        val = line[2]
-                        try:
-                            val = float(val)
-                        except:
-                            pass
-
-                        self._materials.update({search_key: search_val}, {"$set": {key: val}})
-
+        checkpoint_name = os.path.abspath(self._data_file)
+        checkpoint = self.get_watermark(self._materials, checkpoint_name) if self.resume else None
+        file_id = self._get_file_id()
+        size = file_id["size"]
+        if checkpoint and checkpoint.get("file") != file_id:
+            logger.warning("The data file changed since the checkpoint, starting over.")
+            checkpoint = None
+        offset, line_no = (checkpoint["offset"], checkpoint["line_no"]) if checkpoint else (0, 0)
+        if offset:
+            logger.info("Resuming from byte offset {}".format(offset))
+
+        n_rows = n_unmatched = 0
+        pbar = tqdm(total=size, initial=offset, unit="B", unit_scale=True)
+        with open(self._data_file, 'rb') as f:
+            f.seek(offset)
+            rows = []
+            while True:
+                line = f.readline()
+                if line:
+                    line = line.decode().strip()
+                    if line and not line.startswith("#"):
+                        line_no += 1
+                        if line_no > self.header_lines:
+                            rows.append(line.split(self._delimiter))
+                if rows and (len(rows) == self.chunk_size or not line):
+                    n_rows += len(rows)
+                    n_unmatched += self._update_materials(rows)
+                    rows = []
+                    self.set_watermark(self._materials, {"offset": f.tell(), "line_no": line_no,
+                                                         "file": file_id}, checkpoint_name)
+                pbar.update(f.tell() - offset)
+                offset = f.tell()
+                if not line:
+                    break
+        pbar.close()
+        # the checkpoint is only kept for interrupted runs
+        self.reset_watermark(self._materials, checkpoint_name)
+
+        if n_unmatched:
+            logger.warning("{} of {} lines did not match any material".format(n_unmatched,
+                                                                               n_rows))
         logger.info("FileMaterials Builder finished processing")
 
+    def _get_file_id(self):
+        """
+        Identify the version of the data file a checkpoint belongs to.
+
+        Returns:
+            (dict) the size, modification time and md5 hash of the first block of the file
+        """
+        st = os.stat(self._data_file)
+        with open(self._data_file, "rb") as f:
+            head_md5 = hashlib.md5(f.read(CHECKPOINT_BLOCK_SIZE)).hexdigest()
+        return {"size": st.st_size, "mtime": st.st_mtime, "head_md5": head_md5}
+
+    def _update_materials(self, rows):
+        """
+        Update the materials with a chunk of rows of the data file, with one lookup per kind of
+        identifier and one bulk write.
+
+        Args:
+            rows ([[str]]): the split lines of the data file
+
+        Returns:
+            (int) the number of rows that did not match any material
+        """
+        m_ids = {row[0] for row in rows if "-" in row[0]}
+        formulas = {row[0]: get_formula_reduced_abc(row[0]) for row in rows
+                    if "-" not in row[0]}
+
+        existing_ids = {m["material_id"] for m in self._materials.find(
+            {"material_id": {"$in": list(m_ids)}}, {"material_id": 1})} if m_ids else set()
+        # as for update_one, a formula updates a single material
+        formula_ids = {}
+        if formulas:
+            for m in self._materials.find(
+                    {"formula_reduced_abc": {"$in": list(set(formulas.values()))}},
+                    {"material_id": 1, "formula_reduced_abc": 1}):
+                formula_ids.setdefault(m["formula_reduced_abc"], m["material_id"])
+
+        # merge the updates of each material, so that the last line of a property wins as if
+        # the lines were written in order
+        updates = OrderedDict()
+        n_unmatched = 0
+        for row in rows:
+            if "-" in row[0]:
+                m_id = row[0] if row[0] in existing_ids else None
+            else:
+                m_id = formula_ids.get(formulas[row[0]])
+            if m_id is None:
+                n_unmatched += 1
+                continue
+
+            key = row[1]
+            val = row[2]
+            try:
+                val = float(val)
+            except:
+                pass
+            updates.setdefault(m_id, {})[key] = val
+
+        if updates:
+            self._materials.bulk_write([UpdateOne({"material_id": m_id}, {"$set": update})
+                                        for m_id, update in updates.items()], ordered=False)
+        return n_unmatched
+
     def reset(self):
-        logger.warning("Cannot reset FileMaterials Builder!")
+        logger.info("Resetting FileMaterials Builder checkpoint")
+        self.reset_watermark(self._materials, os.path.abspath(self._data_file))
+        logger.warning("Cannot reset the data of FileMaterials Builder!")
 
     @classmethod
     def from_file(cls, db_file, data_file=None, m="materials", **kwargs):
@@ -84,3 +182,8 @@ class FileMaterialsBuilder(AbstractBuilder):
             return cls(db_write[m], data_file, **kwargs)
         else:
             raise ValueError("data_file must be provided")
+
+
+@lru_cache(maxsize=10000)
+def get_formula_reduced_abc(formula):
+    return Composition(formula).reduced_composition.alphabetical_formula
@@ -22,36 +22,30 @@ class FixTasksBuilder(AbstractBuilder):
         self._tasks = tasks_write
 
     def run(self):
-        # change spacegroup numbers from string to integer where needed
         logger.info("FixTasksBuilder started.")
-        for t in self._tasks.find({"output.spacegroup.number": {"$type": 2}},
-                                  {"task_id": 1, "output": 1}):
-            logger.info("Fixing string spacegroup, tid: {}".format(t["task_id"]))
-            sg = int(t["output"]["spacegroup"]["number"])
-            self._tasks.update_one({"task_id": t["task_id"]},
-                                   {"$set": {"output.spacegroup.number": sg}})
+        # change spacegroup numbers from string to integer where needed
+        self.process_documents(self._tasks, {"output.spacegroup.number": {"$type": 2}},
+                               fix_spacegroup_number, projection={"task_id": 1, "output": 1},
+                               key="task_id")
 
         # change tags from string to list where needed
-        for t in self._tasks.find({"tags": {"$exists": True}, "tags.0": {"$exists": False}}, {"task_id": 1, "tags": 1}):
-            logger.info("Fixing tag (converting to list), tid: {}".format(t["task_id"]))
-            self._tasks.update_one({"task_id": t["task_id"]},
-                                   {"$set": {"tags": [t["tags"]]}})
+        self.process_documents(self._tasks, {"tags": {"$exists": True},
+                                             "tags.0": {"$exists": False}},
+                               fix_tags, projection={"task_id": 1, "tags": 1}, key="task_id")
 
         # fix old (incorrect) delta volume percent
-        for t in self._tasks.find({"analysis.delta_volume_percent": {"$exists": True}, "analysis.delta_volume_as_percent": {"$exists": False}}, {"task_id": 1, "analysis": 1}):
-            logger.info("Converting delta_volume_percent to be on a percentage scale, tid: {}".format(t["task_id"]))
-            self._tasks.update_one({"task_id": t["task_id"]},
-                                   {"$set": {"analysis.delta_volume_as_percent": t["analysis"]["delta_volume_percent"] * 100}})
+        self.process_documents(self._tasks,
+                               {"analysis.delta_volume_percent": {"$exists": True},
+                                "analysis.delta_volume_as_percent": {"$exists": False}},
+                               fix_delta_volume_percent, projection={"task_id": 1, "analysis": 1},
+                               key="task_id")
 
         # remove old (incorrect) delta volume percent
-        for t in self._tasks.find(
-                {"analysis.delta_volume_percent": {"$exists": True},
-                 "analysis.delta_volume_as_percent": {"$exists": True}},
-                {"task_id": 1}):
-            logger.info("Removing delta_volume_percent, tid: {}".format(t["task_id"]))
-            self._tasks.update_one({"task_id": t["task_id"]},
-                                   {"$unset": {"analysis.delta_volume_percent": 1}})
-
+        self.process_documents(self._tasks,
+                               {"analysis.delta_volume_percent": {"$exists": True},
+                                "analysis.delta_volume_as_percent": {"$exists": True}},
+                               remove_delta_volume_percent, projection={"task_id": 1},
+                               key="task_id")
 
         logger.info("FixTasksBuilder finished.")
 
@@ -70,3 +64,24 @@ class FixTasksBuilder(AbstractBuilder):
         """
         db_write = get_database(db_file, admin=True)
         return cls(db_write[t], **kwargs)
+
+
+def fix_spacegroup_number(t):
+    logger.info("Fixing string spacegroup, tid: {}".format(t["task_id"]))
+    return {"output.spacegroup.number": int(t["output"]["spacegroup"]["number"])}
+
+
+def fix_tags(t):
+    logger.info("Fixing tag (converting to list), tid: {}".format(t["task_id"]))
+    return {"tags": [t["tags"]]}
+
+
+def fix_delta_volume_percent(t):
+    logger.info("Converting delta_volume_percent to be on a percentage scale, tid: {}".format(
+        t["task_id"]))
+    return {"analysis.delta_volume_as_percent": t["analysis"]["delta_volume_percent"] * 100}
+
+
+def remove_delta_volume_percent(t):
+    logger.info("Removing delta_volume_percent, tid: {}".format(t["task_id"]))
+    return {"$unset": {"analysis.delta_volume_percent": 1}}
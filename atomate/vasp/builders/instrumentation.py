@@ -0,0 +1,177 @@
+# coding: utf-8
+
+"""
+Instrumentation of the builders: time spent in MongoDB reads and writes and in the sections
+of the builders (structure deserialization, matching, compute), and dry runs in which the
+writes are skipped. See AbstractBuilder.instrument.
+"""
+
+import time
+from contextlib import contextmanager
+
+from pymongo.collection import Collection
+
+from atomate.utils.utils import get_logger
+
+logger = get_logger(__name__)
+
+READ_METHODS = ("find_one", "count_documents", "estimated_document_count", "count", "distinct",
+                "aggregate", "find_raw_batches")
+
+WRITE_METHODS = ("insert_one", "insert_many", "update_one", "update_many", "replace_one",
+                 "delete_one", "delete_many", "bulk_write", "find_one_and_update",
+                 "find_one_and_replace", "find_one_and_delete", "create_index", "create_indexes",
+                 "drop_index", "drop", "insert", "update", "remove", "save")
+
+# profiler of the builder being run, which the profile_section calls record to
+_active_profiler = None
+
+
+class BuilderProfiler:
+    """
+    Time and number of calls of named sections. The sections can be nested, e.g.
+    "structure_deserialization" within "structure_matching", in which case the time is
+    counted in both.
+    """
+
+    def __init__(self):
+        self.sections = {}
+        self.stats = []
+
+    @contextmanager
+    def section(self, name):
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - t0)
+
+    def add(self, name, t, count=1):
+        section = self.sections.setdefault(name, {"time": 0., "count": 0})
+        section["time"] += t
+        section["count"] += count
+
+    def reset(self):
+        self.sections = {}
+        self.stats = []
+
+
+@contextmanager
+def profile_section(name):
+    """
+    Record the time spent in a block of code in the profiler of the instrumented builder
+    being run, if any. Sections run in worker processes are not recorded.
+    """
+    if _active_profiler is None:
+        yield
+    else:
+        with _active_profiler.section(name):
+            yield
+
+
+def set_active_profiler(profiler):
+    global _active_profiler
+    _active_profiler = profiler
+
+
+def get_active_profiler():
+    return _active_profiler
+
+
+class InstrumentedCursor:
+    """
+    Cursor recording the time spent fetching the documents as "mongo_read".
+    """
+
+    def __init__(self, cursor, profiler):
+        self._cursor = cursor
+        self._profiler = profiler
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        t0 = time.time()
+        try:
+            return next(self._cursor)
+        finally:
+            self._profiler.add("mongo_read", time.time() - t0)
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if not callable(attr):
+            return attr
+
+        def method(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            # chained cursor methods, e.g. batch_size or limit, return the cursor itself
+            return self if result is self._cursor else result
+        return method
+
+
+class InstrumentedCollection:
+    """
+    Proxy of a pymongo Collection recording the time spent in the reads and writes as
+    "mongo_read" and "mongo_write". In a dry run, the writes are skipped and counted as
+    "mongo_write_skipped".
+    """
+
+    def __init__(self, collection, profiler, dry_run=False):
+        self._collection = collection
+        self._profiler = profiler
+        self._dry_run = dry_run
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name == "find":
+            return lambda *args, **kwargs: InstrumentedCursor(attr(*args, **kwargs),
+                                                             self._profiler)
+        if name in READ_METHODS:
+            return self._timed(attr, "mongo_read")
+        if name in WRITE_METHODS:
+            if not self._dry_run:
+                return self._timed(attr, "mongo_write")
+            if name == "find_one_and_update":
+                return self._timed(self._find_one_and_update_dry, "mongo_read")
+            return self._skipped(name)
+        return attr
+
+    def __getitem__(self, name):
+        return self._collection[name]
+
+    def _timed(self, method, section):
+        def timed(*args, **kwargs):
+            with self._profiler.section(section):
+                return method(*args, **kwargs)
+        return timed
+
+    def _skipped(self, name):
+        def skipped(*args, **kwargs):
+            self._profiler.add("mongo_write_skipped", 0.)
+            logger.debug("Dry run: skipped {}.{}".format(self._collection.name, name))
+            return None
+        return skipped
+
+    def _find_one_and_update_dry(self, filter, update, *args, **kwargs):
+        """
+        Return the document as it would be updated by the top-level $set and $inc of the
+        update, e.g. for counters, without writing it.
+        """
+        self._profiler.add("mongo_write_skipped", 0.)
+        doc = self._collection.find_one(filter)
+        if doc is not None and kwargs.get("return_document"):
+            doc.update(update.get("$set", {}))
+            for k, v in update.get("$inc", {}).items():
+                doc[k] = doc.get(k, 0) + v
+        return doc
+
+
+def instrument_collections(obj, profiler, dry_run=False):
+    """
+    Replace the pymongo collections in the attributes of an object with InstrumentedCollection.
+    """
+    for k, v in list(vars(obj).items()):
+        if isinstance(v, InstrumentedCollection):
+            v = v._collection
+        if isinstance(v, Collection):
+            setattr(obj, k, InstrumentedCollection(v, profiler, dry_run))
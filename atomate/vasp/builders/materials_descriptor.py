@@ -1,4 +1,5 @@
-from tqdm import tqdm
+import time
+from collections import OrderedDict
 
 from atomate.utils.utils import get_database
 
@@ -13,44 +14,213 @@ logger = get_logger(__name__)
 __author__ = 'Anubhav Jain <ajain@lbl.gov>'
 
 
+# registry of the descriptors: name -> function of the structure and of a dict of intermediate
+# results shared by the descriptors of a structure, e.g. the neighbor list
+DESCRIPTORS = OrderedDict()
+
+# cutoff radius of the neighbor list shared by the descriptors (in A)
+NEIGHBOR_CUTOFF = 4.0
+
+
+def register_descriptor(name):
+    """
+    Decorator registering a descriptor computed by the MaterialsDescriptorBuilder, stored as
+    "descriptors.<name>" in the materials documents. The function takes a Structure and a
+    dict of intermediate results shared by all the descriptors of the structure, e.g.:
+
+        @register_descriptor("max_neighbor_distance")
+        def max_neighbor_distance(structure, cache):
+            return float(max(get_neighbor_list(structure, cache)[3]))
+
+    The descriptors are computed in the worker processes if nproc > 1, so they must be
+    registered at import time.
+    """
+    def decorator(func):
+        DESCRIPTORS[name] = func
+        return func
+    return decorator
+
+
+def get_neighbor_list(structure, cache, r=NEIGHBOR_CUTOFF):
+    """
+    Neighbor list of a structure, computed once for all the descriptors.
+
+    Args:
+        structure (Structure): the structure
+        cache (dict): intermediate results of the structure
+        r (float): cutoff radius
+
+    Returns:
+        (center_indices, neighbor_indices, images, distances) as from
+            Structure.get_neighbor_list
+    """
+    key = ("neighbor_list", r)
+    if key not in cache:
+        cache[key] = structure.get_neighbor_list(r)
+    return cache[key]
+
+
+@register_descriptor("dimensionality")
+def dimensionality(structure, cache):
+    return get_dimensionality(structure)
+
+
+@register_descriptor("density")
+def density(structure, cache):
+    return structure.density
+
+
+@register_descriptor("nsites")
+def nsites(structure, cache):
+    return len(structure)
+
+
+@register_descriptor("volume")
+def volume(structure, cache):
+    return structure.volume
+
+
+@register_descriptor("min_interatomic_distance")
+def min_interatomic_distance(structure, cache):
+    distances = get_neighbor_list(structure, cache)[3]
+    distances = distances[distances > 1e-8]
+    return float(distances.min()) if len(distances) else None
+
+
+class DescriptorCalculator:
+    """
+    Compute a set of descriptors for material documents. Picklable, to be used in worker
+    processes.
+    """
+
+    def __init__(self, names):
+        self.names = list(names)
+
+    def __call__(self, m):
+        """
+        Args:
+            m (dict): material document with the "structure" key
+
+        Returns:
+            (dict) the fields to set in the material document
+        """
+        struct = Structure.from_dict(m["structure"])
+        cache = {}
+        return {"descriptors.{}".format(name): DESCRIPTORS[name](struct, cache)
+                for name in self.names}
+
+
 class MaterialsDescriptorBuilder(AbstractBuilder):
-    def __init__(self, materials_write, update_all=False):
+    def __init__(self, materials_write, update_all=False, nproc=1, descriptors=None,
+                 max_cost=None, n_cost_samples=10, chunk_size=1000):
         """
         Starting with an existing materials collection, adds some compositional and structural
         descriptors.
-        
+
+        The cost of each descriptor is measured on a few structures at the start of the first
+        run with materials to process, and recorded in the builder state, so that expensive
+        descriptors can be skipped. The materials without one of the descriptors computed
+        are processed regardless of the incremental updates, e.g. when a descriptor skipped
+        before is added back by raising max_cost.
+
         Args:
             materials_write: mongodb collection for materials (write access needed)
-            update_all: (bool) - if true, updates all docs. If false, updates incrementally
+            update_all: (bool) - if true, updates all docs. If false, updates incrementally,
+                i.e. only the docs updated by the TasksMaterialsBuilder since the last run
+            nproc: (int) number of processes computing the descriptors
+            descriptors: ([str]) names of the descriptors to compute, from the registered
+                ones. Defaults to all of them.
+            max_cost: (float) descriptors taking more than max_cost seconds per structure on
+                average are skipped
+            n_cost_samples: (int) number of structures used to measure the costs. A
+                descriptor is measured on fewer structures if it is already known to be
+                above max_cost.
+            chunk_size: (int) number of materials processed at a time
         """
         self._materials = materials_write
         self.update_all = update_all
+        self.nproc = nproc
+        self.descriptors = list(descriptors or DESCRIPTORS)
+        unknown = [name for name in self.descriptors if name not in DESCRIPTORS]
+        if unknown:
+            raise ValueError("Unknown descriptors: {}".format(unknown))
+        self.max_cost = max_cost
+        self.n_cost_samples = n_cost_samples
+        self.chunk_size = chunk_size
 
     def run(self):
         logger.info("MaterialsDescriptorBuilder starting...")
         self._build_indexes()
 
-        q = {}
-        if not self.update_all:
-            q["descriptors.density"] = {"$exists": False}
+        names = self.descriptors
+        if self.max_cost is not None:
+            costs = self.get_state(self._materials, "costs") or {}
+            unmeasured = [name for name in names if name not in costs]
+            if unmeasured and self._materials.find_one(
+                    self._get_query(names), {"_id": 1}) is not None:
+                costs.update(self._measure_costs(unmeasured))
+                self.set_state(self._materials, "costs", costs)
+            names = [name for name in names if costs.get(name, 0) <= self.max_cost]
+            skipped = [name for name in self.descriptors if name not in names]
+            if skipped:
+                logger.info("Skipping the descriptors above max_cost: {}".format(skipped))
+
+        if names:
+            self.process_documents(self._materials, {}, DescriptorCalculator(names),
+                                   projection={"structure": 1, "material_id": 1},
+                                   key="material_id", update_all=self.update_all,
+                                   chunk_size=self.chunk_size, nproc=self.nproc,
+                                   **self._get_process_kwargs(names))
+        logger.info("MaterialsDescriptorBuilder finished processing.")
+
+    def _get_process_kwargs(self, names):
+        # the materials missing a descriptor are computed even if they are not updated
+        return {"watermark_field": "_tasksbuilder.updated_at",
+                "missing_field": ["descriptors.{}".format(name) for name in names]}
+
+    def _get_query(self, names):
+        """
+        Query of the materials to process with the descriptors names.
+        """
+        return self.get_process_query({}, self._materials, update_all=self.update_all,
+                                      **self._get_process_kwargs(names))
 
-        mats = [m for m in self._materials.find(q, {"structure": 1, "material_id": 1})]
+    def _measure_costs(self, names):
+        """
+        Measure the average time taken by descriptors on a sample of structures.
 
-        pbar = tqdm(mats)
-        for m in pbar:
-            pbar.set_description("Processing materials_id: {}".format(m['material_id']))
-            struct = Structure.from_dict(m["structure"])
-            d = {"descriptors": {}}
-            d["descriptors"]["dimensionality"] = get_dimensionality(struct)
-            d["descriptors"]["density"] = struct.density
-            d["descriptors"]["nsites"] = len(struct)
-            d["descriptors"]["volume"] = struct.volume
+        Args:
+            names ([str]): names of the descriptors
 
-            self._materials.update_one({"material_id": m["material_id"]}, {"$set": d})
+        Returns:
+            (dict) seconds per structure by descriptor name
+        """
+        times = dict.fromkeys(names, 0.)
+        counts = dict.fromkeys(names, 0)
+        for m in self._materials.find({}, {"structure": 1}).limit(self.n_cost_samples):
+            struct = Structure.from_dict(m["structure"])
+            cache = {}
+            for name in names:
+                # the descriptors known to be above max_cost are not measured further
+                if counts[name] and times[name] / counts[name] > self.max_cost:
+                    continue
+                t0 = time.time()
+                try:
+                    DESCRIPTORS[name](struct, cache)
+                except Exception:
+                    pass
+                times[name] += time.time() - t0
+                counts[name] += 1
+        costs = {name: times[name] / counts[name] for name in names if counts[name]}
+        logger.info("Descriptor costs (s/structure): {}".format(
+            ", ".join("{}: {:.2g}".format(name, cost) for name, cost in costs.items())))
+        return costs
 
     def reset(self):
         logger.info("Resetting MaterialsDescriptorBuilder")
         self._materials.update_many({}, {"$unset": {"descriptors": 1}})
+        self.reset_watermark(self._materials)
+        self.reset_state(self._materials, "costs")
         self._build_indexes()
         logger.info("Finished resetting MaterialsDescriptorBuilder")
 
@@ -69,4 +239,4 @@ class MaterialsDescriptorBuilder(AbstractBuilder):
             **kwargs: other parameters to feed into the builder
         """
         db_write = get_database(db_file, admin=True)
-        return cls(db_write[m], **kwargs)
\ No newline at end of file
+        return cls(db_write[m], **kwargs)
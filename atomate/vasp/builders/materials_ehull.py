@@ -1,11 +1,16 @@
 # coding: utf-8
 
+from itertools import combinations
 
+from monty.serialization import loadfn
+from pymongo import UpdateOne
 from tqdm import tqdm
 
 from atomate.utils.utils import get_database
 
-from pymatgen import MPRester, Structure
+from pymatgen import MPRester, Structure, Composition
+from pymatgen.analysis.phase_diagram import PhaseDiagram
+from pymatgen.entries.compatibility import MaterialsProjectCompatibility
 from pymatgen.entries.computed_entries import ComputedEntry
 
 from atomate.utils.utils import get_logger
@@ -17,7 +22,8 @@ __author__ = 'Anubhav Jain <ajain@lbl.gov>'
 
 
 class MaterialsEhullBuilder(AbstractBuilder):
-    def __init__(self, materials_write, mapi_key=None, update_all=False):
+    def __init__(self, materials_write, mapi_key=None, update_all=False, local=False,
+                 reference_entries_file=None, compatibility=None, batch_size=1000):
         """
         Starting with an existing materials collection, adds stability information and
         The Materials Project ID.
@@ -25,16 +31,39 @@ class MaterialsEhullBuilder(AbstractBuilder):
             materials_write: mongodb collection for materials (write access needed)
             mapi_key: (str) Materials API key (if MAPI_KEY env. var. not set)
             update_all: (bool) - if true, updates all docs. If false, only updates
-                docs w/o a stability key
+                docs w/o a stability key. In local mode, the docs whose chemical system
+                contains the one of a doc w/o a stability key are updated as well, since the
+                new material may lower their hull. Use update_all when the reference entries
+                change, or to refresh the stabilities against the Materials API.
+            local: (bool) - if true, the phase diagrams are computed locally from the
+                materials collection and the reference entries, without any call to the
+                Materials API. The Materials Project IDs are not added in this mode.
+            reference_entries_file: (str) json or yaml file with a list of ComputedEntry
+                added to the phase diagrams in local mode, e.g. the Materials Project
+                entries of the relevant chemical systems saved with
+                dumpfn(MPRester().get_entries_in_chemsys(elements), filename). The entries
+                are used as is: they should already be processed by the compatibility scheme.
+            compatibility: (Compatibility) scheme processing the entries of the materials in
+                local mode. Defaults to MaterialsProjectCompatibility.
+            batch_size: (int) number of material updates sent at once in local mode
         """
         self._materials = materials_write
-        self.mpr = MPRester(api_key=mapi_key)
+        self.mpr = MPRester(api_key=mapi_key) if not local else None
         self.update_all = update_all
+        self.local = local
+        self.reference_entries_file = reference_entries_file
+        self.compatibility = compatibility or MaterialsProjectCompatibility()
+        self.batch_size = batch_size
 
     def run(self):
         logger.info("MaterialsEhullBuilder starting...")
         self._build_indexes()
 
+        if self.local:
+            self._run_local()
+            logger.info("MaterialsEhullBuilder finished processing.")
+            return
+
         q = {"thermo.energy": {"$exists": True}}
         if not self.update_all:
             q["stability"] = {"$exists": False}
@@ -82,6 +111,89 @@ class MaterialsEhullBuilder(AbstractBuilder):
 
         logger.info("MaterialsEhullBuilder finished processing.")
 
+    def _run_local(self):
+        """
+        Compute the stability and formation energy of the materials with one phase diagram
+        per chemical system, built from all the materials of the collection and the reference
+        entries.
+        """
+        material_entries = self._get_local_entries()
+        entries = list(material_entries)
+        if self.reference_entries_file:
+            reference_entries = loadfn(self.reference_entries_file)
+            logger.info("Loaded {} reference entries.".format(len(reference_entries)))
+            entries.extend(reference_entries)
+
+        # entries of each chemical system, from which the entries of its subsystems are merged
+        entries_by_chemsys = {}
+        for e in entries:
+            entries_by_chemsys.setdefault(get_chemsys(e.composition), []).append(e)
+
+        q = {"thermo.energy_per_atom": {"$exists": True}}
+        if not self.update_all:
+            q["stability"] = {"$exists": False}
+        m_ids = {m["material_id"] for m in self._materials.find(q, {"material_id": 1})}
+        new_entries = [e for e in material_entries if e.entry_id in m_ids]
+        n_skipped = len(m_ids) - len(new_entries)
+        if n_skipped:
+            logger.warning("{} materials were excluded by the compatibility scheme and are not "
+                           "updated.".format(n_skipped))
+
+        # the new materials may lower the hull of all the chemical systems containing theirs
+        new_systems = {get_chemsys(e.composition) for e in new_entries}
+        materials_by_chemsys = {}
+        n_materials = 0
+        for e in material_entries:
+            chemsys = get_chemsys(e.composition)
+            if e.entry_id in m_ids or \
+                    any(subsys in new_systems for subsys in get_subsystems(chemsys)):
+                materials_by_chemsys.setdefault(chemsys, []).append(e)
+                n_materials += 1
+
+        requests = []
+        pbar = tqdm(total=n_materials)
+        for chemsys, materials in materials_by_chemsys.items():
+            pbar.set_description("Processing chemsys: {}".format(chemsys))
+            try:
+                pd_entries = []
+                for subsys in get_subsystems(chemsys):
+                    pd_entries.extend(entries_by_chemsys.get(subsys, []))
+                pd = PhaseDiagram(pd_entries)
+                for entry in materials:
+                    requests.append(UpdateOne({"material_id": entry.entry_id},
+                                              {"$set": get_stability_doc(pd, entry)}))
+            except Exception:
+                import traceback
+                logger.error("There was an error processing chemsys: {}\n{}".format(
+                    chemsys, traceback.format_exc()))
+            pbar.update(len(materials))
+            if len(requests) >= self.batch_size:
+                self._materials.bulk_write(requests, ordered=False)
+                requests = []
+        if requests:
+            self._materials.bulk_write(requests, ordered=False)
+        pbar.close()
+
+    def _get_local_entries(self):
+        """
+        Get the entries of all the materials with an energy, processed by the compatibility
+        scheme.
+
+        Returns:
+            ([ComputedEntry]) entries with the material_id as entry_id
+        """
+        entries = []
+        for m in self._materials.find({"thermo.energy_per_atom": {"$exists": True}},
+                                      {"material_id": 1, "formula_pretty": 1, "calc_settings": 1,
+                                       "thermo.energy_per_atom": 1}):
+            # materials without calc_settings are excluded by the compatibility scheme
+            params = {x: m.get("calc_settings", {}).get(x)
+                      for x in ["is_hubbard", "hubbards", "potcar_spec"]}
+            comp = Composition(m["formula_pretty"])
+            entries.append(ComputedEntry(comp, m["thermo"]["energy_per_atom"] * comp.num_atoms,
+                                         parameters=params, entry_id=m["material_id"]))
+        return self.compatibility.process_entries(entries)
+
     def reset(self):
         logger.info("Resetting MaterialsEhullBuilder")
         self._materials.update_many({}, {"$unset": {"stability": 1}})
@@ -102,3 +214,44 @@ class MaterialsEhullBuilder(AbstractBuilder):
         """
         db_write = get_database(db_file, admin=True)
         return cls(db_write[m], **kwargs)
+
+
+def get_chemsys(composition):
+    """
+    Chemical system of a composition, e.g. "Fe-O".
+    """
+    return "-".join(sorted(el.symbol for el in composition.elements))
+
+
+def get_subsystems(chemsys):
+    """
+    All the chemical systems contained in a chemical system, including itself, e.g. "Fe",
+    "O" and "Fe-O" for "Fe-O".
+    """
+    elements = chemsys.split("-")
+    return ["-".join(subsys) for n in range(1, len(elements) + 1)
+            for subsys in combinations(elements, n)]
+
+
+def get_stability_doc(pd, entry):
+    """
+    Stability information of an entry in a phase diagram, with the fields of
+    MPRester.get_stability.
+
+    Args:
+        pd (PhaseDiagram): phase diagram containing the entry
+        entry (ComputedEntry): the entry
+
+    Returns:
+        (dict) the updates of the material document
+    """
+    decomp, e_above_hull = pd.get_decomp_and_e_above_hull(entry, allow_negative=True)
+    # the numpy scalars are converted, numpy booleans cannot be stored in mongodb
+    e_above_hull = float(e_above_hull)
+    return {"stability": {"e_above_hull": e_above_hull,
+                          "is_stable": e_above_hull <= 1e-8,
+                          "decomposes_to": [{"material_id": e.entry_id,
+                                             "formula": e.composition.reduced_formula,
+                                             "amount": float(amount)}
+                                            for e, amount in decomp.items()]},
+            "thermo.formation_energy_per_atom": float(pd.get_form_energy_per_atom(entry))}
@@ -1,13 +1,16 @@
 # coding: utf-8
 
+import os
+from collections import OrderedDict
 
-from tqdm import tqdm
+from monty.serialization import loadfn
+from pymongo import UpdateOne
 
-from atomate.vasp.builders.utils import dbid_to_int, dbid_to_str
+from atomate.vasp.builders.utils import dbid_to_str
 from atomate.utils.utils import get_database
 
 from atomate.utils.utils import get_logger
-from atomate.vasp.builders.tasks_materials import TasksMaterialsBuilder
+from atomate.vasp.builders.tasks_materials import TasksMaterialsBuilder, module_dir
 from atomate.vasp.builders.base import AbstractBuilder
 
 logger = get_logger(__name__)
@@ -16,7 +19,8 @@ __author__ = 'Alireza Faghanina <albalu@lbl.gov>, Anubhav Jain <ajain@lbl.gov>'
 
 
 class TagsBuilder(AbstractBuilder):
-    def __init__(self, materials_write, tasks_read, tasks_prefix="t"):
+    def __init__(self, materials_write, tasks_read, tasks_prefix="t", update_all=False,
+                 per_task=False, batch_size=1000, settings_file=None):
         """
         Starting with an existing materials collection, searches all its component tasks for
         the "tags" and key in the tasks collection and copies them to the materials collection.
@@ -26,63 +30,149 @@ class TagsBuilder(AbstractBuilder):
             materials_write (pymongo.collection): materials collection with write access.
             tasks_read (pymongo.collection): read-only(for safety) tasks collection.
             tasks_prefix (str): the string prefix for tasks, e.g. "t" for a task_id like "t-132"
-
+            update_all (bool): if True, processes all the tasks. If False, only processes the
+                tasks added or updated since the last run.
+            per_task (bool): if True, looks up the material of each task and updates it once
+                per task. If False, the tags are gathered per material with a single pass
+                over the materials and each material is updated once.
+            batch_size (int): number of material updates sent at once
+            settings_file (str): filepath to the settings of the TasksMaterialsBuilder. The
+                tasks with a task_label not in its supported_task_labels are never in a
+                material, so they are not retried.
         """
         self._materials = materials_write
         self._tasks = tasks_read
         self._tasks_prefix = tasks_prefix
+        self.update_all = update_all
+        self.per_task = per_task
+        self.batch_size = batch_size
+        settings_file = settings_file or os.path.join(
+            module_dir, "tasks_materials_settings.yaml")
+        self.supported_task_labels = loadfn(settings_file)["supported_task_labels"]
+        self._unmapped = []
 
     def run(self):
         logger.info("TagsBuilder starting...")
         self._build_indexes()
 
-        logger.info("Initializing list of all new task_ids to process ...")
-        previous_task_ids = []
-        for m in self._materials.find({"_tagsbuilder": {"$exists": True}},
-                                      {"_tagsbuilder.all_task_ids": 1}):
-            previous_task_ids.extend(m["_tagsbuilder"]["all_task_ids"])
-
-        previous_task_ids = [dbid_to_int(t) for t in previous_task_ids]
-
-        q = {"tags": {"$exists": True}, "task_id": {"$nin": previous_task_ids},
-             "state": "successful"}
-
-        tasks = [t for t in self._tasks.find(q, {"task_id": 1, "tags": 1})]
-        pbar = tqdm(tasks)
-        for t in pbar:
-            try:
-                pbar.set_description("Processing task_id: {}".format(t['task_id']))
-
-                # get the corresponding materials id
-                m = self._materials.find_one({"_tasksbuilder.all_task_ids":
-                                                  dbid_to_str(self._tasks_prefix, t["task_id"])},
-                                             {"material_id": 1, "tags": 1,
-                                              "_tagsbuilder": 1})
-                if m:
-                    all_tags = t["tags"]
-                    if "tags" in m and m["tags"]:
-                        all_tags.extend(m["tags"])
-
-                    all_tasks = [dbid_to_str(self._tasks_prefix, t["task_id"])]
-                    if "_tagsbuilder" in m:
-                        all_tasks.extend(m["_tagsbuilder"]["all_task_ids"])
-
-                    all_tags = list(set(all_tags))  # filter duplicates
-                    self._materials.update_one({"material_id": m["material_id"]},
-                                               {"$set": {"tags": all_tags,
-                                                         "_tagsbuilder.all_task_ids": all_tasks}})
-
-            except:
-                import traceback
-                logger.exception("<---")
-                logger.exception("There was an error processing task_id: {}".format(t["task_id"]))
-                logger.exception(traceback.format_exc())
-                logger.exception("--->")
+        # the tasks added or updated since the last run, and those not in a material in the
+        # previous runs, are processed; the tags are added to the materials with $addToSet, so
+        # processing a task again is harmless
+        q = {"tags": {"$exists": True}, "state": "successful"}
+        unmapped = [] if self.update_all else self.get_state(self._materials, "unmapped") or []
+        self._unmapped = []
+        if self.per_task:
+            # the process function records the tasks not in a material, so it runs in this
+            # process
+            kwargs = {"target": self._materials, "key": "task_id",
+                      "projection": {"task_id": 1, "tags": 1, "task_label": 1}}
+            if unmapped:
+                self.process_documents(self._tasks, dict(q, task_id={"$in": unmapped}),
+                                       self._get_tags_update, **kwargs)
+            self.process_documents(self._tasks, q, self._get_tags_update,
+                                   watermark_field="last_updated", update_all=self.update_all,
+                                   **kwargs)
+        else:
+            self._update_materials_tags(q, unmapped)
+
+        # the tasks that can still be matched by TasksMaterialsBuilder are retried by task_id
+        if self._unmapped:
+            logger.info("{} tasks are not in a material yet.".format(len(self._unmapped)))
+            self.set_state(self._materials, "unmapped", sorted(set(self._unmapped)))
+        elif unmapped:
+            self.reset_state(self._materials, "unmapped")
         logger.info("TagsBuilder finished processing.")
 
+    def _update_materials_tags(self, q, unmapped):
+        """
+        Add the tags of the new tasks to their materials, with one update per material.
+
+        Args:
+            q (dict): query of the tasks with tags
+            unmapped ([int]): task_ids of the tasks not in a material in the previous runs
+        """
+        watermark = self.get_watermark(self._materials)
+        if watermark is not None and not self.update_all:
+            q = {"$and": [q, {"$or": [{"last_updated": {"$gt": watermark}},
+                                      {"task_id": {"$in": unmapped}}]}]}
+
+        task_tags = {}
+        tasks = {}
+        max_value = None
+        for t in self._tasks.find(q, {"task_id": 1, "tags": 1, "last_updated": 1,
+                                      "task_label": 1}):
+            t_id = dbid_to_str(self._tasks_prefix, t["task_id"])
+            task_tags[t_id] = _get_tags(t)
+            tasks[t_id] = t
+            d = t.get("last_updated")
+            if d is not None and (max_value is None or d > max_value):
+                max_value = d
+        logger.info("There are {} new tasks with tags to process.".format(len(task_tags)))
+        if not task_tags:
+            return
+
+        # task_id -> material_id mapping with indexed queries of the materials of the new tasks,
+        # gathering the tags and task_ids of each material
+        material_tags = OrderedDict()
+        t_ids = list(task_tags)
+        for i in range(0, len(t_ids), self.batch_size):
+            for m in self._materials.find(
+                    {"_tasksbuilder.all_task_ids": {"$in": t_ids[i:i + self.batch_size]}},
+                    {"material_id": 1, "_tasksbuilder.all_task_ids": 1}):
+                for t_id in m["_tasksbuilder"]["all_task_ids"]:
+                    if t_id in task_tags:
+                        tags, m_t_ids = material_tags.setdefault(m["material_id"], (set(), []))
+                        tags.update(task_tags[t_id])
+                        m_t_ids.append(t_id)
+
+        requests = [UpdateOne({"material_id": m_id},
+                              {"$addToSet": {"tags": {"$each": sorted(tags)},
+                                             "_tagsbuilder.all_task_ids": {"$each": m_t_ids}}})
+                    for m_id, (tags, m_t_ids) in material_tags.items()]
+        for i in range(0, len(requests), self.batch_size):
+            self._materials.bulk_write(requests[i:i + self.batch_size], ordered=False)
+        logger.info("Updated the tags of {} materials.".format(len(requests)))
+
+        mapped = set(t_id for tags, m_t_ids in material_tags.values() for t_id in m_t_ids)
+        for t_id, t in tasks.items():
+            if t_id not in mapped:
+                self._add_unmapped(t)
+        if max_value is not None and (watermark is None or max_value > watermark):
+            self.set_watermark(self._materials, max_value)
+
+    def _get_tags_update(self, t):
+        """
+        Get the update adding the tags of a task to its material.
+
+        Args:
+            t (dict): task document with the "task_id", "tags" and "task_label" keys
+
+        Returns:
+            (UpdateOne) the update of the material, or None if the task is not in a material
+            yet
+        """
+        t_id = dbid_to_str(self._tasks_prefix, t["task_id"])
+        m = self._materials.find_one({"_tasksbuilder.all_task_ids": t_id}, {"material_id": 1})
+        if not m:
+            self._add_unmapped(t)
+            return None
+        return UpdateOne({"material_id": m["material_id"]},
+                         {"$addToSet": {"tags": {"$each": _get_tags(t)},
+                                        "_tagsbuilder.all_task_ids": t_id}})
+
+    def _add_unmapped(self, t):
+        """
+        Record a task not in a material, to retry it in the next run if TasksMaterialsBuilder
+        can still match it.
+        """
+        if t.get("task_label") in self.supported_task_labels:
+            self._unmapped.append(t["task_id"])
+
     def reset(self):
         logger.info("Resetting TagsBuilder")
         self._materials.update_many({}, {"$unset": {"tags": 1, "_tagsbuilder": 1}})
+        self.reset_watermark(self._materials)
+        self.reset_state(self._materials, "unmapped")
         self._build_indexes()
         logger.info("Finished resetting TagsBuilder")
 
@@ -108,3 +198,8 @@ class TagsBuilder(AbstractBuilder):
             print("Warning: could not get read-only database; using write creds")
             db_read = get_database(db_file, admin=True)
         return cls(db_write[m], db_read[t], **kwargs)
+
+
+def _get_tags(t):
+    tags = t["tags"]
+    return [tags] if isinstance(tags, str) else tags
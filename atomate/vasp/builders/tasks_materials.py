@@ -2,18 +2,24 @@
 
 
 import os
+import traceback
+import multiprocessing
+from collections import OrderedDict, deque
+from copy import deepcopy
 from datetime import datetime
 
-from pymongo import ReturnDocument
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 from tqdm import tqdm
 
 from atomate.utils.utils import get_mongolike, get_logger
 from atomate.vasp.builders.base import AbstractBuilder
-from atomate.vasp.builders.utils import dbid_to_str, dbid_to_int
+from atomate.vasp.builders.instrumentation import profile_section
+from atomate.vasp.builders.utils import dbid_to_str, dbid_to_int, MaterialsIndex, \
+    get_structure_fingerprint, get_fingerprint_bounds
 from atomate.utils.utils import get_database
 from monty.serialization import loadfn
 from pymatgen import Structure
-from pymatgen.analysis.structure_matcher import StructureMatcher, ElementComparator
 
 logger = get_logger(__name__)
 
@@ -32,7 +38,8 @@ There is lots of config for this builder in the accompanying "tasks_materials_se
 
 class TasksMaterialsBuilder(AbstractBuilder):
     def __init__(self, materials_write, counter_write, tasks_read, tasks_prefix="t",
-                 materials_prefix="m", query=None, settings_file=None):
+                 materials_prefix="m", query=None, settings_file=None, use_fingerprints=True,
+                 nproc=1, processed_write=None, chunk_size=10000, group_size=1000):
         """
         Create a materials collection from a tasks collection.
 
@@ -44,6 +51,21 @@ class TasksMaterialsBuilder(AbstractBuilder):
             materials_prefix (str): a string prefix to prepend to material_ids
             query (dict): a pymongo query on tasks_read for which tasks to include in the builder
             settings_file (str): filepath to a custom settings path
+            use_fingerprints (bool): pre-filter the materials to match with a task by the
+                structure fingerprint stored in "_tasksbuilder.fingerprint", so that only the
+                materials with similar primitive cells are compared with the StructureMatcher.
+                The fingerprint of the materials built without it is added when they are
+                first compared.
+            nproc (int): number of processes matching the new tasks with materials. The tasks
+                are grouped by formula_reduced_abc and each group is matched in a single
+                process, so that no two processes can create the same material.
+            processed_write (pymongo.collection): mongodb collection recording the task_ids
+                already processed and their material_id (write access needed). Defaults to the
+                "<materials collection name>_processed_tasks" collection.
+            chunk_size (int): number of task_ids looked up at a time in processed_write
+            group_size (int): maximum number of tasks of a formula matched at a time. The tasks
+                of a larger formula group are matched in successive parts, each part being
+                matched with the materials created by the previous ones.
         """
 
         settings_file = settings_file or os.path.join(
@@ -62,17 +84,25 @@ class TasksMaterialsBuilder(AbstractBuilder):
         if self._counter.find({"_id": "materialid"}).count() == 0:
             self._counter.insert_one({"_id": "materialid", "c": 0})
 
+        if processed_write is None:
+            processed_write = materials_write.database[
+                "{}_processed_tasks".format(materials_write.name)]
+        self._processed = processed_write
+        self._processed.create_index("task_id", unique=True)
+
         self._tasks = tasks_read
         self._t_prefix = tasks_prefix
         self._m_prefix = materials_prefix
         self.query = query
+        self.use_fingerprints = use_fingerprints
+        self.nproc = nproc
+        self.chunk_size = chunk_size
+        self.group_size = group_size
 
     def run(self):
         logger.info("MaterialsTaskBuilder starting...")
+        self._migrate_processed_task_ids()
         logger.info("Initializing list of all new task_ids to process ...")
-        previous_task_ids = []
-        for m in self._materials.find({}, {"_tasksbuilder.all_task_ids": 1}):
-            previous_task_ids.extend(m["_tasksbuilder"]["all_task_ids"])
 
         q = {"state": "successful", "task_label": {"$in": self.supported_task_labels}}
 
@@ -83,34 +113,123 @@ class TasksMaterialsBuilder(AbstractBuilder):
                                  format(common_keys))
             q.update(self.query)
 
-        all_task_ids = [dbid_to_str(self._t_prefix, t["task_id"]) for t in
-                        self._tasks.find(q, {"task_id": 1})]
-        task_ids = [t_id for t_id in all_task_ids if t_id not in previous_task_ids]
+        # only the new task_ids are kept in memory: the tasks are checked against the processed
+        # task_ids collection a chunk at a time
+        groups = OrderedDict()
+        n_tasks = 0
+        chunk = OrderedDict()
+        cursor = self._tasks.find(q, {"task_id": 1, "formula_reduced_abc": 1})
+        for t in cursor.batch_size(self.chunk_size):
+            if t.get("formula_reduced_abc") is None:
+                logger.error("Task {} has no formula_reduced_abc, skipping it.".format(
+                    t["task_id"]))
+                continue
+            chunk[dbid_to_str(self._t_prefix, t["task_id"])] = t["formula_reduced_abc"]
+            if len(chunk) == self.chunk_size:
+                n_tasks += self._add_new_task_ids(chunk, groups)
+                chunk = OrderedDict()
+        n_tasks += self._add_new_task_ids(chunk, groups)
+        groups = list(groups.values())
+
+        logger.info("There are {} new task_ids to process.".format(n_tasks))
+
+        pbar = tqdm(total=n_tasks)
+        pool = multiprocessing.Pool(self.nproc) if self.nproc > 1 else None
+        try:
+            # the groups are sent to the workers a few at a time to bound the memory used by the
+            # task documents waiting for their matches
+            for batch in _get_batches(groups, 4 * self.nproc, self.group_size):
+                jobs = [self._get_match_job(group) for group in batch]
+                pbar.update(sum(len(group) - len(taskdocs)
+                                for group, (_, taskdocs) in zip(batch, jobs)))
+                jobs = [(job, taskdocs) for job, taskdocs in jobs if taskdocs]
+                args = [job for job, _ in jobs]
+                results = pool.imap(_match_task_group, args) if pool else \
+                    map(_match_task_group, args)
+                for _, taskdocs in jobs:
+                    # the time spent matching, or waiting for the workers
+                    with profile_section("task_group_matching"):
+                        matches, fingerprints = next(results)
+                    pbar.set_description("Processing formula: {}".format(
+                        taskdocs[0]["formula_reduced_abc"]))
+                    try:
+                        self._update_materials(taskdocs, matches, fingerprints)
+                    except:
+                        logger.exception("<---")
+                        logger.exception("There was an error processing task_ids: {}".format(
+                            [t["task_id"] for t in taskdocs]))
+                        logger.exception(traceback.format_exc())
+                        logger.exception("--->")
+                    pbar.update(len(taskdocs))
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
 
-        logger.info("There are {} new task_ids to process.".format(len(task_ids)))
+        logger.info("TasksMaterialsBuilder finished processing.")
 
-        pbar = tqdm(task_ids)
-        for t_id in pbar:
-            pbar.set_description("Processing task_id: {}".format(t_id))
-            try:
-                taskdoc = self._tasks.find_one({"task_id": dbid_to_int(t_id)})
-                m_id = self._match_material(taskdoc)
-                if not m_id:
-                    m_id = self._create_new_material(taskdoc)
-                self._update_material(m_id, taskdoc)
-
-            except:
-                import traceback
-                logger.exception("<---")
-                logger.exception("There was an error processing task_id: {}".format(t_id))
-                logger.exception(traceback.format_exc())
-                logger.exception("--->")
+    def _add_new_task_ids(self, formulas, groups):
+        """
+        Add the task_ids that were not processed yet to their formula group.
 
-        logger.info("TasksMaterialsBuilder finished processing.")
+        Args:
+            formulas (OrderedDict): formula_reduced_abc by task_id
+            groups (OrderedDict): lists of task_ids by formula_reduced_abc, updated in place
+
+        Returns:
+            (int) the number of new task_ids
+        """
+        processed = {d["task_id"] for d in self._processed.find(
+            {"task_id": {"$in": list(formulas)}}, {"task_id": 1})}
+        n = 0
+        for t_id, formula in formulas.items():
+            if t_id not in processed:
+                groups.setdefault(formula, []).append(t_id)
+                n += 1
+        return n
+
+    def _set_processed(self, task_ids):
+        """
+        Record that tasks were processed.
+
+        Args:
+            task_ids (dict): material_id by task_id
+        """
+        if task_ids:
+            self._processed.bulk_write(
+                [UpdateOne({"task_id": t_id}, {"$set": {"material_id": m_id}}, upsert=True)
+                 for t_id, m_id in task_ids.items()], ordered=False)
+
+    def _migrate_processed_task_ids(self):
+        """
+        Fill the processed task_ids collection from the "_tasksbuilder.all_task_ids" of the
+        materials, for a materials collection built before the collection existed.
+        """
+        if self._processed.find_one() is not None or self._materials.find_one(
+                {"_tasksbuilder.all_task_ids.0": {"$exists": True}}) is None:
+            return
+        logger.info("Recording the processed task_ids of the existing materials...")
+        docs = []
+        for m in self._materials.find({}, {"material_id": 1, "_tasksbuilder.all_task_ids": 1}):
+            docs.extend({"task_id": t_id, "material_id": m["material_id"]}
+                        for t_id in m["_tasksbuilder"]["all_task_ids"])
+            if len(docs) >= self.chunk_size:
+                self._insert_processed(docs)
+                docs = []
+        self._insert_processed(docs)
+
+    def _insert_processed(self, docs):
+        if docs:
+            try:
+                self._processed.insert_many(docs, ordered=False)
+            except BulkWriteError:
+                # task_ids listed in several materials
+                pass
 
     def reset(self):
         logger.info("Resetting TasksMaterialsBuilder")
         self._materials.delete_many({})
+        self._processed.delete_many({})
         self._counter.delete_one({"_id": "materialid"})
         self._counter.insert_one({"_id": "materialid", "c": 0})
         self._build_indexes()
@@ -142,6 +261,8 @@ class TasksMaterialsBuilder(AbstractBuilder):
         Create indexes for faster searching
         """
         self._materials.create_index("material_id", unique=True)
+        self._materials.create_index([("formula_reduced_abc", 1), ("sg_number", 1),
+                                      ("_tasksbuilder.fingerprint.nsites", 1)])
         for index in self.indexes:
             self._materials.create_index(index)
 
@@ -172,19 +293,156 @@ class TasksMaterialsBuilder(AbstractBuilder):
             t_struct = Structure.from_dict(taskdoc["output"]["structure"])
             q = {"formula_reduced_abc": formula, "sg_number": sgnum}
 
-        for m in self._materials.find(q, {"parent_structure": 1, "structure": 1, "material_id": 1}):
-            s_dict = m["parent_structure"]["structure"] if "parent_structure" in m else m[
-                "structure"]
-            m_struct = Structure.from_dict(s_dict)
-            sm = StructureMatcher(ltol=ltol, stol=stol, angle_tol=angle_tol,
-                                  primitive_cell=True, scale=True,
-                                  attempt_supercell=False, allow_subset=False,
-                                  comparator=ElementComparator())
+        if self.use_fingerprints:
+            fingerprint = get_structure_fingerprint(t_struct)
+            fp_query = {"_tasksbuilder.fingerprint.nsites": fingerprint["nsites"]}
+            for i, length in enumerate(fingerprint["lengths"]):
+                lower, upper = get_fingerprint_bounds(length, ltol)
+                fp_query["_tasksbuilder.fingerprint.lengths.{}".format(i)] = {"$gte": lower,
+                                                                             "$lte": upper}
+            q["$or"] = [fp_query, {"_tasksbuilder.fingerprint": {"$exists": False}}]
+
+        materials = [_get_material_entry(m) for m in self._materials.find(q, MATERIAL_PROJECTION)]
+        matches, fingerprints = _match_task_group(
+            ([_get_task_entry(taskdoc)], materials, (ltol, stol, angle_tol), self.use_fingerprints))
+        for m_id, fp in fingerprints.items():
+            self._materials.update_one({"material_id": m_id},
+                                       {"$set": {"_tasksbuilder.fingerprint": fp}})
+
+        m_id, error = matches[0]
+        if error:
+            raise RuntimeError(error)
+        return None if isinstance(m_id, tuple) else m_id
+
+    def _get_match_job(self, task_ids, ltol=0.2, stol=0.3, angle_tol=5):
+        """
+        Get the task documents of a group of tasks with the same formula and the arguments of
+        _match_task_group to match them with the materials of this formula.
+
+        Args:
+            task_ids ([str]): task_ids of the tasks
+            ltol (float): StructureMatcher tuning parameter
+            stol (float): StructureMatcher tuning parameter
+            angle_tol (float): StructureMatcher tuning parameter
+
+        Returns:
+            (tuple, [dict]) the arguments of _match_task_group and the task documents, in the
+            order of task_ids. The tasks that cannot be matched are logged and left out.
+        """
+        order = {dbid_to_int(t_id): i for i, t_id in enumerate(task_ids)}
+        tasks = []
+        taskdocs = []
+        for taskdoc in sorted(self._tasks.find({"task_id": {"$in": list(order)}},
+                                               self._get_task_projection()),
+                              key=lambda t: order[t["task_id"]]):
+            try:
+                tasks.append(_get_task_entry(taskdoc))
+                taskdocs.append(taskdoc)
+            except Exception:
+                logger.error("There was an error processing task_id: {}\n{}".format(
+                    taskdoc["task_id"], traceback.format_exc()))
+        formulas = {t["formula"] for t in tasks}
+        materials = [_get_material_entry(m) for m in self._materials.find(
+            {"formula_reduced_abc": {"$in": list(formulas)}}, MATERIAL_PROJECTION)]
+        return (tasks, materials, (ltol, stol, angle_tol), self.use_fingerprints), taskdocs
+
+    def _get_task_projection(self):
+        """
+        The projection of the task documents on the fields used to match the tasks and to
+        build the materials.
+
+        Returns:
+            (dict) the projection
+        """
+        fields = set(TASK_PROJECTION)
+        for x in self.property_settings:
+            for p in x["properties"]:
+                fields.add("{}.{}".format(x["tasks_key"], p) if x.get("tasks_key") else p)
+        # a field is projected with its subfields
+        return {f: 1 for f in fields
+                if not any(f.startswith(other + ".") for other in fields)}
 
-            if sm.fit(m_struct, t_struct):
-                return m["material_id"]
+    def _update_materials(self, taskdocs, matches, fingerprints):
+        """
+        Create the new materials and update the properties of the materials matched with a
+        group of tasks, with a single $set per material sent in one bulk_write. The tasks that
+        fail are logged and not recorded as processed, so that they are retried by the next run.
 
-        return None
+        Args:
+            taskdocs ([dict]): the task documents
+            matches ([tuple]): the (material_id, error) of each task as returned by
+                _match_task_group
+            fingerprints (dict): fingerprints computed for existing materials, by material_id
+        """
+        # the metadata of the properties of the existing materials
+        m_ids = list({m_id for m_id, error in matches
+                      if not error and not isinstance(m_id, tuple)})
+        prop_metadata = {m["material_id"]: m["_tasksbuilder"]["prop_metadata"] for m in
+                         self._materials.find({"material_id": {"$in": m_ids}},
+                                              {"material_id": 1,
+                                               "_tasksbuilder.prop_metadata": 1})}
+
+        # accumulate the property updates of the tasks in the order of the tasks, the new
+        # materials being identified by their ("new", i) key until they get a material_id
+        updates = OrderedDict((m_id, {"_tasksbuilder.fingerprint": fp})
+                              for m_id, fp in fingerprints.items())
+        new_docs = OrderedDict()
+        not_created = set()
+        matched = []
+        with profile_section("compute"):
+            for taskdoc, (m_id, error) in zip(taskdocs, matches):
+                new = isinstance(m_id, tuple) and m_id not in new_docs
+                if not error and m_id in not_created:
+                    error = "The material matched with the task was not created."
+                if not error:
+                    try:
+                        if new:
+                            doc = self._get_new_material_doc(taskdoc, None)
+                            metadata = deepcopy(doc["_tasksbuilder"]["prop_metadata"])
+                        else:
+                            metadata = deepcopy(prop_metadata[m_id])
+                        update = self._get_property_updates(metadata, taskdoc)
+                    except Exception:
+                        error = traceback.format_exc()
+                if error:
+                    logger.error("There was an error processing task_id: {}\n{}".format(
+                        taskdoc["task_id"], error))
+                    if new:
+                        # the tasks matched with the material created by this task are left
+                        # for the next run
+                        not_created.add(m_id)
+                    continue
+                if new:
+                    new_docs[m_id] = doc
+                prop_metadata[m_id] = metadata
+                updates.setdefault(m_id, {}).update(update)
+                matched.append((taskdoc, m_id))
+
+        # create the new materials, with a single counter update for their material_ids
+        material_ids = {}
+        if new_docs:
+            last = self._counter.find_one_and_update(
+                {"_id": "materialid"}, {"$inc": {"c": len(new_docs)}},
+                return_document=ReturnDocument.AFTER)["c"]
+            for i, (key, doc) in enumerate(new_docs.items()):
+                material_ids[key] = dbid_to_str(self._m_prefix, last - len(new_docs) + i + 1)
+                doc["material_id"] = material_ids[key]
+            self._materials.insert_many(list(new_docs.values()))
+
+        task_ids = {}
+        for taskdoc, m_id in matched:
+            task_ids.setdefault(material_ids.get(m_id, m_id), []).append(
+                dbid_to_str(self._t_prefix, taskdoc["task_id"]))
+        requests = []
+        for m_id, update in updates.items():
+            m_id = material_ids.get(m_id, m_id)
+            update = {"$set": update} if update else {}
+            if m_id in task_ids:
+                update["$push"] = {"_tasksbuilder.all_task_ids": {"$each": task_ids[m_id]}}
+            requests.append(UpdateOne({"material_id": m_id}, update))
+        if requests:
+            self._materials.bulk_write(requests, ordered=False)
+        self._set_processed({t_id: m_id for m_id, t_ids in task_ids.items() for t_id in t_ids})
 
     def _create_new_material(self, taskdoc):
         """
@@ -196,15 +454,35 @@ class TasksMaterialsBuilder(AbstractBuilder):
         Returns:
             (int) - material_id of the new document
         """
+        m_id = dbid_to_str(
+            self._m_prefix, self._counter.find_one_and_update(
+                {"_id": "materialid"}, {"$inc": {"c": 1}},
+                return_document=ReturnDocument.AFTER)["c"])
+        self._materials.insert_one(self._get_new_material_doc(taskdoc, m_id))
+        return m_id
+
+    def _get_new_material_doc(self, taskdoc, m_id):
+        """
+        Get the document of a new material created from a task.
+
+        Args:
+            taskdoc (dict): a JSON-like task document
+            m_id (str): material_id of the new document
+
+        Returns:
+            (dict) the material document
+        """
         doc = {"created_at": datetime.utcnow()}
         doc["_tasksbuilder"] = {"all_task_ids": [], "prop_metadata":
             {"labels": {}, "task_ids": {}}, "updated_at": datetime.utcnow()}
+        if self.use_fingerprints:
+            s_dict = taskdoc["parent_structure"]["structure"] if "parent_structure" in taskdoc \
+                else taskdoc["output"]["structure"]
+            doc["_tasksbuilder"]["fingerprint"] = get_structure_fingerprint(
+                Structure.from_dict(s_dict))
         doc["spacegroup"] = taskdoc["output"]["spacegroup"]
         doc["structure"] = taskdoc["output"]["structure"]
-        doc["material_id"] = dbid_to_str(
-            self._m_prefix, self._counter.find_one_and_update(
-                {"_id": "materialid"}, {"$inc": {"c": 1}},
-                return_document=ReturnDocument.AFTER)["c"])
+        doc["material_id"] = m_id
 
         doc["sg_symbol"] = doc["spacegroup"]["symbol"]
         doc["sg_number"] = doc["spacegroup"]["number"]
@@ -219,9 +497,7 @@ class TasksMaterialsBuilder(AbstractBuilder):
             t_struct = Structure.from_dict(taskdoc["parent_structure"]["structure"])
             doc["parent_structure"]["formula_reduced_abc"] = t_struct.composition.reduced_formula
 
-        self._materials.insert_one(doc)
-
-        return doc["material_id"]
+        return doc
 
     def _update_material(self, m_id, taskdoc):
         """
@@ -231,13 +507,38 @@ class TasksMaterialsBuilder(AbstractBuilder):
             m_id (int): material_id for material document to update
             taskdoc (dict): a JSON-like task document
         """
+        prop_metadata = self._materials.find_one(
+            {"material_id": m_id}, {"_tasksbuilder.prop_metadata": 1})[
+            "_tasksbuilder"]["prop_metadata"]
+        update = {"$push": {"_tasksbuilder.all_task_ids": dbid_to_str(
+            self._t_prefix, taskdoc["task_id"])}}
+        prop_updates = self._get_property_updates(prop_metadata, taskdoc)
+        if prop_updates:
+            update["$set"] = prop_updates
+
+        self._materials.update_one({"material_id": m_id}, update)
+
+        # update the database to reflect that this task_id was already processed
+        self._set_processed({dbid_to_str(self._t_prefix, taskdoc["task_id"]): m_id})
+
+    def _get_property_updates(self, prop_metadata, taskdoc):
+        """
+        Get the updates of a material document based on a new task and using complex logic.
+
+        Args:
+            prop_metadata (dict): the "_tasksbuilder.prop_metadata" of the material, updated
+                in place with the metadata of the properties taken from this task
+            taskdoc (dict): a JSON-like task document
+
+        Returns:
+            (dict) the fields to $set in the material document
+        """
+        updates = {}
 
         # For each materials property, figure out what kind of task the data is currently based on
         # as defined by the task label.  This is used to decide if the new taskdoc is a type of
         # calculation that provides higher quality data for that property
-        prop_tlabels = self._materials.find_one(
-            {"material_id": m_id}, {"_tasksbuilder.prop_metadata.labels": 1})[
-            "_tasksbuilder"]["prop_metadata"]["labels"]
+        prop_tlabels = prop_metadata["labels"]
 
         task_label = taskdoc["task_label"]  # task label of new doc that updates this material
 
@@ -258,9 +559,7 @@ class TasksMaterialsBuilder(AbstractBuilder):
                     if not m_quality or t_quality > m_quality \
                             or (t_quality == m_quality
                                 and taskdoc["output"]["energy_per_atom"] <
-                                    self._materials.find_one({"material_id": m_id}, {
-                                        "_tasksbuilder": 1})["_tasksbuilder"]["prop_metadata"][
-                                        "energies"][p]):
+                                    prop_metadata["energies"][p]):
 
                         # this task has better quality data
                         # figure out where the property data lives in the materials doc and
@@ -271,23 +570,127 @@ class TasksMaterialsBuilder(AbstractBuilder):
                             if x.get("tasks_key") else p
 
                         # insert property data AND metadata about this task
-                        self._materials.\
-                            update_one({"material_id": m_id},
-                                       {"$set": {materials_key: get_mongolike(taskdoc, tasks_key),
-                                                 "_tasksbuilder.prop_metadata.labels.{}".format(p): task_label,
-                                                 "_tasksbuilder.prop_metadata.task_ids.{}".format(p): dbid_to_str(
-                                                     self._t_prefix, taskdoc["task_id"]),
-                                                 "_tasksbuilder.prop_metadata.energies.{}".format(p): taskdoc["output"]["energy_per_atom"],
-                                                 "_tasksbuilder.updated_at": datetime.utcnow()}})
+                        t_id = dbid_to_str(self._t_prefix, taskdoc["task_id"])
+                        energy = taskdoc["output"]["energy_per_atom"]
+                        updates.update({materials_key: get_mongolike(taskdoc, tasks_key),
+                                        "_tasksbuilder.prop_metadata.labels.{}".format(p): task_label,
+                                        "_tasksbuilder.prop_metadata.task_ids.{}".format(p): t_id,
+                                        "_tasksbuilder.prop_metadata.energies.{}".format(p): energy,
+                                        "_tasksbuilder.updated_at": datetime.utcnow()})
+                        prop_tlabels[p] = task_label
+                        prop_metadata["task_ids"][p] = t_id
+                        prop_metadata.setdefault("energies", {})[p] = energy
 
                         # copy property to document root if in properties_root
                         # i.e., intentionally duplicate some data to the root level
                         if p in self.properties_root:
-                            self._materials.\
-                            update_one({"material_id": m_id},
-                                       {"$set": {p: get_mongolike(taskdoc, tasks_key)}})
-
-        # update the database to reflect that this task_id was already processed
-        self._materials.update_one({"material_id": m_id},
-                                   {"$push": {"_tasksbuilder.all_task_ids": dbid_to_str(
-                                       self._t_prefix, taskdoc["task_id"])}})
+                            updates[p] = get_mongolike(taskdoc, tasks_key)
+
+        return updates
+
+
+TASK_PROJECTION = ["task_id", "task_label", "formula_reduced_abc", "formula_anonymous",
+                   "formula_pretty", "elements", "nelements", "chemsys", "output.spacegroup",
+                   "output.structure", "output.energy_per_atom", "parent_structure"]
+
+MATERIAL_PROJECTION = {"material_id": 1, "formula_reduced_abc": 1, "sg_number": 1,
+                       "structure": 1, "parent_structure": 1, "_tasksbuilder.fingerprint": 1}
+
+
+def _get_task_entry(taskdoc):
+    """
+    The data of a task used by _match_task_group.
+    """
+    entry = {"task_id": taskdoc["task_id"], "formula": taskdoc["formula_reduced_abc"],
+             "sg_number": taskdoc["output"]["spacegroup"]["number"]}
+    # handle the "parent structure" option, which is used to intentionally force slightly
+    # different structures to contribute to the same "material", e.g. from an ordering scheme
+    if "parent_structure" in taskdoc:
+        entry["parent_sg"] = taskdoc["parent_structure"]["spacegroup"]["number"]
+        entry["structure"] = taskdoc["parent_structure"]["structure"]
+    else:
+        entry["parent_sg"] = None
+        entry["structure"] = taskdoc["output"]["structure"]
+    return entry
+
+
+def _get_batches(groups, n_groups, group_size):
+    """
+    Split groups of tasks with the same formula in batches of at most n_groups groups of at
+    most group_size tasks. The parts of a larger group are in successive batches, so that each
+    part is matched with the materials created by the previous ones.
+
+    Args:
+        groups ([[str]]): the task_ids of each formula
+        n_groups (int): maximum number of groups in a batch
+        group_size (int): maximum number of tasks in a group
+
+    Returns:
+        (generator) the batches, as lists of lists of task_ids
+    """
+    parts = deque(deque(group[i:i + group_size] for i in range(0, len(group), group_size))
+                  for group in groups)
+    while parts:
+        batch = []
+        remaining = []
+        while parts and len(batch) < n_groups:
+            group = parts.popleft()
+            batch.append(group.popleft())
+            if group:
+                remaining.append(group)
+        # the rest of the large groups come first in the next batch
+        parts.extendleft(reversed(remaining))
+        yield batch
+
+
+def _get_material_entry(m):
+    """
+    The data of a material document used by _match_task_group.
+    """
+    parent = m.get("parent_structure")
+    return {"material_id": m["material_id"], "formula": m["formula_reduced_abc"],
+            "sg_number": m.get("sg_number"),
+            "parent_sg": parent["spacegroup"]["number"] if parent else None,
+            "structure": parent["structure"] if parent else m["structure"],
+            "fingerprint": m.get("_tasksbuilder", {}).get("fingerprint")}
+
+
+def _match_task_group(args):
+    """
+    Match tasks with the same formula with materials; used as the worker of
+    TasksMaterialsBuilder.run. The tasks are matched in order, each task that does not match
+    any material creating a new one that the next tasks can match.
+
+    Args:
+        args (tuple): the task entries, the material entries of the formula, the ltol, stol
+            and angle_tol of the StructureMatcher and whether to use the structure fingerprints
+
+    Returns:
+        ([tuple], dict) the (material_id, error traceback) of each task, where the material_id
+        of a new material is ("new", i), and the fingerprints computed for the materials that
+        had none, by material_id
+    """
+    tasks, materials, tolerances, use_fingerprints = args
+    index = MaterialsIndex(*tolerances, use_fingerprints=use_fingerprints)
+    for m in materials:
+        index.add(m["material_id"], m["formula"], m["sg_number"], m["structure"],
+                  parent_sg=m["parent_sg"], fingerprint=m["fingerprint"])
+    matches = []
+    n_new = 0
+    for task in tasks:
+        try:
+            with profile_section("structure_deserialization"):
+                t_struct = Structure.from_dict(task["structure"])
+            with profile_section("structure_matching"):
+                t_fingerprint = get_structure_fingerprint(t_struct) if use_fingerprints else None
+            m_id = index.match(task["formula"], task["sg_number"], t_struct,
+                               parent_sg=task["parent_sg"], fingerprint=t_fingerprint)
+            if m_id is None:
+                m_id = ("new", n_new)
+                n_new += 1
+                index.add(m_id, task["formula"], task["sg_number"], t_struct,
+                          parent_sg=task["parent_sg"], fingerprint=t_fingerprint)
+            matches.append((m_id, None))
+        except Exception:
+            matches.append((None, traceback.format_exc()))
+    return matches, index.new_fingerprints
@@ -0,0 +1,107 @@
+# coding: utf-8
+
+import unittest
+
+from atomate.vasp.builders.base import AbstractBuilder, _add_projection_fields
+from atomate.utils.testing import AtomateTest
+
+
+def double(doc):
+    if doc.get("fail"):
+        raise ValueError("failed")
+    return {"y": 2 * doc["x"]}
+
+
+class DoubleBuilder(AbstractBuilder):
+
+    def __init__(self, coll, **kwargs):
+        self.coll = coll
+        self.kwargs = kwargs
+
+    def run(self, **kwargs):
+        return self.process_documents(self.coll, {}, double, projection=["x", "fail"],
+                                      watermark_field="meta.n", **dict(self.kwargs, **kwargs))
+
+    def reset(self):
+        self.reset_watermark(self.coll)
+
+    @classmethod
+    def from_file(cls, db_file):
+        raise NotImplementedError
+
+
+class ProcessDocumentsTest(AtomateTest):
+
+    def setUp(self):
+        super(ProcessDocumentsTest, self).setUp()
+        self.coll = self.get_task_database().docs
+        self.coll.insert_many([{"x": i, "meta": {"n": i}} for i in range(1, 6)])
+
+    def test_watermark(self):
+        for nproc in [1, 2]:
+            builder = DoubleBuilder(self.coll, nproc=nproc, chunk_size=2)
+            builder.reset()
+            self.coll.update_many({}, {"$unset": {"y": 1}})
+            stats = builder.run()
+            self.assertEqual((stats["n_docs"], stats["n_updates"], stats["n_errors"]), (5, 5, 0))
+            self.assertEqual([d["y"] for d in self.coll.find(sort=[("x", 1)])],
+                             [2, 4, 6, 8, 10])
+            self.assertEqual(builder.get_watermark(self.coll), 5)
+
+            # only the documents changed since the last run are processed
+            self.assertEqual(builder.run()["n_docs"], 0)
+            self.coll.update_one({"x": 3}, {"$set": {"x": 30, "meta.n": 6}})
+            self.assertEqual(builder.run()["n_docs"], 1)
+            self.assertEqual(self.coll.find_one({"x": 30})["y"], 60)
+            self.assertEqual(builder.run(update_all=True)["n_docs"], 5)
+            self.coll.update_one({"x": 30}, {"$set": {"x": 3, "meta.n": 3}})
+
+    def test_failed(self):
+        builder = DoubleBuilder(self.coll)
+        self.coll.update_one({"x": 3}, {"$set": {"fail": True}})
+        stats = builder.run()
+        self.assertEqual((stats["n_updates"], stats["n_errors"]), (4, 1))
+        # the watermark moves past the failed document, which is retried by key
+        self.assertEqual(builder.get_watermark(self.coll), 5)
+        self.assertEqual(builder.run()["n_docs"], 1)
+        self.coll.update_one({"x": 3}, {"$unset": {"fail": 1}})
+        self.coll.update_one({"x": 5}, {"$set": {"fail": True, "meta.n": 6}})
+        stats = builder.run()
+        self.assertEqual((stats["n_docs"], stats["n_updates"], stats["n_errors"]), (2, 1, 1))
+        self.assertEqual(self.coll.find_one({"x": 3})["y"], 6)
+        self.assertEqual(builder.get_watermark(self.coll), 6)
+
+        self.coll.update_one({"x": 5}, {"$unset": {"fail": 1}})
+        self.assertEqual(builder.run()["n_updates"], 1)
+        self.assertEqual(builder.run()["n_docs"], 0)
+        self.assertIsNone(builder.get_state(self.coll, "failed"))
+
+        # the failed documents are processed again after a reset
+        self.coll.update_one({"x": 1}, {"$set": {"fail": True}})
+        builder.run(update_all=True)
+        self.assertEqual(builder.get_state(self.coll, "failed"),
+                         [self.coll.find_one({"x": 1})["_id"]])
+        builder.reset()
+        self.assertIsNone(builder.get_state(self.coll, "failed"))
+
+    def test_missing_field(self):
+        builder = DoubleBuilder(self.coll, missing_field="y")
+        self.coll.update_one({"x": 3}, {"$set": {"fail": True}})
+        builder.run()
+        # the failed document is retried as long as it has no result, without holding the
+        # watermark back
+        self.assertEqual(builder.get_watermark(self.coll), 5)
+        self.assertEqual(builder.run()["n_docs"], 1)
+        self.coll.update_one({"x": 3}, {"$unset": {"fail": 1}})
+        self.assertEqual(builder.run()["n_updates"], 1)
+        self.assertEqual(builder.run()["n_docs"], 0)
+
+    def test_add_projection_fields(self):
+        self.assertEqual(_add_projection_fields({"meta": 1}, ["meta.n", "x", None, "_id"]),
+                         {"meta": 1, "x": 1})
+        self.assertEqual(_add_projection_fields({"_id": 0}, ["x"]), {"_id": 0})
+        self.assertEqual(_add_projection_fields(["meta"], ["meta.n", "x"]), ["meta", "x"])
+
+
+if __name__ == "__main__":
+    unittest.main()
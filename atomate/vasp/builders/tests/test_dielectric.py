@@ -0,0 +1,54 @@
+# coding: utf-8
+
+import datetime
+import unittest
+
+from atomate.vasp.builders.bandgap_estimation import BandgapEstimationBuilder
+from atomate.vasp.builders.dielectric import DielectricBuilder
+from atomate.utils.testing import AtomateTest
+
+
+class DielectricBuilderTest(AtomateTest):
+
+    def setUp(self):
+        super(DielectricBuilderTest, self).setUp()
+        self.materials = self.get_task_database().materials
+        eps = [[4, 0, 0], [0, 4, 0], [0, 0, 4]]
+        self.materials.insert_many([
+            {"material_id": "mp-{}".format(i),
+             "dielectric": {"epsilon_ionic": eps, "epsilon_static": eps},
+             "_tasksbuilder": {"updated_at": datetime.datetime(2018, 1, 1)}}
+            for i in range(3)])
+
+    def test_run(self):
+        # the estimation builder runs first and has nothing to do yet
+        bandgap = BandgapEstimationBuilder(self.materials)
+        bandgap.run()
+        self.assertEqual(self.materials.count_documents({"bandgap_estimation": {"$exists": 1}}), 0)
+
+        dielectric = DielectricBuilder(self.materials)
+        dielectric.set_watermark(self.materials, datetime.datetime(2018, 1, 2))
+        # the materials without averages are processed regardless of the watermark
+        dielectric.run()
+        m = self.materials.find_one({"material_id": "mp-0"})
+        self.assertAlmostEqual(m["dielectric"]["epsilon_avg"], 8)
+        self.assertFalse(m["dielectric"]["has_neg_eps"])
+
+        bandgap.run()
+        self.assertEqual(self.materials.count_documents({"bandgap_estimation": {"$exists": 1}}), 3)
+        self.assertAlmostEqual(self.materials.find_one()["bandgap_estimation"]["gap_moss"], 95 / 16.)
+
+        # new averages are estimated again
+        self.materials.update_one({"material_id": "mp-0"},
+                                  {"$set": {"dielectric.epsilon_static": [[9, 0, 0], [0, 9, 0],
+                                                                          [0, 0, 9]],
+                                            "_tasksbuilder.updated_at":
+                                                datetime.datetime(2018, 1, 3)}})
+        dielectric.run()
+        bandgap.run()
+        m = self.materials.find_one({"material_id": "mp-0"})
+        self.assertAlmostEqual(m["bandgap_estimation"]["gap_moss"], 95 / 81.)
+
+
+if __name__ == "__main__":
+    unittest.main()
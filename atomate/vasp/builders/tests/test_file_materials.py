@@ -0,0 +1,72 @@
+# coding: utf-8
+
+import os
+import unittest
+from unittest import mock
+
+from atomate.vasp.builders.file_materials import FileMaterialsBuilder
+from atomate.utils.testing import AtomateTest
+
+
+class FileMaterialsBuilderTest(AtomateTest):
+
+    def setUp(self):
+        super(FileMaterialsBuilderTest, self).setUp()
+        self.materials = self.get_task_database().materials
+        self.materials.insert_many([{"material_id": "m-1", "formula_reduced_abc": "Si1"},
+                                    {"material_id": "m-2", "formula_reduced_abc": "Cl1 Na1"}])
+        self.data_file = os.path.join(self.scratch_dir, "data.csv")
+        self.write_data(1)
+        self.builder = FileMaterialsBuilder(self.materials, self.data_file, header_lines=1,
+                                            chunk_size=2)
+
+    def write_data(self, n):
+        with open(self.data_file, "w") as f:
+            f.write("# comment\nid,property,value\nm-1,a,{}\nNaCl,a,{}\n".format(n, n + 1))
+            f.write("m-1,b,{}\nm-2,b,{}\nm-3,b,0\n".format(n + 2, n + 3))
+
+    def run_interrupted(self):
+        # the run stops after the first chunk of rows is written
+        update_materials = self.builder._update_materials
+        calls = []
+
+        def interrupted(rows):
+            if calls:
+                raise RuntimeError("interrupted")
+            calls.append(rows)
+            return update_materials(rows)
+
+        with mock.patch.object(self.builder, "_update_materials", interrupted):
+            self.assertRaises(RuntimeError, self.builder.run)
+
+    def test_run(self):
+        self.builder.run()
+        self.assertEqual(self.materials.find_one({"material_id": "m-1"}), {
+            "_id": mock.ANY, "material_id": "m-1", "formula_reduced_abc": "Si1", "a": 1, "b": 3})
+        self.assertEqual(self.materials.find_one({"material_id": "m-2"})["a"], 2)
+        self.assertEqual(self.materials.find_one({"material_id": "m-2"})["b"], 4)
+
+    def test_resume(self):
+        self.run_interrupted()
+        self.assertEqual(self.materials.find_one({"material_id": "m-1"})["a"], 1)
+        self.assertNotIn("b", self.materials.find_one({"material_id": "m-1"}))
+
+        # the first chunk is not processed again
+        self.materials.update_one({"material_id": "m-1"}, {"$set": {"a": 10}})
+        self.builder.run()
+        m = self.materials.find_one({"material_id": "m-1"})
+        self.assertEqual((m["a"], m["b"]), (10, 3))
+        self.assertIsNone(self.builder.get_watermark(self.materials,
+                                                     os.path.abspath(self.data_file)))
+
+        # a data file replaced since the interrupted run is processed from the start, even
+        # with the same size
+        self.run_interrupted()
+        self.write_data(5)
+        self.builder.run()
+        m = self.materials.find_one({"material_id": "m-1"})
+        self.assertEqual((m["a"], m["b"]), (5, 7))
+
+
+if __name__ == "__main__":
+    unittest.main()
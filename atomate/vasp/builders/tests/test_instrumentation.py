@@ -0,0 +1,64 @@
+# coding: utf-8
+
+import json
+import os
+import unittest
+
+from pymatgen import Structure, Lattice
+
+from atomate.vasp.builders.materials_descriptor import MaterialsDescriptorBuilder
+from atomate.vasp.builders.tasks_materials import TasksMaterialsBuilder
+from atomate.vasp.builders.tests.test_tasks_materials import get_task
+from atomate.utils.testing import AtomateTest
+
+
+class InstrumentationTest(AtomateTest):
+
+    def setUp(self):
+        super(InstrumentationTest, self).setUp()
+        self.db = self.get_task_database()
+        rocksalt = Structure.from_spacegroup("Fm-3m", Lattice.cubic(5.6), ["Na", "Cl"],
+                                             [[0, 0, 0], [0.5, 0.5, 0.5]])
+        si = Structure.from_spacegroup("Fd-3m", Lattice.cubic(5.47), ["Si"], [[0, 0, 0]])
+        self.db.tasks.insert_many([get_task(1, rocksalt, (225, "Fm-3m"), -3.),
+                                   get_task(2, si, (227, "Fd-3m"), -5.4)])
+
+    def test_dry_run(self):
+        profile_file = os.path.join(self.scratch_dir, "profile.json")
+        builder = TasksMaterialsBuilder(self.db.materials, self.db.counter, self.db.tasks)
+        builder.instrument(dry_run=True, profile_file=profile_file).run()
+        # nothing is written, the new material_ids are only computed
+        self.assertEqual(self.db.materials.count_documents({}), 0)
+        self.assertEqual(self.db.materials_processed_tasks.count_documents({}), 0)
+        self.assertEqual(self.db.counter.find_one({"_id": "materialid"})["c"], 0)
+
+        with open(profile_file) as f:
+            profile = json.load(f)
+        self.assertEqual(profile["builder"], "TasksMaterialsBuilder")
+        self.assertTrue(profile["dry_run"])
+        for section in ["mongo_read", "mongo_write_skipped", "structure_matching", "compute"]:
+            self.assertGreater(profile["sections"][section]["count"], 0)
+        self.assertNotIn("mongo_write", profile["sections"])
+        self.assertEqual(profile, dict(builder.get_profile(), time_total=profile["time_total"]))
+
+        # the builder is run again for real
+        builder.instrument().run()
+        self.assertEqual(self.db.materials.count_documents({}), 2)
+        self.assertGreater(builder.get_profile()["sections"]["mongo_write"]["count"], 0)
+
+    def test_process_documents(self):
+        TasksMaterialsBuilder(self.db.materials, self.db.counter, self.db.tasks).run()
+        builder = MaterialsDescriptorBuilder(self.db.materials, descriptors=["nsites"])
+        builder.instrument(dry_run=True).run()
+        self.assertEqual(self.db.materials.count_documents({"descriptors": {"$exists": 1}}), 0)
+        self.assertIsNone(builder.get_watermark(self.db.materials))
+        stats = builder.get_profile()["process_documents"]
+        self.assertEqual([(s["n_docs"], s["n_updates"]) for s in stats], [(2, 2)])
+
+        builder.instrument().run()
+        self.assertEqual(self.db.materials.count_documents({"descriptors": {"$exists": 1}}), 2)
+        self.assertIsNotNone(builder.get_watermark(self.db.materials))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+# coding: utf-8
+
+import datetime
+import time
+import unittest
+from unittest import mock
+
+from pymatgen import Structure, Lattice
+
+from atomate.vasp.builders.materials_descriptor import MaterialsDescriptorBuilder, DESCRIPTORS
+from atomate.utils.testing import AtomateTest
+
+calls = []
+
+
+def slow(structure, cache):
+    calls.append(len(structure))
+    time.sleep(0.02)
+    return 1
+
+
+class MaterialsDescriptorBuilderTest(AtomateTest):
+
+    def setUp(self):
+        super(MaterialsDescriptorBuilderTest, self).setUp()
+        self.materials = self.get_task_database().materials
+        s = Structure(Lattice.cubic(3.), ["Si", "Si"], [[0, 0, 0], [0.5, 0.5, 0.5]])
+        self.materials.insert_many([
+            {"material_id": "m-{}".format(i), "structure": s.as_dict(),
+             "_tasksbuilder": {"updated_at": datetime.datetime(2018, 1, i)}}
+            for i in range(1, 4)])
+        del calls[:]
+
+    def get_builder(self, **kwargs):
+        return MaterialsDescriptorBuilder(self.materials, descriptors=["nsites", "slow"],
+                                          n_cost_samples=3, **kwargs)
+
+    @mock.patch.dict(DESCRIPTORS, {"slow": slow})
+    def test_run(self):
+        self.get_builder().run()
+        for m in self.materials.find():
+            self.assertEqual(m["descriptors"], {"nsites": 2, "slow": 1})
+        # the costs are only measured with a max_cost
+        self.assertEqual(len(calls), 3)
+        self.assertIsNone(self.get_builder().get_state(self.materials, "costs"))
+
+    @mock.patch.dict(DESCRIPTORS, {"slow": slow})
+    def test_max_cost(self):
+        builder = self.get_builder(max_cost=0.01)
+        builder.run()
+        # the slow descriptor is measured once, then skipped
+        self.assertEqual(len(calls), 1)
+        costs = builder.get_state(self.materials, "costs")
+        self.assertGreater(costs["slow"], 0.01)
+        self.assertLess(costs["nsites"], 0.01)
+        for m in self.materials.find():
+            self.assertEqual(m["descriptors"], {"nsites": 2})
+
+        # the costs are measured once, the watermark is kept in its own document
+        builder.run()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(builder.get_watermark(self.materials), datetime.datetime(2018, 1, 3))
+
+        # the materials missing a descriptor skipped before are processed once it is allowed,
+        # although they were not updated since
+        self.get_builder(max_cost=1).run()
+        self.assertEqual(len(calls), 4)
+        for m in self.materials.find():
+            self.assertEqual(m["descriptors"], {"nsites": 2, "slow": 1})
+
+    @mock.patch.dict(DESCRIPTORS, {"slow": slow})
+    def test_no_work(self):
+        # without materials to process, the costs are not measured
+        self.materials.update_many({}, {"$set": {"descriptors": {"nsites": 2, "slow": 1}}})
+        builder = self.get_builder(max_cost=0.01)
+        builder.set_watermark(self.materials, datetime.datetime(2018, 1, 3))
+        builder.run()
+        self.assertEqual(calls, [])
+        self.assertIsNone(builder.get_state(self.materials, "costs"))
+
+
+if __name__ == "__main__":
+    unittest.main()
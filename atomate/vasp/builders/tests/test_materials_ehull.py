@@ -0,0 +1,59 @@
+# coding: utf-8
+
+import os
+import unittest
+
+from pymatgen.entries.compatibility import Compatibility
+
+from atomate.vasp.builders.materials_ehull import MaterialsEhullBuilder
+from atomate.utils.testing import AtomateTest
+
+module_dir = os.path.dirname(os.path.abspath(__file__))
+ref_file = os.path.join(module_dir, "..", "..", "test_files", "reference_entries", "Li-O.json")
+
+
+class MaterialsEhullBuilderTest(AtomateTest):
+
+    def setUp(self):
+        super(MaterialsEhullBuilderTest, self).setUp()
+        self.db = self.get_task_database()
+        # the reference entries are Li (-2 eV/atom), O2 (-5 eV/atom) and Li2O (-25/3 eV/atom)
+        self.db.materials.insert_many([
+            {"material_id": "m-1", "formula_pretty": "Li2O2", "thermo": {"energy_per_atom": -7.0}},
+            {"material_id": "m-2", "formula_pretty": "Li", "thermo": {"energy_per_atom": -1.9}}])
+        self.builder = MaterialsEhullBuilder(self.db.materials, local=True,
+                                             reference_entries_file=ref_file,
+                                             compatibility=Compatibility([]))
+
+    def test_run_local(self):
+        self.builder.run()
+        m1 = self.db.materials.find_one({"material_id": "m-1"})
+        # Li2O2 is 0.5 eV/atom above the Li2O-O2 tie line at -4 eV/atom
+        self.assertAlmostEqual(m1["stability"]["e_above_hull"], 0.5)
+        self.assertFalse(m1["stability"]["is_stable"])
+        self.assertEqual(sorted(d["material_id"] for d in m1["stability"]["decomposes_to"]),
+                         ["ref-Li2O", "ref-O2"])
+        self.assertAlmostEqual(m1["thermo"]["formation_energy_per_atom"], -3.5)
+        m2 = self.db.materials.find_one({"material_id": "m-2"})
+        self.assertAlmostEqual(m2["stability"]["e_above_hull"], 0.1)
+        self.assertAlmostEqual(m2["thermo"]["formation_energy_per_atom"], 0.1)
+
+        # a new Li2O lowers the hull of Li-O: Li2O2 is updated, Li is not affected
+        self.db.materials.insert_one({"material_id": "m-3", "formula_pretty": "Li2O",
+                                      "thermo": {"energy_per_atom": -9.0}})
+        self.db.materials.update_one({"material_id": "m-2"},
+                                     {"$set": {"stability.e_above_hull": -1}})
+        self.builder.run()
+        m3 = self.db.materials.find_one({"material_id": "m-3"})
+        self.assertTrue(m3["stability"]["is_stable"])
+        self.assertAlmostEqual(m3["thermo"]["formation_energy_per_atom"], -6.0)
+        m1 = self.db.materials.find_one({"material_id": "m-1"})
+        self.assertAlmostEqual(m1["stability"]["e_above_hull"], 1.0)
+        self.assertEqual(sorted(d["material_id"] for d in m1["stability"]["decomposes_to"]),
+                         ["m-3", "ref-O2"])
+        m2 = self.db.materials.find_one({"material_id": "m-2"})
+        self.assertEqual(m2["stability"]["e_above_hull"], -1)
+
+
+if __name__ == "__main__":
+    unittest.main()
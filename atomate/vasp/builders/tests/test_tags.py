@@ -0,0 +1,61 @@
+# coding: utf-8
+
+import datetime
+import unittest
+
+from atomate.vasp.builders.tags import TagsBuilder
+from atomate.utils.testing import AtomateTest
+
+
+class TagsBuilderTest(AtomateTest):
+
+    def setUp(self):
+        super(TagsBuilderTest, self).setUp()
+        self.db = self.get_task_database()
+        self.db.materials.insert_many([
+            {"material_id": "mp-1", "_tasksbuilder": {"all_task_ids": ["t-1", "t-2"]}},
+            {"material_id": "mp-2", "_tasksbuilder": {"all_task_ids": ["t-4"]}}])
+        self.db.tasks.insert_many([{"task_id": i, "tags": ["tag{}".format(i)],
+                                    "state": "successful", "task_label": "static",
+                                    "last_updated": datetime.datetime(2018, 1, i)}
+                                   for i in range(1, 5)])
+        # a task that is never in a material, and one with a single tag
+        self.db.tasks.insert_many([
+            {"task_id": 5, "tags": ["tag5"], "state": "successful", "task_label": "unknown",
+             "last_updated": datetime.datetime(2018, 1, 5)},
+            {"task_id": 6, "tags": "tag6", "state": "successful", "task_label": "static",
+             "last_updated": datetime.datetime(2018, 1, 6)}])
+        self.db.materials.update_one({"material_id": "mp-2"},
+                                     {"$push": {"_tasksbuilder.all_task_ids": "t-6"}})
+
+    def test_run(self):
+        for per_task in [False, True]:
+            builder = TagsBuilder(self.db.materials, self.db.tasks, per_task=per_task)
+            builder.reset()
+            builder.run()
+            self.assertEqual(self.db.materials.find_one({"material_id": "mp-1"})["tags"],
+                             ["tag1", "tag2"])
+            self.assertEqual(sorted(self.db.materials.find_one({"material_id": "mp-2"})["tags"]),
+                             ["tag4", "tag6"])
+            # task 3 is not in a material yet: it is retried by task_id, while the watermark
+            # moves past it. Task 5 cannot be in a material and is not retried.
+            self.assertEqual(builder.get_watermark(self.db.materials),
+                             datetime.datetime(2018, 1, 6))
+            self.assertEqual(builder.get_state(self.db.materials, "unmapped"), [3])
+            builder.run()
+            self.assertEqual(builder.get_state(self.db.materials, "unmapped"), [3])
+
+            # it is processed once it is matched to a material
+            self.db.materials.update_one({"material_id": "mp-2"},
+                                         {"$push": {"_tasksbuilder.all_task_ids": "t-3"}})
+            builder.run()
+            m = self.db.materials.find_one({"material_id": "mp-2"})
+            self.assertEqual(sorted(m["tags"]), ["tag3", "tag4", "tag6"])
+            self.assertEqual(sorted(m["_tagsbuilder"]["all_task_ids"]), ["t-3", "t-4", "t-6"])
+            self.assertIsNone(builder.get_state(self.db.materials, "unmapped"))
+            self.db.materials.update_one({"material_id": "mp-2"},
+                                         {"$pull": {"_tasksbuilder.all_task_ids": "t-3"}})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+# coding: utf-8
+
+import unittest
+
+from pymatgen import Structure, Lattice
+
+from atomate.vasp.builders.tasks_materials import TasksMaterialsBuilder
+from atomate.utils.testing import AtomateTest
+
+
+def get_task(task_id, structure, sg, energy_per_atom, task_label="static"):
+    """
+    A minimal task document with the fields used by TasksMaterialsBuilder.
+    """
+    comp = structure.composition
+    output = {"structure": structure.as_dict(), "spacegroup": {"number": sg[0], "symbol": sg[1]},
+              "energy": energy_per_atom * len(structure), "energy_per_atom": energy_per_atom,
+              "bandgap": 1., "cbm": 1., "vbm": 0., "is_gap_direct": False, "is_metal": False}
+    return {"task_id": task_id, "state": "successful", "task_label": task_label,
+            "formula_reduced_abc": comp.reduced_composition.alphabetical_formula,
+            "formula_pretty": comp.reduced_formula,
+            "formula_anonymous": comp.anonymized_formula,
+            "elements": sorted(el.symbol for el in comp.elements), "nelements": len(comp),
+            "chemsys": "-".join(sorted(el.symbol for el in comp.elements)), "output": output,
+            "input": {"is_hubbard": False, "hubbards": {}, "potcar_spec": []}}
+
+
+class TasksMaterialsBuilderTest(AtomateTest):
+
+    def setUp(self):
+        super(TasksMaterialsBuilderTest, self).setUp()
+        self.db = self.get_task_database()
+        rocksalt = Structure.from_spacegroup("Fm-3m", Lattice.cubic(5.6), ["Na", "Cl"],
+                                             [[0, 0, 0], [0.5, 0.5, 0.5]])
+        cscl = Structure(Lattice.cubic(3.4), ["Na", "Cl"], [[0, 0, 0], [0.5, 0.5, 0.5]])
+        si = Structure.from_spacegroup("Fd-3m", Lattice.cubic(5.47), ["Si"], [[0, 0, 0]])
+        # the relaxed rocksalt structure is the same material
+        relaxed = rocksalt.copy()
+        relaxed.scale_lattice(rocksalt.volume * 1.05)
+        self.tasks = [
+            get_task(1, rocksalt, (225, "Fm-3m"), -3.),
+            get_task(2, relaxed, (225, "Fm-3m"), -2.9, "structure optimization"),
+            get_task(3, cscl, (221, "Pm-3m"), -2.8),
+            get_task(4, si, (227, "Fd-3m"), -5.4)]
+        self.db.tasks.insert_many([dict(t) for t in self.tasks])
+
+    def get_builder(self, **kwargs):
+        return TasksMaterialsBuilder(self.db.materials, self.db.counter, self.db.tasks,
+                                     **kwargs)
+
+    def test_run(self):
+        for nproc in [1, 2]:
+            builder = self.get_builder(nproc=nproc)
+            builder.reset()
+            builder.run()
+            # the new tasks of a formula are matched together: both rocksalt tasks create a
+            # single material, with the properties of the static task
+            self.assertEqual(self.db.materials.count_documents({}), 3)
+            m = self.db.materials.find_one({"formula_reduced_abc": "Cl1 Na1",
+                                            "sg_number": 225})
+            self.assertEqual(m["_tasksbuilder"]["all_task_ids"], ["t-1", "t-2"])
+            self.assertEqual(m["thermo"]["energy_per_atom"], -3.)
+            self.assertEqual(m["_tasksbuilder"]["prop_metadata"]["labels"]["energy"], "static")
+            self.assertIn("fingerprint", m["_tasksbuilder"])
+            self.assertEqual(sorted(m["material_id"] for m in self.db.materials.find()),
+                             ["m-1", "m-2", "m-3"])
+            self.assertEqual(self.db.counter.find_one({"_id": "materialid"})["c"], 3)
+
+    def test_processed_tasks(self):
+        builder = self.get_builder(chunk_size=2)
+        builder.run()
+        processed = {d["task_id"]: d["material_id"]
+                     for d in self.db.materials_processed_tasks.find()}
+        m = self.db.materials.find_one({"_tasksbuilder.all_task_ids": "t-1"})
+        self.assertEqual(len(processed), 4)
+        self.assertEqual(processed["t-1"], m["material_id"])
+        self.assertEqual(processed["t-2"], m["material_id"])
+
+        # only the new tasks are processed by the next runs
+        self.db.tasks.insert_one(dict(self.tasks[0], task_id=5))
+        builder.run()
+        m = self.db.materials.find_one({"material_id": m["material_id"]})
+        self.assertEqual(m["_tasksbuilder"]["all_task_ids"], ["t-1", "t-2", "t-5"])
+        self.assertEqual(self.db.materials.count_documents({}), 3)
+        self.assertEqual(self.db.materials_processed_tasks.count_documents({}), 5)
+
+        # the processed tasks of a materials collection built without the collection are
+        # migrated from the materials
+        self.db.materials_processed_tasks.delete_many({})
+        builder.run()
+        self.assertEqual(self.db.materials_processed_tasks.count_documents({}), 5)
+        self.assertEqual(self.db.materials.count_documents({}), 3)
+        m = self.db.materials.find_one({"material_id": m["material_id"]})
+        self.assertEqual(m["_tasksbuilder"]["all_task_ids"], ["t-1", "t-2", "t-5"])
+
+    def test_missing_formula(self):
+        # a task without formula_reduced_abc is skipped, the others are processed
+        self.db.tasks.update_one({"task_id": 4}, {"$unset": {"formula_reduced_abc": 1}})
+        self.get_builder().run()
+        self.assertEqual(self.db.materials.count_documents({}), 2)
+        self.assertIsNone(self.db.materials_processed_tasks.find_one({"task_id": "t-4"}))
+
+    def test_task_errors(self):
+        # a task that cannot be matched, or whose properties cannot be taken, is left out and
+        # retried by the next run; the other tasks of its formula are processed
+        self.db.tasks.update_one({"task_id": 1}, {"$unset": {"output.spacegroup": 1}})
+        self.db.tasks.update_one({"task_id": 3}, {"$unset": {"output.bandgap": 1}})
+        self.get_builder().run()
+        processed = {d["task_id"] for d in self.db.materials_processed_tasks.find()}
+        self.assertEqual(processed, {"t-2", "t-4"})
+        m = self.db.materials.find_one({"_tasksbuilder.all_task_ids": "t-2"})
+        self.assertEqual(m["thermo"]["energy_per_atom"], -2.9)
+        # the material of the cscl task was not created
+        self.assertEqual(self.db.materials.count_documents({}), 2)
+        self.assertEqual(self.db.counter.find_one({"_id": "materialid"})["c"], 2)
+
+        self.db.tasks.update_one({"task_id": 1}, {"$set": {"output.spacegroup": {
+            "number": 225, "symbol": "Fm-3m"}}})
+        self.db.tasks.update_one({"task_id": 3}, {"$set": {"output.bandgap": 1.}})
+        self.get_builder().run()
+        self.assertEqual(self.db.materials_processed_tasks.count_documents({}), 4)
+        self.assertEqual(self.db.materials.count_documents({}), 3)
+        m = self.db.materials.find_one({"material_id": m["material_id"]})
+        self.assertEqual(m["_tasksbuilder"]["all_task_ids"], ["t-2", "t-1"])
+        self.assertEqual(m["thermo"]["energy_per_atom"], -3.)
+
+    def test_group_size(self):
+        # the tasks of a formula are matched in parts, the later parts matching the materials
+        # created by the earlier ones
+        self.db.tasks.insert_many([dict(self.tasks[0], task_id=i) for i in range(5, 8)])
+        builder = self.get_builder(group_size=2)
+        self.assertNotIn("output", builder._get_task_projection())
+        builder.run()
+        self.assertEqual(self.db.materials.count_documents({}), 3)
+        m = self.db.materials.find_one({"_tasksbuilder.all_task_ids": "t-1"})
+        self.assertEqual(m["_tasksbuilder"]["all_task_ids"], ["t-1", "t-2", "t-5", "t-6", "t-7"])
+        self.assertEqual(self.db.materials_processed_tasks.count_documents({}), 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
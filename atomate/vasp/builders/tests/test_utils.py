@@ -0,0 +1,59 @@
+# coding: utf-8
+
+import unittest
+from unittest import mock
+
+from pymatgen import Structure, Lattice
+
+from atomate.vasp.builders.utils import MaterialsIndex, get_structure_fingerprint, \
+    fingerprints_match
+
+
+class MaterialsIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rocksalt = Structure.from_spacegroup("Fm-3m", Lattice.cubic(5.6), ["Na", "Cl"],
+                                                  [[0, 0, 0], [0.5, 0.5, 0.5]])
+        self.cscl = Structure(Lattice.cubic(3.4), ["Na", "Cl"], [[0, 0, 0], [0.5, 0.5, 0.5]])
+
+    def test_match(self):
+        index = MaterialsIndex()
+        index.add("m-1", "Cl1 Na1", 225, self.rocksalt.as_dict())
+        index.add("m-2", "Cl1 Na1", 221, self.cscl.as_dict(),
+                  fingerprint=get_structure_fingerprint(self.cscl))
+        supercell = self.rocksalt * (2, 1, 1)
+        self.assertEqual(index.match("Cl1 Na1", 225, supercell), "m-1")
+        self.assertEqual(index.match("Cl1 Na1", 221, self.cscl), "m-2")
+        # the materials are looked up by formula and space group
+        self.assertIsNone(index.match("Cl1 Na1", 221, self.rocksalt))
+        self.assertIsNone(index.match("Cl1 K1", 225, self.rocksalt))
+        # the fingerprints are computed once for the materials added without one
+        self.assertEqual(list(index.new_fingerprints), ["m-1"])
+
+    def test_parent_structure(self):
+        index = MaterialsIndex()
+        index.add("m-1", "Cl1 Na1", 225, self.rocksalt, parent_sg=221)
+        self.assertEqual(index.match("Cl1 Na1", 12, self.rocksalt, parent_sg=221), "m-1")
+        self.assertIsNone(index.match("Cl1 Na1", 225, self.rocksalt, parent_sg=225))
+
+    def test_fingerprints(self):
+        expanded = self.rocksalt.copy()
+        expanded.scale_lattice(self.rocksalt.volume * 1.1)
+        self.assertTrue(fingerprints_match(get_structure_fingerprint(self.rocksalt),
+                                           get_structure_fingerprint(expanded)))
+        distorted = self.cscl.copy()
+        distorted.apply_strain([1., 0, 0])
+        self.assertFalse(fingerprints_match(get_structure_fingerprint(self.cscl),
+                                            get_structure_fingerprint(distorted)))
+
+        # the StructureMatcher is only called for the materials with a matching fingerprint
+        for use_fingerprints, n_fits in [(True, 0), (False, 1)]:
+            index = MaterialsIndex(use_fingerprints=use_fingerprints)
+            index.add("m-1", "Cl1 Na1", 221, self.cscl)
+            with mock.patch.object(index.matcher, "fit", return_value=False) as fit:
+                self.assertIsNone(index.match("Cl1 Na1", 221, distorted))
+            self.assertEqual(fit.call_count, n_fits)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,6 +2,13 @@
 This class contains common functions for builders
 """
 
+from functools import lru_cache
+
+from pymatgen import Structure
+from pymatgen.analysis.structure_matcher import StructureMatcher, ElementComparator
+
+from atomate.vasp.builders.instrumentation import profile_section
+
 __author__ = 'Anubhav Jain <ajain@lbl.gov>'
 
 
@@ -13,3 +20,143 @@ def dbid_to_str(prefix, dbid):
 def dbid_to_int(dbid):
     # converts string dbid to int (removes prefix)
     return int(dbid.split("-")[1])
+
+
+@lru_cache(maxsize=None)
+def get_structure_matcher(ltol=0.2, stol=0.3, angle_tol=5):
+    """
+    StructureMatcher used by the builders to match a structure with existing materials. The
+    matchers are stateless, so a single instance is shared per set of tolerances.
+    """
+    return StructureMatcher(ltol=ltol, stol=stol, angle_tol=angle_tol, primitive_cell=True,
+                            scale=True, attempt_supercell=False, allow_subset=False,
+                            comparator=ElementComparator())
+
+
+def get_structure_fingerprint(structure):
+    """
+    Fingerprint of a structure used to pre-filter the candidates of get_structure_matcher:
+    the number of sites of the primitive cell, as reduced by StructureMatcher, and the lengths
+    of its Niggli reduced lattice vectors scaled to a volume of 1 A^3 per site.
+
+    Args:
+        structure (Structure): the structure
+
+    Returns:
+        (dict) {"nsites": int, "lengths": [a, b, c]} with a <= b <= c
+    """
+    prim = structure.get_reduced_structure().get_primitive_structure()
+    lattice = prim.lattice.get_niggli_reduced_lattice()
+    scale = (len(prim) / lattice.volume) ** (1 / 3)
+    return {"nsites": len(prim), "lengths": sorted(float(x) * scale for x in lattice.abc)}
+
+
+def get_fingerprint_bounds(length, ltol=0.2):
+    """
+    Range of the fingerprint lattice lengths of the structures that can match a structure with
+    the given fingerprint length, with the StructureMatcher length tolerance ltol. The
+    matched lattice vectors are within ltol of the reduced ones, hence the upper bound; the
+    lower bound leaves an additional margin for the angle tolerance.
+
+    Returns:
+        (float, float) the lower and upper bounds
+    """
+    return length * (1 - ltol) ** 2, length * (1 + ltol) * 1.01
+
+
+def fingerprints_match(fingerprint1, fingerprint2, ltol=0.2):
+    """
+    Whether two structures with these fingerprints can be matched by get_structure_matcher.
+    """
+    if fingerprint1["nsites"] != fingerprint2["nsites"]:
+        return False
+    for l1, l2 in zip(fingerprint1["lengths"], fingerprint2["lengths"]):
+        lower, upper = get_fingerprint_bounds(l2, ltol)
+        if not lower <= l1 <= upper:
+            return False
+    return True
+
+
+class MaterialsIndex:
+    """
+    In-memory index of materials keyed by formula and space group, used to match structures
+    with materials. The structures of the materials are deserialized once, when first
+    compared, and their fingerprints are computed once if missing.
+    """
+
+    def __init__(self, ltol=0.2, stol=0.3, angle_tol=5, use_fingerprints=True):
+        """
+        Args:
+            ltol (float): StructureMatcher tuning parameter
+            stol (float): StructureMatcher tuning parameter
+            angle_tol (float): StructureMatcher tuning parameter
+            use_fingerprints (bool): whether to skip the materials with a fingerprint that
+                cannot match before calling the StructureMatcher
+        """
+        self.ltol = ltol
+        self.matcher = get_structure_matcher(ltol, stol, angle_tol)
+        self.use_fingerprints = use_fingerprints
+        self._by_sg = {}
+        self._by_parent_sg = {}
+        # fingerprints computed for the materials added without one, by material_id
+        self.new_fingerprints = {}
+
+    def add(self, material_id, formula, sg_number, structure, parent_sg=None, fingerprint=None):
+        """
+        Add a material to the index.
+
+        Args:
+            material_id: identifier of the material
+            formula (str): formula_reduced_abc of the material
+            sg_number (int): space group number of the material
+            structure (Structure/dict): structure of the material, or of its parent structure
+            parent_sg (int): space group number of the parent structure, if any
+            fingerprint (dict): fingerprint of the structure, computed when needed if None
+        """
+        entry = {"material_id": material_id, "structure": structure, "fingerprint": fingerprint}
+        self._by_sg.setdefault((formula, sg_number), []).append(entry)
+        if parent_sg is not None:
+            self._by_parent_sg.setdefault((formula, parent_sg), []).append(entry)
+
+    def match(self, formula, sg_number, structure, parent_sg=None, fingerprint=None):
+        """
+        Find the first material added with the same formula and space group, or parent
+        structure space group, and a structure matching this structure.
+
+        Args:
+            formula (str): formula_reduced_abc of the structure
+            sg_number (int): space group number of the structure
+            structure (Structure): the structure
+            parent_sg (int): space group number of the parent structure, if any. The
+                structure is then only compared with the materials with the same parent
+                structure space group.
+            fingerprint (dict): fingerprint of the structure, computed if None
+
+        Returns:
+            the material_id of the matching material, or None
+        """
+        if parent_sg is not None:
+            entries = self._by_parent_sg.get((formula, parent_sg), [])
+        else:
+            entries = self._by_sg.get((formula, sg_number), [])
+        with profile_section("structure_matching"):
+            if self.use_fingerprints and entries and fingerprint is None:
+                fingerprint = get_structure_fingerprint(structure)
+            for entry in entries:
+                if self.use_fingerprints:
+                    if entry["fingerprint"] is None:
+                        entry["fingerprint"] = get_structure_fingerprint(
+                            self._get_structure(entry))
+                        self.new_fingerprints[entry["material_id"]] = entry["fingerprint"]
+                    if not fingerprints_match(entry["fingerprint"], fingerprint, self.ltol):
+                        continue
+                if self.matcher.fit(self._get_structure(entry), structure):
+                    return entry["material_id"]
+        return None
+
+    @staticmethod
+    def _get_structure(entry):
+        if not isinstance(entry["structure"], Structure):
+            with profile_section("structure_deserialization"):
+                entry["structure"] = Structure.from_dict(entry["structure"])
+        return entry["structure"]
@@ -39,4 +39,30 @@ STORE_VOLUMETRIC_DATA = ("chgcar", "aeccar0", "aeccar2", "elfcar", "locpot")
 
 # ingest any additional JSON data present into database when parsing VASP directories
 # useful for storing duplicate of FW.json
-STORE_ADDITIONAL_JSON = False
\ No newline at end of file
+STORE_ADDITIONAL_JSON = False
+
+# record the size, mtime and md5 hash of the files parsed by VaspDrone in the task doc
+# so that unchanged directories can be skipped when they are ingested again. Hashing adds a
+# full read of the files, so it is off for the regular VaspToDb path and turned on by the
+# bulk ingestion of VaspCalcDb.insert_tasks_from_dir
+STORE_FILE_FINGERPRINTS = False
+
+# codec used to compress the DOS, band structure and volumetric data stored in GridFS:
+# "zlib", "gzip", "lzma", "zstd" (requires the zstandard package) or None.
+# The codec is recorded in the GridFS metadata, so existing data stays readable.
+GRIDFS_COMPRESSION = "zlib"
+GRIDFS_COMPRESSION_LEVEL = 1
+# GridFS chunk size in bytes; None uses the GridFS default (255 kB)
+GRIDFS_CHUNK_SIZE = None
+# format of the volumetric data (CHGCAR, LOCPOT, ...) stored in GridFS: "json" for the json
+# serialized object, "binary" for raw arrays of GRIDFS_VOLUMETRIC_DTYPE ("float32" or "float64")
+# or "chunked" for arrays split into blocks of GRIDFS_VOLUMETRIC_BLOCK_SIZE points along each
+# axis, which can be read partially
+GRIDFS_VOLUMETRIC_FORMAT = "json"
+GRIDFS_VOLUMETRIC_DTYPE = "float64"
+GRIDFS_VOLUMETRIC_BLOCK_SIZE = 32
+
+# local directory caching the DOS, band structures and volumetric data read from GridFS by
+# VaspCalcDb, and its maximum size in bytes; None disables the cache
+GRIDFS_CACHE_DIR = None
+GRIDFS_CACHE_SIZE = 2 ** 30
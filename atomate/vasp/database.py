@@ -1,24 +1,46 @@
 # coding: utf-8
 
 
-from monty.json import MontyEncoder, MontyDecoder
+from monty.json import MontyEncoder, MontyDecoder, jsanitize
 
 """
 This module defines the database classes.
 """
 
+import os
+import copy
+import time
 import zlib
+import gzip
+import lzma
 import json
+import functools
+import itertools
+import multiprocessing
+import traceback
 from bson import ObjectId
 
+import numpy as np
+
 from pymatgen.electronic_structure.bandstructure import BandStructure, BandStructureSymmLine
 from pymatgen.electronic_structure.dos import CompleteDos
+from pymatgen.core.structure import Structure
+from pymatgen.io.vasp.inputs import Poscar
 
 import gridfs
 from pymongo import ASCENDING, DESCENDING
 
-from atomate.utils.database import CalcDb
-from atomate.utils.utils import get_logger
+from atomate.utils.database import CalcDb, GridFSCache
+from atomate.utils.utils import get_logger, get_uri, load_class
+from atomate.vasp.drones import VaspDrone
+from atomate.vasp.config import GRIDFS_COMPRESSION, GRIDFS_COMPRESSION_LEVEL, \
+    GRIDFS_CHUNK_SIZE, GRIDFS_VOLUMETRIC_FORMAT, GRIDFS_VOLUMETRIC_DTYPE, \
+    GRIDFS_VOLUMETRIC_BLOCK_SIZE, GRIDFS_CACHE_DIR, GRIDFS_CACHE_SIZE
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 __author__ = 'Kiran Mathew'
 __credits__ = 'Anubhav Jain'
@@ -26,6 +48,255 @@ __email__ = 'kmathew@lbl.gov'
 
 logger = get_logger(__name__)
 
+VOLUMETRIC_DATA_NAMES = ('chgcar', 'locpot', 'aeccar0', 'aeccar1', 'aeccar2', 'elfcar')
+
+GRIDFS_DATA_NAMES = ('dos', 'bandstructure', 'trajectory') + VOLUMETRIC_DATA_NAMES
+
+COMPRESSION_CODECS = ("zlib", "gzip", "lzma", "zstd", None)
+
+
+def compress_data(data, compression="zlib", level=None):
+    """
+    Compress bytes with one of the COMPRESSION_CODECS.
+
+    Args:
+        data (bytes): the data to compress
+        compression (str): name of the codec, None for no compression
+        level (int): compression level (preset for lzma). None uses the codec default.
+
+    Returns:
+        (bytes) the compressed data
+    """
+    if compression is None:
+        return data
+    elif compression == "zlib":
+        return zlib.compress(data, -1 if level is None else level)
+    elif compression == "gzip":
+        return gzip.compress(data, 9 if level is None else level)
+    elif compression == "lzma":
+        return lzma.compress(data, preset=level)
+    elif compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("'zstandard' package is NOT installed but is required for the "
+                               "zstd compression.")
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress(data)
+    raise ValueError("Unknown compression: {}. Choose from {}".format(compression,
+                                                                     COMPRESSION_CODECS))
+
+
+def decompress_data(data, compression="zlib"):
+    """
+    Decompress bytes compressed with compress_data.
+
+    Args:
+        data (bytes): the compressed data
+        compression (str): name of the codec used, None for no compression
+
+    Returns:
+        (bytes) the decompressed data
+    """
+    if compression is None:
+        return data
+    elif compression == "zlib":
+        return zlib.decompress(data)
+    elif compression == "gzip":
+        return gzip.decompress(data)
+    elif compression == "lzma":
+        return lzma.decompress(data)
+    elif compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("'zstandard' package is NOT installed but is required to read "
+                               "zstd compressed data.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError("Unknown compression: {}. Choose from {}".format(compression,
+                                                                     COMPRESSION_CODECS))
+
+
+def encode_volumetric_data(vol_data, dtype="float64"):
+    """
+    Encode volumetric data in the binary format used by VaspCalcDb.insert_volumetric_gridfs.
+
+    Args:
+        vol_data (VolumetricData or dict): the volumetric data, e.g. a Chgcar, or its dict
+        dtype (str): float type of the stored arrays, "float32" or "float64"
+
+    Returns:
+        (dict, bytes) the json header and the data arrays as consecutive little-endian buffers
+    """
+    vol_data, header = _get_volumetric_header(vol_data, dtype)
+    buffer = b"".join(np.ascontiguousarray(vol_data.data[k], dtype=header["dtype"]).tobytes()
+                      for k in header["keys"])
+    return header, buffer
+
+
+def decode_volumetric_data(header, buffer):
+    """
+    Rebuild the volumetric data encoded by encode_volumetric_data.
+
+    Args:
+        header (dict): the json header
+        buffer (bytes): the decompressed data arrays
+
+    Returns:
+        VolumetricData object, e.g. a Chgcar
+    """
+    dtype = np.dtype(header["dtype"])
+    dim = header["dim"]
+    n = int(np.prod(dim))
+    data = {}
+    for i, k in enumerate(header["keys"]):
+        data[k] = np.frombuffer(buffer, dtype=dtype, count=n, offset=i * n * dtype.itemsize)\
+            .reshape(dim).astype(np.float64)
+    return _get_volumetric_object(header, data)
+
+
+def get_volumetric_blocks(dim, block_size):
+    """
+    Split a grid into blocks of at most block_size points along each axis.
+
+    Args:
+        dim ([int]): grid dimensions
+        block_size (int): maximum number of points of a block along each axis
+
+    Returns:
+        ([tuple]) the slices of each block, in the order they are stored in the chunked format
+    """
+    return list(itertools.product(*[[slice(i, min(i + block_size, n))
+                                     for i in range(0, n, block_size)] for n in dim]))
+
+
+def encode_chunked_volumetric_data(vol_data, dtype="float64", block_size=32,
+                                   compression="zlib", level=None):
+    """
+    Encode volumetric data in the chunked format: each data array is split into blocks (see
+    get_volumetric_blocks) that are compressed independently, so that a part of the grid can
+    be decoded from the bytes of the blocks it intersects only.
+
+    Args:
+        vol_data (VolumetricData or dict): the volumetric data, e.g. a Chgcar, or its dict
+        dtype (str): float type of the stored arrays, "float32" or "float64"
+        block_size (int): maximum number of grid points of a block along each axis
+        compression (str): codec used for each block, see compress_data
+        level (int): compression level
+
+    Returns:
+        (dict, bytes) the json header, including the offsets of the blocks, and the blocks
+    """
+    vol_data, header = _get_volumetric_header(vol_data, dtype)
+    header.update({"block_size": block_size, "block_compression": compression,
+                   "block_offsets": {}})
+    blocks = get_volumetric_blocks(header["dim"], block_size)
+    chunks = []
+    offset = 0
+    for k in header["keys"]:
+        data = np.asarray(vol_data.data[k], dtype=header["dtype"])
+        offsets = [offset]
+        for block in blocks:
+            chunk = compress_data(np.ascontiguousarray(data[block]).tobytes(), compression, level)
+            chunks.append(chunk)
+            offset += len(chunk)
+            offsets.append(offset)
+        header["block_offsets"][k] = offsets
+    return header, b"".join(chunks)
+
+
+def decode_chunked_volumetric_data(header, buffer):
+    """
+    Rebuild the volumetric data encoded by encode_chunked_volumetric_data.
+
+    Args:
+        header (dict): the json header
+        buffer (bytes): the blocks
+
+    Returns:
+        VolumetricData object, e.g. a Chgcar
+    """
+    blocks = get_volumetric_blocks(header["dim"], header["block_size"])
+    data = {}
+    for k in header["keys"]:
+        data[k] = np.empty(header["dim"])
+        offsets = header["block_offsets"][k]
+        for i, block in enumerate(blocks):
+            data[k][block] = decode_volumetric_block(header, buffer[offsets[i]:offsets[i + 1]],
+                                                     block)
+    return _get_volumetric_object(header, data)
+
+
+def decode_volumetric_block(header, chunk, block):
+    """
+    Decode a single block of the chunked format.
+
+    Args:
+        header (dict): the json header
+        chunk (bytes): the compressed block
+        block (tuple): the slices of the block
+
+    Returns:
+        (np.ndarray) the data of the block
+    """
+    shape = tuple(s.stop - s.start for s in block)
+    return np.frombuffer(decompress_data(chunk, header["block_compression"]),
+                         dtype=np.dtype(header["dtype"])).reshape(shape)
+
+
+def _get_volumetric_header(vol_data, dtype):
+    if isinstance(vol_data, dict):
+        vol_data = MontyDecoder().process_decoded(vol_data)
+    header = {"@module": vol_data.__class__.__module__,
+              "@class": vol_data.__class__.__name__,
+              "structure": vol_data.structure.as_dict(),
+              "dim": [int(i) for i in vol_data.dim],
+              "dtype": np.dtype(dtype).newbyteorder("<").str,
+              "keys": sorted(vol_data.data.keys()),
+              "data_aug": jsanitize(vol_data.data_aug) if vol_data.data_aug else None}
+    return vol_data, header
+
+
+def _get_volumetric_object(header, data):
+    cls = load_class(header["@module"], header["@class"])
+    poscar = Poscar(Structure.from_dict(header["structure"]))
+    if header.get("data_aug"):
+        return cls(poscar, data, data_aug=header["data_aug"])
+    return cls(poscar, data)
+
+
+def encode_trajectory(trajectory, dtype="float64"):
+    """
+    Encode the trajectory of the ionic steps read by atomate.vasp.drones.stream_vasprun in the
+    binary format used by VaspCalcDb.insert_trajectory_gridfs.
+
+    Args:
+        trajectory (dict): numpy arrays keyed by name, and the "species" list
+        dtype (str): float type of the stored arrays, "float32" or "float64"
+
+    Returns:
+        (dict, bytes) the json header and the arrays as consecutive little-endian buffers
+    """
+    dtype = np.dtype(dtype).newbyteorder("<")
+    arrays = sorted(k for k in trajectory if k != "species")
+    header = {"species": trajectory.get("species"), "dtype": dtype.str,
+              "arrays": [[k, [int(i) for i in np.shape(trajectory[k])]] for k in arrays]}
+    buffer = b"".join(np.ascontiguousarray(trajectory[k], dtype=dtype).tobytes() for k in arrays)
+    return header, buffer
+
+
+def decode_trajectory(header, buffer):
+    """
+    Rebuild the trajectory encoded by encode_trajectory.
+
+    Returns:
+        (dict) float64 numpy arrays keyed by name, and the "species" list
+    """
+    dtype = np.dtype(header["dtype"])
+    trajectory = {"species": header["species"]}
+    offset = 0
+    for k, shape in header["arrays"]:
+        n = int(np.prod(shape))
+        trajectory[k] = np.frombuffer(buffer, dtype=dtype, count=n, offset=offset)\
+            .reshape(shape).astype(np.float64)
+        offset += n * dtype.itemsize
+    return trajectory
+
 
 class VaspCalcDb(CalcDb):
     """
@@ -36,6 +307,19 @@ class VaspCalcDb(CalcDb):
                  password=None, **kwargs):
         super(VaspCalcDb, self).__init__(host, port, database, collection, user,
                                          password, **kwargs)
+        # defaults used by insert_gridfs; the codec is recorded in the file metadata so
+        # they can be changed without affecting the retrieval of existing data
+        self.gridfs_compression = GRIDFS_COMPRESSION
+        self.gridfs_compression_level = GRIDFS_COMPRESSION_LEVEL
+        self.gridfs_chunk_size = GRIDFS_CHUNK_SIZE
+        self.volumetric_data_format = GRIDFS_VOLUMETRIC_FORMAT
+        self.volumetric_data_dtype = GRIDFS_VOLUMETRIC_DTYPE
+        self.volumetric_block_size = GRIDFS_VOLUMETRIC_BLOCK_SIZE
+        # directory of the memory-mapped files written by get_volumetric_memmap
+        self.volumetric_cache_dir = None
+        # optional GridFSCache of the objects returned by get_dos, get_band_structure, etc.
+        self.gridfs_cache = GridFSCache(GRIDFS_CACHE_DIR, GRIDFS_CACHE_SIZE) \
+            if GRIDFS_CACHE_DIR else None
 
     def build_indexes(self, indexes=None, background=True):
         """
@@ -80,119 +364,609 @@ class VaspCalcDb(CalcDb):
         Returns:
             (int) - task_id of inserted document
         """
-        dos = None
-        bs = None
-        vol_data = {}
+        gridfs_data = self._pop_gridfs_data(task_doc) if use_gridfs else {}
+        self._invalidate_gridfs_cache([task_doc["dir_name"]])
 
-        # move dos BS and CHGCAR from doc to gridfs
-        if use_gridfs and "calcs_reversed" in task_doc:
+        # insert the task document
+        t_id = self.insert(task_doc)
 
-            if "dos" in task_doc["calcs_reversed"][0]:  # only store idx=0 (last step)
-                dos = json.dumps(task_doc["calcs_reversed"][0]["dos"], cls=MontyEncoder)
-                del task_doc["calcs_reversed"][0]["dos"]
+        # insert the dos, bandstructure and volumetric data into gridfs and update the task document
+        self._insert_gridfs_data(t_id, gridfs_data)
 
-            if "bandstructure" in task_doc["calcs_reversed"][0]:  # only store idx=0 (last step)
-                bs = json.dumps(task_doc["calcs_reversed"][0]["bandstructure"], cls=MontyEncoder)
-                del task_doc["calcs_reversed"][0]["bandstructure"]
+        return t_id
 
-            for vol_data_name in ('chgcar', 'locpot', 'aeccar0', 'aeccar1', 'aeccar2', 'elfcar'):
-                if vol_data_name in task_doc["calcs_reversed"][0]:  # only store idx=0 data
-                    vol_data[vol_data_name] = json.dumps(task_doc["calcs_reversed"][0][vol_data_name],
-                                                         cls=MontyEncoder)
-                    del task_doc["calcs_reversed"][0][vol_data_name]
+    def insert_tasks_from_dir(self, root, drone=None, nproc=None, batch_size=50,
+                              use_gridfs=False, update_duplicates=True, incremental=False,
+                              store_file_fingerprints=True):
+        """
+        Parse all the VASP run directories found under root and insert them as task documents.
+        The directories are assimilated in a pool of processes while the documents are streamed
+        back to this process, which writes them to the database in batches.
 
-        # insert the task document
-        t_id = self.insert(task_doc)
+        Args:
+            root (str): path to the top directory to search for VASP runs
+            drone (VaspDrone): drone used to parse the directories. Defaults to VaspDrone().
+            nproc (int): number of parsing processes. Defaults to the number of cpus.
+            batch_size (int): number of task documents to insert in a single bulk write
+            use_gridfs (bool): use gridfs for bandstructures, DOS and volumetric data
+            update_duplicates (bool): whether to update the duplicates
+            incremental (bool): skip the directories already in the database whose files did not
+                change since, as recorded in the "file_fingerprints" of their task document
+            store_file_fingerprints (bool): record the "file_fingerprints" of the directories
+                for the next incremental ingestions, whatever the setting of the drone
 
-        # insert the dos into gridfs and update the task document
-        if dos:
-            dos_gfs_id, compression_type = self.insert_gridfs(dos, "dos_fs", task_id=t_id)
-            self.collection.update_one(
-                {"task_id": t_id}, {"$set": {"calcs_reversed.0.dos_compression": compression_type}})
-            self.collection.update_one({"task_id": t_id}, {"$set": {"calcs_reversed.0.dos_fs_id": dos_gfs_id}})
+        Returns:
+            (dict) ingestion statistics: number of directories parsed, unchanged and failed, number of
+            task documents inserted, bytes parsed, elapsed time and throughput
+        """
+        drone = drone or VaspDrone()
+        if drone.store_file_fingerprints != store_file_fingerprints:
+            drone = copy.copy(drone)
+            drone.store_file_fingerprints = store_file_fingerprints
+        paths = []
+        for walk in os.walk(root):
+            paths.extend(drone.get_valid_paths(walk))
+        logger.info("Found {} directories to parse in {}".format(len(paths), root))
 
-        # insert the bandstructure into gridfs and update the task documents
-        if bs:
-            bfs_gfs_id, compression_type = self.insert_gridfs(bs, "bandstructure_fs", task_id=t_id)
-            self.collection.update_one(
-                {"task_id": t_id}, {"$set": {"calcs_reversed.0.bandstructure_compression": compression_type}})
-            self.collection.update_one(
-                {"task_id": t_id}, {"$set": {"calcs_reversed.0.bandstructure_fs_id": bfs_gfs_id}})
+        previous_fingerprints = {}
+        if incremental:
+            for doc in self.collection.find({"file_fingerprints": {"$exists": True}},
+                                            ["dir_name", "file_fingerprints"]):
+                previous_fingerprints[doc["dir_name"]] = doc["file_fingerprints"]
+        # drone.post_process names the directories with get_uri; resolve the host name only once
+        uri_prefix = get_uri(root)[:-len(os.path.abspath(root))] if drone.use_full_uri else ""
+        jobs = [(path, previous_fingerprints.get(uri_prefix + os.path.abspath(path)))
+                for path in paths]
 
-        # insert the CHGCAR file into gridfs and update the task documents
-        if vol_data:
-            for name, data in vol_data.items():
-                data_gfs_id, compression_type = self.insert_gridfs(data, "{}_fs".format(name), task_id=t_id)
-                self.collection.update_one(
-                    {"task_id": t_id}, {"$set": {"calcs_reversed.0.{}_compression".format(name): compression_type}})
-                self.collection.update_one({"task_id": t_id}, {"$set": {"calcs_reversed.0.{}_fs_id".format(name): data_gfs_id}})
+        stats = {"n_dirs": len(paths), "n_parsed": 0, "n_unchanged": 0, "n_failed": 0,
+                 "n_inserted": 0, "bytes_parsed": 0, "failed_dirs": []}
+        start = time.time()
+        batch = []
+        with multiprocessing.Pool(nproc) as pool:
+            for path, doc, nbytes, error in pool.imap_unordered(
+                    functools.partial(_assimilate_dir, drone), jobs):
+                stats["bytes_parsed"] += nbytes
+                if doc is None and error is None:
+                    stats["n_unchanged"] += 1
+                    continue
+                if error:
+                    logger.error("Error in {}.\n{}".format(path, error))
+                    stats["n_failed"] += 1
+                    stats["failed_dirs"].append(path)
+                    continue
+                stats["n_parsed"] += 1
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    stats["n_inserted"] += self._insert_task_batch(batch, use_gridfs, update_duplicates)
+                    batch = []
+        if batch:
+            stats["n_inserted"] += self._insert_task_batch(batch, use_gridfs, update_duplicates)
 
-        return t_id
+        stats["elapsed_time"] = time.time() - start
+        stats["dirs_per_sec"] = len(paths) / stats["elapsed_time"] if stats["elapsed_time"] else 0
+        stats["bytes_per_sec"] = stats["bytes_parsed"] / stats["elapsed_time"] \
+            if stats["elapsed_time"] else 0
+        logger.info("Parsed {} directories ({} unchanged, {} failed, {:.1f} MB) in {:.1f} s: "
+                    "{:.2f} dirs/s, {:.2f} MB/s".format(
+                        len(paths), stats["n_unchanged"], stats["n_failed"],
+                        stats["bytes_parsed"] / 1e6, stats["elapsed_time"],
+                        stats["dirs_per_sec"], stats["bytes_per_sec"] / 1e6))
+        return stats
+
+    def _insert_task_batch(self, task_docs, use_gridfs=False, update_duplicates=True):
+        """
+        Insert a batch of task documents with a single bulk write, followed by their
+        GridFS data if requested.
+
+        Returns:
+            (int) number of task documents inserted or updated
+        """
+        gridfs_data = [self._pop_gridfs_data(d) if use_gridfs else {} for d in task_docs]
+        self._invalidate_gridfs_cache([d["dir_name"] for d in task_docs])
+        t_ids = self.insert_many(task_docs, update_duplicates=update_duplicates)
+        for t_id, data in zip(t_ids, gridfs_data):
+            if t_id is not None:
+                self._insert_gridfs_data(t_id, data)
+        return len([t_id for t_id in t_ids if t_id is not None])
+
+    def _pop_gridfs_data(self, task_doc):
+        """
+        Remove the DOS, band structure and volumetric data of the last calculation from the task
+        document and return them serialized.
+
+        Args:
+            task_doc (dict): the task document
+
+        Returns:
+            (dict) json strings keyed by the name of the data, e.g. "dos" or "chgcar". With the
+            "binary" and "chunked" volumetric data formats, the volumetric data objects are
+            returned as is, as well as the trajectory arrays.
+        """
+        gridfs_data = {}
+        if "calcs_reversed" in task_doc:
+            # only store idx=0 (last step)
+            for name in GRIDFS_DATA_NAMES:
+                if name in task_doc["calcs_reversed"][0]:
+                    if name == "trajectory" or name in VOLUMETRIC_DATA_NAMES and \
+                            self.volumetric_data_format in ("binary", "chunked"):
+                        gridfs_data[name] = task_doc["calcs_reversed"][0][name]
+                    else:
+                        gridfs_data[name] = json.dumps(task_doc["calcs_reversed"][0][name],
+                                                       cls=MontyEncoder)
+                    del task_doc["calcs_reversed"][0][name]
+        return gridfs_data
 
-    def retrieve_task(self, task_id):
+    def _insert_gridfs_data(self, task_id, gridfs_data):
         """
-        Retrieves a task document and unpacks the band structure and DOS as dict
+        Insert the data returned by _pop_gridfs_data into the "<name>_fs" GridFS collections
+        and record the file ids in the task document.
+
+        Args:
+            task_id (int): task_id of the task document
+            gridfs_data (dict): json strings or volumetric data keyed by the name of the data
+        """
+        for name, data in gridfs_data.items():
+            if isinstance(data, str):
+                fs_id, compression_type = self.insert_gridfs(data, "{}_fs".format(name),
+                                                             task_id=task_id)
+            elif name == "trajectory":
+                fs_id, compression_type = self.insert_trajectory_gridfs(
+                    data, "{}_fs".format(name), task_id=task_id)
+            else:
+                fs_id, compression_type = self.insert_volumetric_gridfs(
+                    data, "{}_fs".format(name), task_id=task_id)
+            self.collection.update_one(
+                {"task_id": task_id},
+                {"$set": {"calcs_reversed.0.{}_compression".format(name): compression_type,
+                          "calcs_reversed.0.{}_fs_id".format(name): fs_id}})
+
+    def retrieve_task(self, task_id, properties=None, with_dos=True, with_bs=True,
+                      with_volumetric=True):
+        """
+        Retrieves a task document and unpacks the band structure and DOS as dict and the
+        volumetric data stored in GridFS as VolumetricData objects.
 
         Args:
             task_id: (int) task_id to retrieve
+            properties (list): fields of the task document to retrieve, e.g.
+                ["output", "calcs_reversed.output.energy"]. Defaults to the whole document.
+            with_dos (bool): whether to retrieve the DOS from GridFS
+            with_bs (bool): whether to retrieve the band structure from GridFS
+            with_volumetric (bool or list): whether to retrieve the volumetric data from GridFS,
+                or the names of the volumetric data to retrieve, e.g. ["chgcar"]
+
+        Returns:
+            (dict) task document with BS + DOS + volumetric data included, or None if there is
+            no task with this task_id
+        """
+        return next(self.retrieve_tasks({"task_id": task_id}, properties, with_dos, with_bs,
+                                        with_volumetric, batch_size=1), None)
+
+    def retrieve_tasks(self, query, properties=None, with_dos=True, with_bs=True,
+                       with_volumetric=True, batch_size=100):
+        """
+        Iterate over the task documents matching a query, with the data stored in GridFS
+        unpacked as in retrieve_task. The documents are fetched in batches and the GridFS files
+        of a batch are looked up with a single query per type of data.
+
+        Args:
+            query (dict): the query on the tasks collection
+            properties (list): fields of the task documents to retrieve. Defaults to the whole
+                documents.
+            with_dos (bool): whether to retrieve the DOS from GridFS
+            with_bs (bool): whether to retrieve the band structure from GridFS
+            with_volumetric (bool or list): whether to retrieve the volumetric data from GridFS,
+                or the names of the volumetric data to retrieve
+            batch_size (int): number of task documents fetched at a time
+
+        Yields:
+            (dict) task documents
+        """
+        names = []
+        if with_bs:
+            names.append("bandstructure")
+        if with_dos:
+            names.append("dos")
+        if with_volumetric:
+            names.extend(VOLUMETRIC_DATA_NAMES if with_volumetric is True else with_volumetric)
+
+        projection = None
+        if properties is not None:
+            # the GridFS file ids are needed even if not requested, unless they are already
+            # covered by a requested field (overlapping paths are rejected by MongoDB)
+            projection = {"task_id": 1}
+            fields = list(properties) + ["calcs_reversed.{}_fs_id".format(n) for n in names]
+            for field in sorted(set(fields), key=len):
+                if not any(field.startswith(p + ".") for p in projection):
+                    projection[field] = 1
+
+        cursor = self.collection.find(query, projection).batch_size(batch_size)
+        while True:
+            task_docs = list(itertools.islice(cursor, batch_size))
+            if not task_docs:
+                break
+            for name in names:
+                self._add_gridfs_objects(task_docs, name)
+            for task_doc in task_docs:
+                yield task_doc
+
+    def _add_gridfs_objects(self, task_docs, name):
+        """
+        Add the objects stored in the "<name>_fs" GridFS collection to the last calculation of
+        the task documents that reference one.
+        """
+        calcs = [(d.get("calcs_reversed") or [{}])[0] for d in task_docs]
+        fs_ids = [c.get("{}_fs_id".format(name)) for c in calcs]
+        if name == "dos":
+            decode = self._decode_dos
+        elif name == "bandstructure":
+            decode = self._decode_band_structure
+        else:
+            decode = self._decode_volumetric_grid_out
+        objs = self._get_gridfs_objects([f for f in fs_ids if f is not None], name, decode)
+        for calc, fs_id in zip(calcs, fs_ids):
+            if fs_id in objs:
+                obj = objs[fs_id]
+                calc[name] = obj.as_dict() if name in ("dos", "bandstructure") else obj
+
+    def _get_gridfs_objects(self, fs_ids, name, decode):
+        """
+        Get the objects decoded from several files of the "<name>_fs" GridFS collection, through
+        self.gridfs_cache if it is set.
 
         Returns:
-            (dict) complete task document with BS + DOS included
-
-        """
-        task_doc = self.collection.find_one({"task_id": task_id})
-        calc = task_doc["calcs_reversed"][0]
-        if 'bandstructure_fs_id' in calc:
-            bs = self.get_band_structure(task_id)
-            calc["bandstructure"] = bs.as_dict()
-        if 'dos_fs_id' in calc:
-            dos = self.get_dos(task_id)
-            calc["dos"] = dos.as_dict()
-        if 'chgcar_fs_id' in calc:
-            chgcar = self.get_chgcar(task_id)
-            calc["chgcar"] = chgcar
-        if 'aeccar0_fs_id' in calc:
-            aeccar = self.get_aeccar(task_id)
-            calc["aeccar0"] = aeccar['aeccar0']
-            calc["aeccar2"] = aeccar['aeccar2']
-        return task_doc
-
-    def insert_gridfs(self, d, collection="fs", compress=True, oid=None, task_id=None):
+            (dict) the objects keyed by file id
+        """
+        objs = {}
+        if self.gridfs_cache is not None:
+            for fs_id in fs_ids:
+                obj = self.gridfs_cache.get(fs_id)
+                if obj is not None:
+                    objs[fs_id] = obj
+        missing = [fs_id for fs_id in fs_ids if fs_id not in objs]
+        if missing:
+            fs = gridfs.GridFS(self.db, "{}_fs".format(name))
+            for grid_out in fs.find({"_id": {"$in": missing}}):
+                obj = decode(grid_out)
+                objs[grid_out._id] = obj
+                if self.gridfs_cache is not None:
+                    self.gridfs_cache.put(grid_out._id, obj)
+        return objs
+
+    def insert_gridfs(self, d, collection="fs", compress=True, oid=None, task_id=None,
+                      compression=None, compression_level=None, chunk_size=None, metadata=None):
         """
         Insert the given document into GridFS.
 
         Args:
-            d (dict): the document
+            d (str or bytes): the document
             collection (string): the GridFS collection name
             compress (bool): Whether to compress the data or not
             oid (ObjectId()): the _id of the file; if specified, it must not already exist in GridFS
             task_id(int or str): the task_id to store into the gridfs metadata
+            compression (str): codec from COMPRESSION_CODECS. Defaults to self.gridfs_compression.
+            compression_level (int): compression level. Defaults to self.gridfs_compression_level.
+            chunk_size (int): GridFS chunk size in bytes. Defaults to self.gridfs_chunk_size,
+                or the GridFS default if None.
+            metadata (dict): additional metadata to store with the file
         Returns:
             file id, the type of compression used.
         """
         oid = oid or ObjectId()
         compression_type = None
+        if isinstance(d, str):
+            d = d.encode()
 
         if compress:
-            d = zlib.compress(d.encode(), compress)
-            compression_type = "zlib"
+            compression_type = compression or self.gridfs_compression
+            level = self.gridfs_compression_level if compression_level is None else compression_level
+            d = compress_data(d, compression_type, level)
 
         fs = gridfs.GridFS(self.db, collection)
+        kwargs = {}
+        chunk_size = chunk_size or self.gridfs_chunk_size
+        if chunk_size:
+            kwargs["chunkSize"] = chunk_size
+        metadata = dict(metadata or {}, compression=compression_type)
         if task_id:
             # Putting task id in the metadata subdocument as per mongo specs:
             # https://github.com/mongodb/specifications/blob/master/source/gridfs/gridfs-spec.rst#terms
-            fs_id = fs.put(d, _id=oid, metadata={"task_id": task_id, "compression": compression_type})
-        else:
-            fs_id = fs.put(d, _id=oid, metadata={"compression": compression_type})
+            metadata["task_id"] = task_id
+        fs_id = fs.put(d, _id=oid, metadata=metadata, **kwargs)
 
         return fs_id, compression_type
 
+    def insert_volumetric_gridfs(self, vol_data, collection="fs", task_id=None, dtype=None,
+                                 chunked=None, block_size=None, **kwargs):
+        """
+        Insert volumetric data (e.g. a Chgcar) into GridFS in the binary format: the data arrays
+        are stored as raw little-endian buffers and the structure, grid dimensions and
+        augmentation data as a header in the file metadata. In the chunked variant, the arrays
+        are split into independently compressed blocks so that parts of the grid can be read
+        with get_volumetric_slice without downloading the whole file.
+
+        Args:
+            vol_data (VolumetricData or dict): the volumetric data or its dict representation
+            collection (string): the GridFS collection name
+            task_id(int or str): the task_id to store into the gridfs metadata
+            dtype (str): float type of the stored arrays, "float32" or "float64".
+                Defaults to self.volumetric_data_dtype.
+            chunked (bool): whether to use the chunked format. Defaults to True if
+                self.volumetric_data_format is "chunked".
+            block_size (int): number of grid points of a block along each axis, for the chunked
+                format. Defaults to self.volumetric_block_size.
+            **kwargs: other arguments of insert_gridfs, e.g. the compression
+
+        Returns:
+            file id, the type of compression used.
+        """
+        dtype = dtype or self.volumetric_data_dtype
+        if chunked is None:
+            chunked = self.volumetric_data_format == "chunked"
+        if not chunked:
+            header, buffer = encode_volumetric_data(vol_data, dtype)
+            return self.insert_gridfs(buffer, collection, task_id=task_id,
+                                      metadata={"format": "binary", "header": header}, **kwargs)
+
+        # the blocks are compressed individually, not the GridFS file
+        kwargs.pop("compress", None)
+        compression = kwargs.pop("compression", None) or self.gridfs_compression
+        level = kwargs.pop("compression_level", None)
+        level = self.gridfs_compression_level if level is None else level
+        header, buffer = encode_chunked_volumetric_data(
+            vol_data, dtype, block_size or self.volumetric_block_size, compression, level)
+        fs_id, _ = self.insert_gridfs(buffer, collection, compress=False, task_id=task_id,
+                                      metadata={"format": "chunked", "header": header}, **kwargs)
+        return fs_id, compression
+
+    def insert_trajectory_gridfs(self, trajectory, collection="fs", task_id=None,
+                                 dtype="float64", **kwargs):
+        """
+        Insert the trajectory of the ionic steps of a calculation into GridFS, as raw
+        little-endian buffers with the shapes of the arrays in the file metadata.
+
+        Args:
+            trajectory (dict): numpy arrays keyed by name, as returned by
+                atomate.vasp.drones.stream_vasprun, and the "species" list
+            collection (string): the GridFS collection name
+            task_id(int or str): the task_id to store into the gridfs metadata
+            dtype (str): float type of the stored arrays, "float32" or "float64"
+            **kwargs: other arguments of insert_gridfs, e.g. the compression
+
+        Returns:
+            file id, the type of compression used.
+        """
+        header, buffer = encode_trajectory(trajectory, dtype)
+        return self.insert_gridfs(buffer, collection, task_id=task_id,
+                                  metadata={"format": "trajectory", "header": header}, **kwargs)
+
+    def get_gridfs_data(self, fs_id, collection="fs"):
+        """
+        Read and decompress a GridFS file using the codec recorded in its metadata.
+
+        Args:
+            fs_id (ObjectId): the _id of the file
+            collection (str): the GridFS collection name
+
+        Returns:
+            (bytes) the decompressed content of the file
+        """
+        return self._read_grid_out(gridfs.GridFS(self.db, collection).get(fs_id))[0]
+
+    @staticmethod
+    def _read_grid_out(grid_out):
+        """
+        Read and decompress a GridFS file.
+
+        Returns:
+            (bytes, dict) the decompressed content and the metadata of the file
+        """
+        metadata = grid_out.metadata or {}
+        # files inserted before the codec was configurable were always zlib compressed
+        compression = metadata.get("compression", "zlib")
+        return decompress_data(grid_out.read(), compression), metadata
+
+    def _get_task_grid_out(self, task_id, name):
+        """
+        Get the GridFS file of the data (e.g. "dos" or "chgcar") of the last calculation of a task.
+        """
+        fs_id = self._get_task_fs_id(task_id, name)
+        return gridfs.GridFS(self.db, '{}_fs'.format(name)).get(fs_id)
+
+    def _get_task_fs_id(self, task_id, name):
+        key = '{}_fs_id'.format(name)
+        m_task = self.collection.find_one({"task_id": task_id}, {"calcs_reversed." + key: 1})
+        return m_task['calcs_reversed'][0][key]
+
+    def _get_task_gridfs_data(self, task_id, name):
+        """
+        Read the GridFS data (e.g. "dos" or "chgcar") of the last calculation of a task.
+        """
+        return self._read_grid_out(self._get_task_grid_out(task_id, name))[0]
+
+    def get_volumetric_data(self, task_id, name="chgcar"):
+        """
+        Read volumetric data stored in GridFS, in either the json, binary or chunked format.
+
+        Args:
+            task_id(int or str): the task_id containing the gridfs metadata
+            name (str): name of the data, e.g. "chgcar", "locpot" or "aeccar0"
+
+        Returns:
+            VolumetricData object, e.g. a Chgcar
+        """
+        return self._get_task_gridfs_object(task_id, name, self._decode_volumetric_grid_out)
+
+    def _decode_volumetric_grid_out(self, grid_out):
+        data, metadata = self._read_grid_out(grid_out)
+        if metadata.get("format") == "binary":
+            return decode_volumetric_data(metadata["header"], data)
+        elif metadata.get("format") == "chunked":
+            return decode_chunked_volumetric_data(metadata["header"], data)
+        return json.loads(data, cls=MontyDecoder)
+
+    def get_volumetric_slice(self, task_id, name="chgcar", axis=0, index_range=None, key="total"):
+        """
+        Read a slab of volumetric data, i.e. the grid points whose index along an axis is within
+        a range. For data stored in the chunked format, only the blocks intersecting the slab
+        are downloaded and decompressed. If a memory-mapped cache file was written by
+        get_volumetric_memmap in self.volumetric_cache_dir, the slab is read from it instead.
+
+        Args:
+            task_id(int or str): the task_id containing the gridfs metadata
+            name (str): name of the data, e.g. "chgcar" or "locpot"
+            axis (int): axis of the slab, 0, 1 or 2
+            index_range (tuple): (start, stop) grid indices along the axis, stop excluded.
+                Defaults to the whole axis.
+            key (str): the data array, e.g. "total" or "diff"
+
+        Returns:
+            (np.ndarray) the slab of the data array
+        """
+        grid_out = self._get_task_grid_out(task_id, name)
+        metadata = grid_out.metadata or {}
+        cache_file = self._get_volumetric_cache_file(grid_out._id, key)
+        if cache_file and os.path.exists(cache_file):
+            data = np.load(cache_file, mmap_mode="r")
+        elif metadata.get("format") != "chunked":
+            data = self._decode_volumetric_grid_out(grid_out).data[key]
+        else:
+            data = None
+
+        if data is not None:
+            start, stop = index_range or (0, data.shape[axis])
+            return np.take(data, range(start, stop), axis=axis)
+
+        dim = metadata["header"]["dim"]
+        start, stop = index_range or (0, dim[axis])
+        shape = list(dim)
+        shape[axis] = stop - start
+        slab = np.empty(shape)
+        for block, block_data in self._iter_volumetric_blocks(grid_out, key, axis, (start, stop)):
+            lo = max(block[axis].start, start)
+            hi = min(block[axis].stop, stop)
+            src = [slice(None)] * 3
+            src[axis] = slice(lo - block[axis].start, hi - block[axis].start)
+            dest = list(block)
+            dest[axis] = slice(lo - start, hi - start)
+            slab[tuple(dest)] = block_data[tuple(src)]
+        return slab
+
+    def get_volumetric_planar_average(self, task_id, name="locpot", axis=2, key="total"):
+        """
+        Average of volumetric data over the planes perpendicular to an axis, as computed by
+        VolumetricData.get_average_along_axis. Data stored in the chunked format is processed
+        block by block, without building the full grid in memory.
+
+        Args:
+            task_id(int or str): the task_id containing the gridfs metadata
+            name (str): name of the data, e.g. "locpot" or "chgcar"
+            axis (int): axis along which the planar average is computed
+            key (str): the data array, e.g. "total" or "diff"
+
+        Returns:
+            (np.ndarray) the planar averages
+        """
+        grid_out = self._get_task_grid_out(task_id, name)
+        other_axes = tuple(i for i in range(3) if i != axis)
+        if (grid_out.metadata or {}).get("format") != "chunked":
+            return np.mean(self._decode_volumetric_grid_out(grid_out).data[key], axis=other_axes)
+
+        dim = grid_out.metadata["header"]["dim"]
+        total = np.zeros(dim[axis])
+        for block, block_data in self._iter_volumetric_blocks(grid_out, key):
+            total[block[axis]] += block_data.sum(axis=other_axes)
+        return total / (dim[other_axes[0]] * dim[other_axes[1]])
+
+    def get_volumetric_memmap(self, task_id, name="chgcar", key="total", cache_dir=None):
+        """
+        Get a data array of volumetric data as a read-only memory-mapped .npy file in a local
+        cache directory. The file is written on the first call, block by block for the chunked
+        format; later calls and get_volumetric_slice read it without accessing GridFS.
+
+        Args:
+            task_id(int or str): the task_id containing the gridfs metadata
+            name (str): name of the data, e.g. "chgcar" or "locpot"
+            key (str): the data array, e.g. "total" or "diff"
+            cache_dir (str): the cache directory, which then becomes self.volumetric_cache_dir.
+                Defaults to self.volumetric_cache_dir.
+
+        Returns:
+            (np.memmap) the data array
+        """
+        if cache_dir:
+            self.volumetric_cache_dir = cache_dir
+        grid_out = self._get_task_grid_out(task_id, name)
+        cache_file = self._get_volumetric_cache_file(grid_out._id, key)
+        if not cache_file:
+            raise ValueError("A cache_dir is required to memory-map volumetric data!")
+
+        if not os.path.exists(cache_file):
+            os.makedirs(self.volumetric_cache_dir, exist_ok=True)
+            tmp_file = "{}.{}.tmp".format(cache_file, os.getpid())
+            if (grid_out.metadata or {}).get("format") == "chunked":
+                data = np.lib.format.open_memmap(tmp_file, mode="w+", dtype=np.float64,
+                                                 shape=tuple(grid_out.metadata["header"]["dim"]))
+                for block, block_data in self._iter_volumetric_blocks(grid_out, key):
+                    data[block] = block_data
+                data.flush()
+                del data
+            else:
+                with open(tmp_file, "wb") as f:
+                    np.save(f, self._decode_volumetric_grid_out(grid_out).data[key])
+            os.replace(tmp_file, cache_file)
+        return np.load(cache_file, mmap_mode="r")
+
+    def _get_volumetric_cache_file(self, fs_id, key):
+        if not self.volumetric_cache_dir:
+            return None
+        return os.path.join(self.volumetric_cache_dir, "{}_{}.npy".format(fs_id, key))
+
+    @staticmethod
+    def _iter_volumetric_blocks(grid_out, key, axis=0, index_range=None):
+        """
+        Iterate over the blocks of a GridFS file in the chunked format, reading only the bytes
+        of the blocks that intersect index_range along axis.
+
+        Yields:
+            (tuple, np.ndarray) the slices of the block and its data
+        """
+        header = grid_out.metadata["header"]
+        offsets = header["block_offsets"][key]
+        start, stop = index_range or (0, header["dim"][axis])
+        for i, block in enumerate(get_volumetric_blocks(header["dim"], header["block_size"])):
+            if block[axis].stop <= start or block[axis].start >= stop:
+                continue
+            grid_out.seek(offsets[i])
+            yield block, decode_volumetric_block(header, grid_out.read(offsets[i + 1] - offsets[i]),
+                                                 block)
+
     def get_band_structure(self, task_id):
-        m_task = self.collection.find_one({"task_id": task_id}, {"calcs_reversed": 1})
-        fs_id = m_task['calcs_reversed'][0]['bandstructure_fs_id']
-        fs = gridfs.GridFS(self.db, 'bandstructure_fs')
-        bs_json = zlib.decompress(fs.get(fs_id).read())
-        bs_dict = json.loads(bs_json.decode())
+        return self._get_task_gridfs_object(task_id, 'bandstructure', self._decode_band_structure)
+
+    def get_dos(self, task_id):
+        return self._get_task_gridfs_object(task_id, 'dos', self._decode_dos)
+
+    def get_trajectory(self, task_id):
+        """
+        Read the trajectory of the ionic steps of the last calculation of a task, stored when
+        the task was parsed with VaspDrone(stream_ionic_steps=True).
+
+        Args:
+            task_id(int or str): the task_id containing the gridfs metadata
+
+        Returns:
+            (dict) numpy arrays of the "lattice", "frac_coords", "forces", "stress" and energy
+            terms of the ionic steps, and the "species" list
+        """
+        return self._get_task_gridfs_object(task_id, 'trajectory', self._decode_trajectory)
+
+    def _decode_trajectory(self, grid_out):
+        data, metadata = self._read_grid_out(grid_out)
+        return decode_trajectory(metadata["header"], data)
+
+    def _decode_band_structure(self, grid_out):
+        bs_dict = json.loads(self._read_grid_out(grid_out)[0].decode())
         if bs_dict["@class"] == "BandStructure":
             return BandStructure.from_dict(bs_dict)
         elif bs_dict["@class"] == "BandStructureSymmLine":
@@ -200,20 +974,46 @@ class VaspCalcDb(CalcDb):
         else:
             raise ValueError("Unknown class for band structure! {}".format(bs_dict["@class"]))
 
-    def get_dos(self, task_id):
-        m_task = self.collection.find_one({"task_id": task_id}, {"calcs_reversed": 1})
-        fs_id = m_task['calcs_reversed'][0]['dos_fs_id']
-        fs = gridfs.GridFS(self.db, 'dos_fs')
-        dos_json = zlib.decompress(fs.get(fs_id).read())
-        dos_dict = json.loads(dos_json.decode())
+    def _decode_dos(self, grid_out):
+        dos_dict = json.loads(self._read_grid_out(grid_out)[0].decode())
         return CompleteDos.from_dict(dos_dict)
 
+    def _get_task_gridfs_object(self, task_id, name, decode):
+        """
+        Get the object decoded from the GridFS data (e.g. "dos" or "chgcar") of the last
+        calculation of a task, through self.gridfs_cache if it is set.
+
+        Args:
+            task_id(int or str): the task_id containing the gridfs metadata
+            name (str): name of the data
+            decode (callable): function decoding the object from the GridFS file
+        """
+        if self.gridfs_cache is None:
+            return decode(self._get_task_grid_out(task_id, name))
+
+        # the current fs_id of the task is always read, since the task may have been overwritten
+        # by another process; the cache is keyed by fs_id, which changes when the data does
+        fs_id = self._get_task_fs_id(task_id, name)
+        obj = self.gridfs_cache.get(fs_id)
+        if obj is None:
+            obj = decode(gridfs.GridFS(self.db, '{}_fs'.format(name)).get(fs_id))
+            self.gridfs_cache.put(fs_id, obj)
+        return obj
+
+    def _invalidate_gridfs_cache(self, dir_names):
+        """
+        Remove the GridFS data of the tasks about to be overwritten from self.gridfs_cache.
+        """
+        if self.gridfs_cache is None:
+            return
+        projection = ["calcs_reversed.{}_fs_id".format(n) for n in GRIDFS_DATA_NAMES]
+        for doc in self.collection.find({"dir_name": {"$in": dir_names}}, projection):
+            calc = (doc.get("calcs_reversed") or [{}])[0]
+            self.gridfs_cache.invalidate([calc[k] for k in calc if k.endswith("_fs_id")])
+
     def get_chgcar_string(self, task_id):
         # Not really used now, consier deleting
-        m_task = self.collection.find_one({"task_id": task_id}, {"calcs_reversed": 1})
-        fs_id = m_task['calcs_reversed'][0]['chgcar_fs_id']
-        fs = gridfs.GridFS(self.db, 'chgcar_fs')
-        return zlib.decompress(fs.get(fs_id).read())
+        return self._get_task_gridfs_data(task_id, 'chgcar')
 
     def get_chgcar(self, task_id):
         """
@@ -223,12 +1023,7 @@ class VaspCalcDb(CalcDb):
         Returns:
             chgcar: Chgcar object
         """
-        m_task = self.collection.find_one({"task_id": task_id}, {"calcs_reversed": 1})
-        fs_id = m_task['calcs_reversed'][0]['chgcar_fs_id']
-        fs = gridfs.GridFS(self.db, 'chgcar_fs')
-        chgcar_json = zlib.decompress(fs.get(fs_id).read())
-        chgcar= json.loads(chgcar_json, cls=MontyDecoder)
-        return chgcar
+        return self.get_volumetric_data(task_id, 'chgcar')
 
     def get_aeccar(self, task_id, check_valid = True):
         """
@@ -239,15 +1034,8 @@ class VaspCalcDb(CalcDb):
         Returns:
             {"aeccar0" : Chgcar, "aeccar2" : Chgcar}: dict of Chgcar objects
         """
-        m_task = self.collection.find_one({"task_id": task_id}, {"calcs_reversed": 1})
-        fs_id = m_task['calcs_reversed'][0]['aeccar0_fs_id']
-        fs = gridfs.GridFS(self.db, 'aeccar0_fs')
-        aeccar_json = zlib.decompress(fs.get(fs_id).read())
-        aeccar0 = json.loads(aeccar_json, cls=MontyDecoder)
-        fs_id = m_task['calcs_reversed'][0]['aeccar2_fs_id']
-        fs = gridfs.GridFS(self.db, 'aeccar2_fs')
-        aeccar_json = zlib.decompress(fs.get(fs_id).read())
-        aeccar2 = json.loads(aeccar_json, cls=MontyDecoder)
+        aeccar0 = self.get_volumetric_data(task_id, 'aeccar0')
+        aeccar2 = self.get_volumetric_data(task_id, 'aeccar2')
 
         if check_valid and (aeccar0.data['total'] + aeccar2.data['total']).min() < 0:
             ValueError(f"The AECCAR seems to be corrupted for task_id = {task_id}")
@@ -269,3 +1057,30 @@ class VaspCalcDb(CalcDb):
 
 
 # TODO: @albalu, @matk86, @computron - add BoltztrapCalcDB management here -computron, matk86
+
+
+def _assimilate_dir(drone, job):
+    """
+    Assimilate a single directory; used as the worker of VaspCalcDb.insert_tasks_from_dir.
+
+    Args:
+        drone (VaspDrone): the drone
+        job (tuple): path to the directory and the file fingerprints of its previous
+            task document or None
+
+    Returns:
+        (path, task document, number of bytes in the directory, traceback). Both the task
+        document and the traceback are None if the directory did not change.
+    """
+    path, previous_fingerprints = job
+    try:
+        if previous_fingerprints is not None:
+            fingerprints = drone.get_file_fingerprints(path, previous=previous_fingerprints)
+            if not drone.get_changed_tasks(fingerprints, previous_fingerprints):
+                return path, None, 0, None
+        nbytes = 0
+        for parent, subdirs, files in os.walk(path):
+            nbytes += sum(os.path.getsize(os.path.join(parent, f)) for f in files)
+        return path, drone.assimilate(path), nbytes, None
+    except Exception:
+        return path, None, 0, traceback.format_exc()
@@ -9,13 +9,18 @@ https://groups.google.com/forum/#!topic/pymatgen/pQ-emBpeV5U
 
 import os
 import re
+import copy
+import hashlib
 import datetime
 from fnmatch import fnmatch
 from collections import OrderedDict
 import json
 import glob
+import tempfile
+import time
 import traceback
 import warnings
+import xml.etree.ElementTree as ET
 
 from monty.io import zopen
 from monty.json import jsanitize
@@ -28,7 +33,7 @@ from pymatgen.core.structure import Structure
 from pymatgen.core.operations import SymmOp
 from pymatgen.electronic_structure.bandstructure import BandStructureSymmLine
 from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
-from pymatgen.io.vasp import BSVasprun, Vasprun, Outcar, Locpot
+from pymatgen.io.vasp import Vasprun, Outcar, Locpot
 from pymatgen.io.vasp.inputs import Poscar, Potcar, Incar, Kpoints
 from pymatgen.io.vasp.outputs import Chgcar
 from pymatgen.apps.borg.hive import AbstractDrone
@@ -38,7 +43,8 @@ from atomate.utils.utils import get_uri
 
 from atomate.utils.utils import get_logger
 from atomate import __version__ as atomate_version
-from atomate.vasp.config import STORE_VOLUMETRIC_DATA, STORE_ADDITIONAL_JSON
+from atomate.vasp.config import STORE_VOLUMETRIC_DATA, STORE_ADDITIONAL_JSON, \
+    STORE_FILE_FINGERPRINTS
 
 __author__ = 'Kiran Mathew, Shyue Ping Ong, Shyam Dwaraknath, Anubhav Jain'
 __email__ = 'kmathew@lbl.gov'
@@ -89,7 +95,9 @@ class VaspDrone(AbstractDrone):
                  parse_bader=bader_exe_exists, parse_chgcar=False, parse_aeccar=False,
                  parse_potcar_file=True,
                  store_volumetric_data=STORE_VOLUMETRIC_DATA,
-                 store_additional_json=STORE_ADDITIONAL_JSON):
+                 store_additional_json=STORE_ADDITIONAL_JSON,
+                 store_file_fingerprints=STORE_FILE_FINGERPRINTS,
+                 stream_ionic_steps=False, ionic_step_skip=None, ionic_step_fields=None):
         """
         Initialize a Vasp drone to parse vasp outputs
         Args:
@@ -116,6 +124,22 @@ class VaspDrone(AbstractDrone):
             'AECCAR0', 'AECCAR1', 'AECCAR2', 'ELFCAR'), case insensitive
             store_additional_json (bool): If True, parse any .json files present and store as
             sub-doc including the FW.json if present
+            store_file_fingerprints (bool): If True, store the size, mtime and md5 hash of the
+            parsed files in the "file_fingerprints" key, used to skip unchanged files when the
+            directory is assimilated again
+            stream_ionic_steps (bool): If True, read the ionic steps of the vasprun.xml files one
+            at a time instead of building them all in memory, e.g. for long MD runs. The
+            lattice, coordinates, forces, stress and energies of every step are stored as
+            numpy arrays in the "trajectory" key of the calculation, which VaspCalcDb moves to
+            GridFS. Only the last step is parsed by Vasprun, the other "ionic_steps" of the
+            calculation are built from the arrays according to ionic_step_skip and
+            ionic_step_fields
+            ionic_step_skip (int): with stream_ionic_steps, also keep every ionic_step_skip-th
+            ionic step in "ionic_steps". The last step is always kept, with all its fields.
+            Defaults to None, keeping the last step only
+            ionic_step_fields (list): with stream_ionic_steps, the keys of the ionic steps kept
+            with ionic_step_skip, among the energy terms, "forces", "stress" and "structure",
+            e.g. ["e_0_energy", "forces"]. Defaults to the energy terms only
         """
         self.parse_dos = parse_dos
         self.additional_fields = additional_fields or {}
@@ -128,6 +152,12 @@ class VaspDrone(AbstractDrone):
         self.store_volumetric_data = [f.lower() for f in store_volumetric_data]
         self.store_additional_json = store_additional_json
         self.parse_potcar_file = parse_potcar_file
+        self.store_file_fingerprints = store_file_fingerprints
+        self.stream_ionic_steps = stream_ionic_steps
+        self.ionic_step_skip = ionic_step_skip
+        self.ionic_step_fields = ionic_step_fields
+        # Vasprun objects of the file being processed, shared by the process_* methods
+        self._vasprun_cache = {}
 
         if parse_chgcar or parse_aeccar:
             warnings.warn("These options have been deprecated in favor of the 'store_volumetric_data' "
@@ -140,7 +170,7 @@ class VaspDrone(AbstractDrone):
             if parse_aeccar and "aeccar2" not in self.store_volumetric_data:
                 self.store_volumetric_data.append("aeccar2")
 
-    def assimilate(self, path):
+    def assimilate(self, path, previous_doc=None):
         """
         Adapted from matgendb.creator
         Parses vasp runs(vasprun.xml file) and insert the result into the db.
@@ -149,6 +179,9 @@ class VaspDrone(AbstractDrone):
 
         Args:
             path (str): Path to the directory containing vasprun.xml and OUTCAR files
+            previous_doc (dict): task dictionary previously assimilated from the same path,
+                including its "file_fingerprints". If given, only the calculations whose files
+                changed are parsed again and the previous_doc is returned as is if no file changed.
 
         Returns:
             (dict): a task dictionary
@@ -157,13 +190,114 @@ class VaspDrone(AbstractDrone):
         vasprun_files = self.filter_files(path, file_pattern="vasprun.xml")
         outcar_files = self.filter_files(path, file_pattern="OUTCAR")
         if len(vasprun_files) > 0 and len(outcar_files) > 0:
-            d = self.generate_doc(path, vasprun_files, outcar_files)
+            previous_fingerprints = (previous_doc or {}).get("file_fingerprints")
+            fingerprints = None
+            if self.store_file_fingerprints or previous_fingerprints is not None:
+                fingerprints = self.get_file_fingerprints(path, previous=previous_fingerprints)
+            previous_calcs = None
+            if previous_fingerprints is not None:
+                changed_tasks = self.get_changed_tasks(fingerprints, previous_fingerprints)
+                if not changed_tasks:
+                    logger.info("No file changed in {}, skipping parsing.".format(path))
+                    return previous_doc
+                previous_calcs = self._get_reusable_calcs(previous_doc, changed_tasks)
+            d = self.generate_doc(path, vasprun_files, outcar_files, previous_calcs=previous_calcs)
+            if fingerprints is not None:
+                d["file_fingerprints"] = fingerprints
             self.post_process(path, d)
         else:
             raise ValueError("No VASP files found!")
         self.validate_doc(d)
         return d
 
+    def get_file_fingerprints(self, path, previous=None):
+        """
+        Fingerprint the files read by the drone: the vasprun.xml, OUTCAR and volumetric files
+        of each calculation and the json and .orig files of the directory.
+
+        Args:
+            path (str): path to the folder
+            previous ([dict]): fingerprints previously computed for the same folder. The hash
+                of the files whose size and mtime did not change is reused instead of recomputed.
+
+        Returns:
+            ([dict]): one dict per file with the keys "file", "task" (the run name, "root" for
+            the files not specific to a run), "size", "mtime" and "md5"
+        """
+        previous = {fp["file"]: fp for fp in previous or []}
+        patterns = ["vasprun.xml", "OUTCAR"] + [f.upper() for f in self.store_volumetric_data]
+        if self.parse_locpot and "LOCPOT" not in patterns:
+            patterns.append("LOCPOT")
+        files = OrderedDict()
+        for pattern in patterns:
+            for taskname, filename in self.filter_files(path, file_pattern=pattern).items():
+                files[filename] = taskname
+        fullpath = os.path.abspath(path)
+        root_patterns = ["transformations.json*", "custodian.json*", "*.orig*"]
+        if self.store_additional_json:
+            root_patterns.append("*.json*")
+        for pattern in root_patterns:
+            for filename in sorted(glob.glob(os.path.join(fullpath, pattern))):
+                files.setdefault(os.path.basename(filename), "root")
+
+        fingerprints = []
+        for filename, taskname in files.items():
+            stat = os.stat(os.path.join(fullpath, filename))
+            prev = previous.get(filename)
+            if prev and prev["size"] == stat.st_size and prev["mtime"] == stat.st_mtime:
+                md5 = prev["md5"]
+            else:
+                md5 = _md5(os.path.join(fullpath, filename))
+            fingerprints.append({"file": filename, "task": taskname, "size": stat.st_size,
+                                 "mtime": stat.st_mtime, "md5": md5})
+        return fingerprints
+
+    @staticmethod
+    def get_changed_tasks(fingerprints, previous_fingerprints):
+        """
+        Compare two sets of file fingerprints of the same folder.
+
+        Args:
+            fingerprints ([dict]): current fingerprints, as returned by get_file_fingerprints
+            previous_fingerprints ([dict]): previous fingerprints
+
+        Returns:
+            (set): names of the tasks whose files were added, removed or modified
+        """
+        def by_task(fps):
+            d = {}
+            for fp in fps or []:
+                d.setdefault(fp["task"], set()).add((fp["file"], fp["size"], fp["md5"]))
+            return d
+
+        new, old = by_task(fingerprints), by_task(previous_fingerprints)
+        return {t for t in set(new) | set(old) if new.get(t) != old.get(t)}
+
+    @staticmethod
+    def _get_reusable_calcs(previous_doc, changed_tasks):
+        """
+        Get the calculations of a previous task doc whose files did not change, with the
+        outcar run_stats and the keys moved to the root of the doc by generate_doc restored.
+
+        Returns:
+            (dict): calculation dicts keyed by task name
+        """
+        calcs = {}
+        prev_calcs = previous_doc.get("calcs_reversed", [])
+        for i, calc in enumerate(prev_calcs):
+            name = calc["task"]["name"]
+            if name in changed_tasks or name not in previous_doc.get("run_stats", {}):
+                continue
+            calc = copy.deepcopy(calc)
+            calc["output"]["outcar"]["run_stats"] = previous_doc["run_stats"][name]
+            if i == 0:
+                calc["density"] = previous_doc["output"]["density"]
+            if i == len(prev_calcs) - 1:
+                calc["is_hubbard"] = previous_doc["input"]["is_hubbard"]
+                calc["hubbards"] = previous_doc["input"]["hubbards"]
+            calcs[name] = calc
+        return calcs
+
     def filter_files(self, path, file_pattern="vasprun.xml"):
         """
         Find the files that match the pattern in the given path and
@@ -201,19 +335,25 @@ class VaspDrone(AbstractDrone):
                     processed_files['standard'] = f
         return processed_files
 
-    def generate_doc(self, dir_name, vasprun_files, outcar_files):
+    def generate_doc(self, dir_name, vasprun_files, outcar_files, previous_calcs=None):
         """
         Adapted from matgendb.creator.generate_doc
+
+        previous_calcs (dict) can map task names to already parsed calculations, which are
+        used instead of parsing the corresponding vasprun.xml and OUTCAR files again.
         """
         try:
             # basic properties, incl. calcs_reversed and run_stats
+            previous_calcs = previous_calcs or {}
             fullpath = os.path.abspath(dir_name)
             d = jsanitize(self.additional_fields, strict=True)
             d["schema"] = {"code": "atomate", "version": VaspDrone.__version__}
             d["dir_name"] = fullpath
-            d["calcs_reversed"] = [self.process_vasprun(dir_name, taskname, filename)
+            d["calcs_reversed"] = [previous_calcs[taskname] if taskname in previous_calcs
+                                   else self.process_vasprun(dir_name, taskname, filename)
                                    for taskname, filename in vasprun_files.items()]
-            outcar_data = [Outcar(os.path.join(dir_name, filename)).as_dict()
+            outcar_data = [previous_calcs[taskname]["output"]["outcar"] if taskname in previous_calcs
+                           else Outcar(os.path.join(dir_name, filename)).as_dict()
                            for taskname, filename in outcar_files.items()]
             run_stats = {}
             for i, d_calc in enumerate(d["calcs_reversed"]):
@@ -340,13 +480,117 @@ class VaspDrone(AbstractDrone):
         """
         Adapted from matgendb.creator
 
-        Process a vasprun.xml file.
+        Process a vasprun.xml file. The file is parsed once, with the projected eigenvalues if
+        the band structure requires them, and the time spent in each step of the processing
+        is stored in the "parse_timings" key.
         """
         vasprun_file = os.path.join(dir_name, filename)
+        parse_projected_eigen = self._needs_projected_eigen(vasprun_file)
+        timings = {}
+        t0 = time.time()
+        try:
+            if not self.stream_ionic_steps:
+                vrun = self.get_vasprun(vasprun_file, parse_projected_eigen)
+                timings["vasprun"] = time.time() - t0
+                d = self._process_vasprun(dir_name, taskname, vasprun_file, vrun, timings)
+                timings["total"] = time.time() - t0
+                return d
+
+            with tempfile.TemporaryDirectory() as scratch_dir:
+                # Vasprun only parses a copy of the file reduced to the last ionic step
+                reduced_file = os.path.join(scratch_dir, "vasprun.xml")
+                with open(reduced_file, "wt") as f:
+                    trajectory = stream_vasprun(vasprun_file, f)
+                parse_potcar_file = self.parse_potcar_file
+                if parse_potcar_file is True:
+                    parse_potcar_file = os.path.dirname(os.path.abspath(vasprun_file))
+                vrun = self.get_vasprun(reduced_file, parse_projected_eigen, parse_potcar_file)
+                timings["vasprun"] = time.time() - t0
+                d = self._process_vasprun(dir_name, taskname, vasprun_file, vrun, timings)
+        finally:
+            self._vasprun_cache.clear()
+
+        trajectory["species"] = [str(sp) for sp in vrun.final_structure.species]
+        nsteps = len(trajectory["lattice"])
+        d["trajectory"] = trajectory
+        d["output"]["nionic_steps"] = nsteps
+        d["output"]["ionic_steps"] = self._get_ionic_steps(trajectory) + \
+            d["output"]["ionic_steps"][-1:]
+        # Vasprun only saw the last ionic step
+        nsw = vrun.parameters.get("NSW", 0)
+        d["has_vasp_completed"] = vrun.converged_electronic and (nsw <= 1 or nsteps < nsw)
+        timings["total"] = time.time() - t0
+        return d
 
-        vrun = Vasprun(vasprun_file, parse_potcar_file=self.parse_potcar_file)
+    def _get_ionic_steps(self, trajectory):
+        """
+        Get the ionic steps kept with ionic_step_skip, except the last one, from the trajectory
+        arrays read by stream_vasprun.
+        """
+        if not self.ionic_step_skip:
+            return []
+        fields = self.ionic_step_fields
+        energies = [k for k in trajectory if k not in TRAJECTORY_ARRAYS and k != "species"
+                    and (fields is None or k in fields)]
+        arrays = [k for k in ("forces", "stress") if fields and k in fields and k in trajectory]
+        steps = []
+        for i in range(0, len(trajectory["lattice"]) - 1, self.ionic_step_skip):
+            step = {k: float(trajectory[k][i]) for k in energies}
+            step.update({k: trajectory[k][i].tolist() for k in arrays})
+            if fields and "structure" in fields:
+                step["structure"] = Structure(trajectory["lattice"][i], trajectory["species"],
+                                              trajectory["frac_coords"][i]).as_dict()
+            steps.append(step)
+        return steps
+
+    def get_vasprun(self, filename, parse_projected_eigen=False, parse_potcar_file=None):
+        """
+        Parse a vasprun.xml file, reusing the Vasprun object of the file being processed if it
+        was already parsed with at least the requested data.
+
+        Args:
+            filename (str): path to the vasprun.xml file
+            parse_projected_eigen (bool): whether the projected eigenvalues are needed
+            parse_potcar_file (bool or str): passed to Vasprun. Defaults to
+                self.parse_potcar_file.
+
+        Returns:
+            Vasprun
+        """
+        key = os.path.abspath(filename)
+        vrun, projected = self._vasprun_cache.get(key, (None, False))
+        if vrun is None or (parse_projected_eigen and not projected):
+            if parse_potcar_file is None:
+                parse_potcar_file = self.parse_potcar_file
+            vrun = Vasprun(filename, parse_potcar_file=parse_potcar_file,
+                           parse_projected_eigen=parse_projected_eigen)
+            self._vasprun_cache[key] = (vrun, parse_projected_eigen)
+        return vrun
+
+    def _needs_projected_eigen(self, vasprun_file):
+        """
+        Whether process_bandstructure will need the projected eigenvalues of a vasprun.xml file,
+        decided from the incar in its header.
+        """
+        if self.bandstructure_mode is False:
+            return False
+        if str(self.bandstructure_mode).lower() == "auto":
+            incar = _read_vasprun_incar(vasprun_file)
+            return int(incar.get("ICHARG", 0)) > 10 and int(incar.get("NSW", 0)) <= 1
+        return bool(self.bandstructure_mode)
 
+    def _process_vasprun(self, dir_name, taskname, vasprun_file, vrun, timings):
+        """
+        Build the calculation dict of a parsed vasprun.xml file.
+        """
+        t0 = time.time()
+        # the projected eigenvalues are not stored, skip their (costly) serialization
+        projected_eigenvalues = vrun.projected_eigenvalues
+        vrun.projected_eigenvalues = None
         d = vrun.as_dict()
+        vrun.projected_eigenvalues = projected_eigenvalues
+        d["parse_timings"] = timings
+        timings["as_dict"] = time.time() - t0
 
         # rename formula keys
         for k, v in {"formula_pretty": "pretty_formula",
@@ -372,18 +616,23 @@ class VaspDrone(AbstractDrone):
             d["output"][k] = d["output"].pop(v)
 
         # Process bandstructure and DOS
+        t0 = time.time()
         if self.bandstructure_mode != False:
             bs = self.process_bandstructure(vrun)
             if bs:
                 d["bandstructure"] = bs
+        timings["bandstructure"] = time.time() - t0
 
+        t0 = time.time()
         if self.parse_dos != False:
             dos = self.process_dos(vrun)
             if dos:
                 d["dos"] = dos
+        timings["dos"] = time.time() - t0
 
         # Parse electronic information if possible.
         # For certain optimizers this is broken and we don't get an efermi resulting in the bandstructure
+        t0 = time.time()
         try:
             bs = vrun.get_band_structure()
             bs_gap = bs.get_band_gap()
@@ -405,6 +654,7 @@ class VaspDrone(AbstractDrone):
                 logger.error(traceback.format_exc())
                 logger.error("Error in " + os.path.abspath(dir_name) + ".\n" + traceback.format_exc())
                 raise
+        timings["electronic"] = time.time() - t0
 
         # store run name and location ,e.g. relax1, relax2, etc.
         d["task"] = {"type": taskname, "name": taskname}
@@ -413,6 +663,7 @@ class VaspDrone(AbstractDrone):
         d["output_file_paths"] = self.process_raw_data(dir_name, taskname=taskname)
 
         # parse axially averaged locpot
+        t0 = time.time()
         if "locpot" in d["output_file_paths"] and self.parse_locpot:
             locpot = Locpot.from_file(os.path.join(dir_name, d["output_file_paths"]["locpot"]))
             d["output"]["locpot"] = {i: locpot.get_average_along_axis(i) for i in range(3)}
@@ -427,6 +678,7 @@ class VaspDrone(AbstractDrone):
                     except:
                         raise ValueError("Failed to parse {} at {}.".format(file,
                                                                             d["output_file_paths"][file]))
+        timings["volumetric"] = time.time() - t0
 
         # parse force constants
         if hasattr(vrun, "force_constants"):
@@ -436,20 +688,29 @@ class VaspDrone(AbstractDrone):
 
         # perform Bader analysis using Henkelman bader
         if self.parse_bader and "chgcar" in d["output_file_paths"]:
+            t0 = time.time()
             suffix = '' if taskname == 'standard' else ".{}".format(taskname)
             bader = bader_analysis_from_path(dir_name, suffix=suffix)
             d["bader"] = bader
+            timings["bader"] = time.time() - t0
 
         return d
 
     def process_bandstructure(self, vrun):
-
-        vasprun_file = vrun.filename
+        """
+        Get the band structure of a parsed vasprun.xml file as a dict, or None. When the
+        projections are needed, the file is only parsed again if vrun was not obtained from
+        get_vasprun with parse_projected_eigen=True.
+        """
         # Band structure parsing logic
         if str(self.bandstructure_mode).lower() == "auto":
+            # only save the bandstructure if not moving ions
+            if vrun.incar.get("NSW", 0) > 1:
+                return None
+
             # if NSCF calculation
             if vrun.incar.get("ICHARG", 0) > 10:
-                bs_vrun = BSVasprun(vasprun_file, parse_projected_eigen=True)
+                bs_vrun = self.get_vasprun(vrun.filename, parse_projected_eigen=True)
                 try:
                     # Try parsing line mode
                     bs = bs_vrun.get_band_structure(line_mode=True)
@@ -458,16 +719,12 @@ class VaspDrone(AbstractDrone):
                     bs = bs_vrun.get_band_structure()
             # else just regular calculation
             else:
-                bs_vrun = BSVasprun(vasprun_file, parse_projected_eigen=False)
-                bs = bs_vrun.get_band_structure()
-
-            # only save the bandstructure if not moving ions
-            if vrun.incar.get("NSW", 0) <= 1:
-                return bs.as_dict()
+                bs = vrun.get_band_structure()
+            return bs.as_dict()
 
         # legacy line/True behavior for bandstructure_mode
         elif self.bandstructure_mode:
-            bs_vrun = BSVasprun(vasprun_file, parse_projected_eigen=True)
+            bs_vrun = self.get_vasprun(vrun.filename, parse_projected_eigen=True)
             bs = bs_vrun.get_band_structure(line_mode=(str(self.bandstructure_mode).lower() == "line"))
             return bs.as_dict()
 
@@ -689,7 +946,11 @@ class VaspDrone(AbstractDrone):
             "bandstructure_mode": self.bandstructure_mode,
             "additional_fields": self.additional_fields,
             "use_full_uri": self.use_full_uri,
-            "runs": self.runs}
+            "runs": self.runs,
+            "store_file_fingerprints": self.store_file_fingerprints,
+            "stream_ionic_steps": self.stream_ionic_steps,
+            "ionic_step_skip": self.ionic_step_skip,
+            "ionic_step_fields": self.ionic_step_fields}
         return {"@module": self.__class__.__module__,
                 "@class": self.__class__.__name__,
                 "version": self.__class__.__version__,
@@ -699,3 +960,109 @@ class VaspDrone(AbstractDrone):
     @classmethod
     def from_dict(cls, d):
         return cls(**d["init_args"])
+
+
+def _md5(filename, blocksize=2 ** 20):
+    """
+    md5 hash of the raw content of a file, read in blocks.
+    """
+    md5 = hashlib.md5()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+# the arrays of the ionic steps read by stream_vasprun, besides the energy terms
+TRAJECTORY_ARRAYS = ("lattice", "frac_coords", "forces", "stress")
+
+
+def stream_vasprun(filename, output):
+    """
+    Read the ionic steps of a vasprun.xml file one at a time, while writing a copy of the file
+    reduced to the last ionic step. Only one ionic step is held in memory as xml at a time.
+
+    Args:
+        filename (str): path to the vasprun.xml file, possibly compressed
+        output (file): text file object the reduced vasprun.xml is written to
+
+    Returns:
+        (dict) trajectory: numpy arrays over the ionic steps of the "lattice" (n, 3, 3),
+        "frac_coords" (n, nsites, 3), "forces" (n, nsites, 3) and "stress" (n, 3, 3), and of
+        each energy term of the steps, e.g. "e_fr_energy" (n,)
+    """
+    steps = {k: [] for k in TRAJECTORY_ARRAYS}
+    energies = OrderedDict()
+    calc, previous = None, None
+    n = 0
+    with zopen(filename, "rt") as f:
+        for line in f:
+            tag = line.strip()
+            if tag == "<calculation>":
+                calc, previous = [line], None
+            elif calc is not None:
+                calc.append(line)
+                if tag == "</calculation>":
+                    _read_ionic_step(ET.fromstring("".join(calc)), steps, energies)
+                    calc, previous = None, calc
+                    n += 1
+            elif previous is not None and not tag:
+                continue
+            else:
+                if previous is not None:
+                    # the last ionic step
+                    output.writelines(previous)
+                    previous = None
+                output.write(line)
+    # a truncated file ends within or right after an ionic step
+    output.writelines(previous or calc or [])
+
+    trajectory = {k: np.array(v) for k, v in steps.items() if len(v) == n}
+    trajectory.update({k: np.array(v) for k, v in energies.items() if len(v) == n})
+    return trajectory
+
+
+def _read_ionic_step(elem, steps, energies):
+    """
+    Append the data of a <calculation> element of vasprun.xml to the lists of stream_vasprun.
+    """
+    def varray(e):
+        return np.array([[_vasp_float(x) for x in v.text.split()] for v in e.findall("v")])
+
+    structure = elem.find("structure")
+    steps["lattice"].append(varray(structure.find("crystal/varray[@name='basis']")))
+    steps["frac_coords"].append(varray(structure.find("varray[@name='positions']")))
+    for name in ("forces", "stress"):
+        e = elem.find("varray[@name='{}']".format(name))
+        if e is not None:
+            steps[name].append(varray(e))
+    for e in elem.find("energy").findall("i"):
+        energies.setdefault(e.attrib["name"].strip(), []).append(_vasp_float(e.text))
+
+
+def _read_vasprun_incar(filename):
+    """
+    Read the <incar> element at the start of a vasprun.xml file, without reading the rest of
+    the file.
+
+    Returns:
+        (dict) the raw values of the incar parameters keyed by name
+    """
+    lines = []
+    with zopen(filename, "rt") as f:
+        for line in f:
+            if lines or line.strip().startswith("<incar"):
+                lines.append(line)
+                if line.strip() == "</incar>":
+                    break
+    if not lines:
+        return {}
+    return {i.attrib["name"]: i.text.strip() for i in ET.fromstring("".join(lines)).findall("i")}
+
+
+def _vasp_float(x):
+    # VASP writes asterisks for the numbers that overflow the output format
+    try:
+        return float(x)
+    except ValueError:
+        return float("nan")
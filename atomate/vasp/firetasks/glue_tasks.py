@@ -1,5 +1,6 @@
 # coding: utf-8
 
+import fnmatch
 import glob
 
 from pymatgen.analysis.elasticity.strain import Strain
@@ -12,8 +13,6 @@ between different Firetasks and Fireworks. This module also contains tasks that
 flow of the workflow, e.g. tasks to check stability or the gap is within a certain range.
 """
 
-import shutil
-import gzip
 import os
 import re
 
@@ -58,10 +57,28 @@ class CopyVaspOutputs(CopyFiles):
             everything
         contcar_to_poscar(bool): If True (default), will move CONTCAR to
             POSCAR (original POSCAR is not copied).
+        nthreads (int): number of concurrent copies. Supports env_chk. Defaults to 4.
+        max_bandwidth (float): maximum total bandwidth of the copies in MB/s. Supports
+            env_chk. Defaults to no limit.
+        staging (str): how the local files are staged: "copy" (default), "hardlink",
+            "reflink" (copy-on-write clone) or "symlink", e.g. "reflink" or "hardlink" to
+            stage a large WAVECAR or CHGCAR instantly on the same filesystem. Falls back to
+            a copy when the filesystem does not support it. Hard links and symlinks share the
+            data with the previous calculation, so only use them if VASP does not write the
+            staged files again (e.g. LWAVE = False for a staged WAVECAR). Gzipped files are
+            decompressed in full instead, unless decompress is False: to stage the WAVECAR
+            or CHGCAR of the previous calculation, leave them uncompressed with the
+            gzip_exclude option of RunVaspCustodian. Supports env_chk.
+        staging_files ([str]): file name patterns of the files staged with the staging mode.
+            The other files, e.g. the INCAR, KPOINTS and POSCAR that are rewritten in place
+            by the next calculation, are always copied. Defaults to ["WAVECAR", "CHGCAR"].
+        decompress (bool): If True (default), gzipped files are decompressed while they
+            are copied. If False, they are staged as is, e.g. for readers of .gz files.
     """
 
     optional_params = ["calc_loc", "calc_dir", "filesystem", "additional_files",
-                       "contcar_to_poscar"]
+                       "contcar_to_poscar", "nthreads", "max_bandwidth", "staging",
+                       "staging_files", "decompress"]
 
     def run_task(self, fw_spec):
 
@@ -87,13 +104,18 @@ class CopyVaspOutputs(CopyFiles):
         # setup the copy
         self.setup_copy(self.get("calc_dir", None),
                         filesystem=self.get("filesystem", None),
-                        files_to_copy=files_to_copy, from_path_dict=calc_loc)
+                        files_to_copy=files_to_copy, from_path_dict=calc_loc,
+                        fw_spec=fw_spec, nthreads=self.get("nthreads"),
+                        max_bandwidth=self.get("max_bandwidth"),
+                        staging=self.get("staging"), staging_files=self.get("staging_files"))
         # do the copying
         self.copy_files()
 
     def copy_files(self):
         all_files = self.fileclient.listdir(self.from_dir)
-        # start file copy
+        # find the files to copy, then copy them concurrently
+        decompress = self.get("decompress", True)
+        files = []
         for f in self.files_to_copy:
             prev_path_full = os.path.join(self.from_dir, f)
             dest_fname = 'POSCAR' if f == 'CONTCAR' and self.get(
@@ -101,8 +123,7 @@ class CopyVaspOutputs(CopyFiles):
             dest_path = os.path.join(self.to_dir, dest_fname)
 
             relax_ext = ""
-            relax_paths = sorted(
-                self.fileclient.glob(prev_path_full + ".relax*"))
+            relax_paths = sorted(fnmatch.filter(all_files, f + ".relax*"))
             if relax_paths:
                 if len(relax_paths) > 9:
                     raise ValueError(
@@ -120,16 +141,15 @@ class CopyVaspOutputs(CopyFiles):
             if not (f + relax_ext + gz_ext) in all_files:
                 raise ValueError("Cannot find file: {}".format(f))
 
-            # copy the file (minus the relaxation extension)
-            self.fileclient.copy(prev_path_full + relax_ext + gz_ext,
-                                 dest_path + gz_ext)
+            # copy the file (minus the relaxation extension), the .gz files are decompressed
+            # on the fly unless they are staged as is
+            if not decompress:
+                dest_path += gz_ext
+            files.append((prev_path_full + relax_ext + gz_ext, dest_path))
 
-            # unzip the .gz if needed
-            if gz_ext in ['.gz', ".GZ"]:
-                # unzip dest file
-                with open(dest_path, 'wb') as f_out, gzip.open(dest_path + gz_ext, 'rb') as f_in:
-                    shutil.copyfileobj(f_in, f_out)
-                os.remove(dest_path + gz_ext)
+        self.fileclient.copy_many(files, nthreads=self.nthreads, max_bandwidth=self.max_bandwidth,
+                                  mode=self.staging, staging_files=self.staging_files,
+                                  decompress=decompress)
 
 
 @explicit_serialize
@@ -75,12 +75,20 @@ class VaspToDb(FiretaskBase):
             The path is a full mongo-style path so subdocuments can be referneced
             using dot notation and array keys can be referenced using the index.
             E.g "calcs_reversed.0.output.outar.run_stats"
+        stream_ionic_steps (bool): read the ionic steps of vasprun.xml one at a time and store
+            their trajectory in GridFS instead of the task doc, e.g. for long MD runs.
+            Defaults to False.
+        ionic_step_skip (int): with stream_ionic_steps, also keep every ionic_step_skip-th
+            ionic step in the task doc. Defaults to None, keeping the last step only.
+        ionic_step_fields (list): with stream_ionic_steps, the keys of the ionic steps kept
+            with ionic_step_skip. Defaults to the energy terms.
     """
     optional_params = ["calc_dir", "calc_loc", "parse_dos", "bandstructure_mode",
                        "additional_fields", "db_file", "fw_spec_field", "defuse_unsuccessful",
                        "task_fields_to_push", "parse_chgcar", "parse_aeccar",
                        "parse_potcar_file",
-                       "store_volumetric_data"]
+                       "store_volumetric_data", "stream_ionic_steps", "ionic_step_skip",
+                       "ionic_step_fields"]
 
     def run_task(self, fw_spec):
         # get the directory that contains the VASP dir to parse
@@ -99,7 +107,10 @@ class VaspToDb(FiretaskBase):
                           bandstructure_mode=self.get("bandstructure_mode", False),
                           parse_chgcar=self.get("parse_chgcar", False),  # deprecated
                           parse_aeccar=self.get("parse_aeccar", False),  # deprecated
-                          store_volumetric_data=self.get("store_volumetric_data", STORE_VOLUMETRIC_DATA))
+                          store_volumetric_data=self.get("store_volumetric_data", STORE_VOLUMETRIC_DATA),
+                          stream_ionic_steps=self.get("stream_ionic_steps", False),
+                          ionic_step_skip=self.get("ionic_step_skip"),
+                          ionic_step_fields=self.get("ionic_step_fields"))
 
         # assimilate (i.e., parse)
         task_doc = drone.assimilate(calc_dir)
@@ -113,6 +124,10 @@ class VaspToDb(FiretaskBase):
 
         # db insertion or taskdoc dump
         if not db_file:
+            # the trajectory arrays of stream_ionic_steps are not JSON serializable
+            for calc in task_doc.get("calcs_reversed", []):
+                if "trajectory" in calc:
+                    calc["trajectory"] = jsanitize(calc["trajectory"])
             with open("task.json", "w") as f:
                 f.write(json.dumps(task_doc, default=DATETIME_HANDLER))
         else:
@@ -122,7 +137,8 @@ class VaspToDb(FiretaskBase):
                 or bool(self.get("bandstructure_mode", False))
                 or self.get("parse_chgcar", False)  # deprecated
                 or self.get("parse_aeccar", False)  # deprecated
-                or bool(self.get("store_volumetric_data", STORE_VOLUMETRIC_DATA)))
+                or bool(self.get("store_volumetric_data", STORE_VOLUMETRIC_DATA))
+                or self.get("stream_ionic_steps", False))
             logger.info("Finished parsing with task_id: {}".format(t_id))
 
         defuse_children = False
@@ -30,6 +30,7 @@ from custodian.vasp.validators import VasprunXMLValidator, VaspFilesValidator
 from fireworks import explicit_serialize, FiretaskBase, FWAction
 
 from atomate.utils.utils import env_chk, get_logger
+from atomate.utils.fileio import gzip_dir
 from atomate.vasp.config import CUSTODIAN_MAX_ERRORS
 
 __author__ = 'Anubhav Jain <ajain@lbl.gov>'
@@ -81,6 +82,13 @@ class RunVaspCustodian(FiretaskBase):
         scratch_dir: (str) - if specified, uses this directory as the root scratch dir.
             Supports env_chk.
         gzip_output: (bool) - gzip output (default=T)
+        gzip_nthreads: (int) - if set, the output is gzipped on this number of threads, the
+            files and the blocks of the large files being compressed concurrently, instead of
+            sequentially by custodian. Supports env_chk.
+        gzip_exclude: ([str]) - file name patterns of the outputs left uncompressed, e.g.
+            ["WAVECAR", "CHGCAR"] so that the next calculation can stage them with links (see
+            the staging option of CopyVaspOutputs) instead of decompressing them.
+            Supports env_chk.
         max_errors: (int) - maximum # of errors to fix before giving up (default=5)
         ediffg: (float) shortcut for setting EDIFFG in special custodian jobs
         auto_npar: (bool) - use auto_npar (default=F). Recommended set to T
@@ -93,7 +101,8 @@ class RunVaspCustodian(FiretaskBase):
     required_params = ["vasp_cmd"]
     optional_params = ["job_type", "handler_group", "max_force_threshold", "scratch_dir",
                        "gzip_output", "max_errors", "ediffg", "auto_npar", "gamma_vasp_cmd",
-                       "wall_time","half_kpts_first_relax"]
+                       "wall_time","half_kpts_first_relax", "gzip_nthreads",
+                       "gzip_exclude"]
 
     def run_task(self, fw_spec):
 
@@ -119,6 +128,8 @@ class RunVaspCustodian(FiretaskBase):
         job_type = self.get("job_type", "normal")
         scratch_dir = env_chk(self.get("scratch_dir"), fw_spec)
         gzip_output = self.get("gzip_output", True)
+        gzip_nthreads = env_chk(self.get("gzip_nthreads"), fw_spec, strict=False, default=None)
+        gzip_exclude = env_chk(self.get("gzip_exclude"), fw_spec, strict=False, default=None)
         max_errors = self.get("max_errors", CUSTODIAN_MAX_ERRORS)
         auto_npar = env_chk(self.get("auto_npar"), fw_spec, strict=False, default=False)
         gamma_vasp_cmd = env_chk(self.get("gamma_vasp_cmd"), fw_spec, strict=False, default=None)
@@ -199,9 +210,23 @@ class RunVaspCustodian(FiretaskBase):
             validators = [VasprunXMLValidator(), VaspFilesValidator()]
 
         c = Custodian(handlers, jobs, validators=validators, max_errors=max_errors,
-                      scratch_dir=scratch_dir, gzipped_output=gzip_output)
-
-        c.run()
+                      scratch_dir=scratch_dir,
+                      gzipped_output=gzip_output and not (gzip_nthreads or gzip_exclude))
+
+        completed = False
+        try:
+            c.run()
+            completed = True
+        finally:
+            # gzip the output even if custodian failed, as custodian does
+            if gzip_output and (gzip_nthreads or gzip_exclude):
+                try:
+                    gzip_dir(os.getcwd(), nthreads=gzip_nthreads, exclude=gzip_exclude)
+                except Exception:
+                    # the error of custodian is the one raised
+                    if completed:
+                        raise
+                    logger.exception("Could not gzip the output of the failed run")
 
         if os.path.exists(zpath("custodian.json")):
             stored_custodian_data = {"custodian": loadfn(zpath("custodian.json"))}
@@ -83,6 +83,31 @@ class TestCopyVaspOutputs(AtomateTest):
         for f in no_files:
             self.assertFalse(os.path.exists(os.path.join(self.scratch_dir, f)))
 
+    def test_gzip_copy_compressed(self):
+        ct = CopyVaspOutputs(calc_dir=self.gzip_outdir, decompress=False)
+        ct.run_task({})
+        for f in ["INCAR", "KPOINTS", "POTCAR", "POSCAR"]:
+            self.assertTrue(os.path.exists(os.path.join(self.scratch_dir, f + ".gz")))
+            self.assertFalse(os.path.exists(os.path.join(self.scratch_dir, f)))
+
+    def test_staging_modes(self):
+        for staging in ["hardlink", "reflink", "symlink"]:
+            ct = CopyVaspOutputs(calc_dir=self.plain_outdir, staging=staging)
+            ct.run_task({})
+            # the files are linked, or copied if the filesystem does not support it
+            with open(os.path.join(self.plain_outdir, "CONTCAR")) as f1:
+                with open(os.path.join(self.scratch_dir, "POSCAR")) as f2:
+                    self.assertEqual(f1.read(), f2.read())
+            # only the WAVECAR and CHGCAR are staged by default, the inputs are copied
+            for f in ["INCAR", "KPOINTS", "POSCAR"]:
+                self.assertFalse(os.path.islink(os.path.join(self.scratch_dir, f)))
+        CopyVaspOutputs(calc_dir=self.plain_outdir, staging="symlink",
+                        staging_files=["OUTCAR"]).run_task({})
+        self.assertTrue(os.path.islink(os.path.join(self.scratch_dir, "OUTCAR")))
+        self.assertFalse(os.path.islink(os.path.join(self.scratch_dir, "INCAR")))
+        self.assertRaises(ValueError, CopyVaspOutputs(calc_dir=self.plain_outdir,
+                                                      staging="move").run_task, {})
+
     def test_relax2_copy(self):
         ct = CopyVaspOutputs(calc_dir=self.relax2_outdir, additional_files=["IBZKPT"])
         ct.run_task({})
@@ -0,0 +1,44 @@
+# coding: utf-8
+
+import os
+import unittest
+from unittest import mock
+
+from atomate.vasp.firetasks.run_calc import RunVaspCustodian
+from atomate.utils.testing import AtomateTest
+
+
+class TestRunVaspCustodian(AtomateTest):
+
+    def setUp(self):
+        super(TestRunVaspCustodian, self).setUp(lpad=False)
+
+    @mock.patch("atomate.vasp.firetasks.run_calc.gzip_dir")
+    @mock.patch("atomate.vasp.firetasks.run_calc.Custodian")
+    def test_gzip_output(self, custodian, gzip_dir):
+        task = RunVaspCustodian(vasp_cmd="vasp", gzip_nthreads=2)
+        task.run_task({})
+        gzip_dir.assert_called_once_with(os.getcwd(), nthreads=2, exclude=None)
+        # the output is gzipped by gzip_dir instead of custodian
+        self.assertFalse(custodian.call_args[1]["gzipped_output"])
+
+        # the output of a failed run is gzipped, and the error of custodian is raised even if
+        # gzip fails
+        custodian.return_value.run.side_effect = RuntimeError("custodian")
+        gzip_dir.side_effect = IOError("gzip")
+        with self.assertRaisesRegex(RuntimeError, "custodian"):
+            task.run_task({})
+        self.assertEqual(gzip_dir.call_count, 2)
+
+        custodian.return_value.run.side_effect = None
+        self.assertRaises(IOError, task.run_task, {})
+
+        # the outputs staged by the next calculation are left uncompressed
+        gzip_dir.side_effect = None
+        RunVaspCustodian(vasp_cmd="vasp", gzip_exclude=["WAVECAR"]).run_task({})
+        self.assertFalse(custodian.call_args[1]["gzipped_output"])
+        gzip_dir.assert_called_with(os.getcwd(), nthreads=None, exclude=["WAVECAR"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1188,6 +1188,7 @@ class MDFW(Firework):
                 db_file=db_file,
                 additional_fields={"task_label": name},
                 defuse_unsuccessful=False,
+                stream_ionic_steps=True,
             )
         )
         super(MDFW, self).__init__(
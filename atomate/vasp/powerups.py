@@ -873,12 +873,14 @@ def use_gamma_vasp(original_wf, gamma_vasp_cmd):
     return original_wf
 
 
-def modify_gzip_vasp(original_wf, gzip_output):
+def modify_gzip_vasp(original_wf, gzip_output, nthreads=None):
     """
     For all RunVaspCustodian tasks, modify gzip_output boolean
     Args:
         original_wf (Workflow)
         gzip_output (bool): Value to set gzip_output to for RunVaspCustodian
+        nthreads (int): if set, the output is gzipped on this number of threads (supports
+            env_chk, e.g. ">>gzip_nthreads<<")
     Returns:
        Workflow
     """
@@ -887,6 +889,8 @@ def modify_gzip_vasp(original_wf, gzip_output):
     )
     for idx_fw, idx_t in idx_list:
         original_wf.fws[idx_fw].tasks[idx_t]["gzip_output"] = gzip_output
+        if nthreads:
+            original_wf.fws[idx_fw].tasks[idx_t]["gzip_nthreads"] = nthreads
     return original_wf
 
 
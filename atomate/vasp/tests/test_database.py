@@ -0,0 +1,219 @@
+# coding: utf-8
+
+import os
+import copy
+import json
+import unittest
+
+import numpy as np
+
+from pymatgen.io.vasp.outputs import Chgcar
+
+from atomate.vasp.database import VaspCalcDb, compress_data, encode_volumetric_data, \
+    decode_volumetric_data, encode_chunked_volumetric_data, decode_chunked_volumetric_data, \
+    get_volumetric_blocks, encode_trajectory, decode_trajectory
+from atomate.vasp.drones import VaspDrone
+from atomate.utils.database import GridFSCache
+from atomate.utils.testing import AtomateTest
+
+module_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)))
+db_dir = os.path.join(module_dir, "..", "..", "common", "test_files")
+test_files = os.path.join(module_dir, "..", "test_files")
+
+
+class VaspCalcDbTest(AtomateTest):
+
+    def setUp(self):
+        super(VaspCalcDbTest, self).setUp()
+        self.mmdb = VaspCalcDb.from_db_file(os.path.join(db_dir, "db.json"))
+
+    def test_insert_tasks_from_dir(self):
+        root = os.path.join(test_files, "Si_structure_optimization_relax2")
+        drone = VaspDrone(runs=["relax1", "relax2"], store_volumetric_data=[])
+        stats = self.mmdb.insert_tasks_from_dir(root, drone=drone, nproc=2, batch_size=1)
+        self.assertEqual(stats["n_dirs"], 1)
+        self.assertEqual(stats["n_failed"], 0)
+        self.assertEqual(stats["n_inserted"], 1)
+        self.assertGreater(stats["bytes_parsed"], 0)
+        self.assertEqual(self.mmdb.collection.count_documents({}), 1)
+
+        # a second pass over the same directories updates the same task
+        stats = self.mmdb.insert_tasks_from_dir(root, drone=drone, nproc=2)
+        self.assertEqual(stats["n_inserted"], 1)
+        self.assertEqual(self.mmdb.collection.count_documents({}), 1)
+
+        # unchanged directories are skipped in incremental mode
+        stats = self.mmdb.insert_tasks_from_dir(root, drone=drone, nproc=2, incremental=True)
+        self.assertEqual(stats["n_unchanged"], 1)
+        self.assertEqual(stats["n_inserted"], 0)
+
+    def test_insert_many(self):
+        docs = [{"dir_name": "a", "data": 1}, {"dir_name": "b", "data": 2},
+                {"dir_name": "a", "data": 3}]
+        t_ids = self.mmdb.insert_many(docs)
+        self.assertEqual(t_ids[0], t_ids[2])
+        self.assertNotEqual(t_ids[0], t_ids[1])
+        self.assertEqual(self.mmdb.collection.find_one({"dir_name": "a"})["data"], 3)
+
+        t_ids_2 = self.mmdb.insert_many([{"dir_name": "b", "data": 4}, {"dir_name": "c"}],
+                                        update_duplicates=False)
+        self.assertIsNone(t_ids_2[0])
+        self.assertEqual(t_ids_2[1], max(t_ids) + 1)
+        self.assertEqual(self.mmdb.collection.find_one({"dir_name": "b"})["data"], 2)
+        self.assertEqual(self.mmdb.insert({"dir_name": "d"}), max(t_ids) + 2)
+
+    def test_gridfs_compression(self):
+        data = json.dumps({"a": list(range(1000))})
+        for codec in ["zlib", "gzip", "lzma", None]:
+            fs_id, compression = self.mmdb.insert_gridfs(data, "test_fs", compression=codec,
+                                                         compress=codec is not None,
+                                                         chunk_size=1024)
+            self.assertEqual(compression, codec)
+            self.assertEqual(self.mmdb.get_gridfs_data(fs_id, "test_fs").decode(), data)
+        self.assertRaises(ValueError, compress_data, b"", "rar")
+
+        # the codec recorded in the metadata is used by the getters
+        self.mmdb.gridfs_compression = "lzma"
+        doc = VaspDrone().assimilate(os.path.join(test_files, "Si_static", "outputs"))
+        t_id = self.mmdb.insert_task(doc, use_gridfs=True)
+        calc = self.mmdb.collection.find_one({"task_id": t_id})["calcs_reversed"][0]
+        self.assertEqual(calc["dos_compression"], "lzma")
+        self.assertAlmostEqual(self.mmdb.get_dos(t_id).efermi, 5.6335, 3)
+        self.assertAlmostEqual(self.mmdb.get_chgcar(t_id).data["total"].sum() /
+                               self.mmdb.get_chgcar(t_id).ngridpts, 8.0, 4)
+
+    def test_binary_volumetric_data(self):
+        self.mmdb.volumetric_data_format = "binary"
+        drone = VaspDrone(store_volumetric_data=["chgcar", "aeccar0", "aeccar2"])
+        doc = drone.assimilate(os.path.join(test_files, "Si_static", "outputs"))
+        chgcar = doc["calcs_reversed"][0]["chgcar"]
+        t_id = self.mmdb.insert_task(doc, use_gridfs=True)
+        fs_id = self.mmdb.collection.find_one({"task_id": t_id})["calcs_reversed"][0]["chgcar_fs_id"]
+        self.assertEqual(self.mmdb.db.chgcar_fs.files.find_one({"_id": fs_id})["metadata"]["format"],
+                         "binary")
+        cc = self.mmdb.get_chgcar(t_id)
+        self.assertTrue(np.array_equal(cc.data["total"], chgcar.data["total"]))
+        self.assertEqual(cc.structure, chgcar.structure)
+        aeccar = self.mmdb.get_aeccar(t_id)
+        self.assertAlmostEqual(aeccar["aeccar2"].data["total"].sum() / aeccar["aeccar2"].ngridpts,
+                               8.01314480789829, 4)
+
+    def test_chunked_volumetric_data(self):
+        self.mmdb.volumetric_data_format = "chunked"
+        self.mmdb.volumetric_block_size = 7
+        drone = VaspDrone(store_volumetric_data=["chgcar", "locpot"])
+        doc = drone.assimilate(os.path.join(test_files, "Si_static", "outputs"))
+        chgcar = doc["calcs_reversed"][0]["chgcar"]
+        locpot = doc["calcs_reversed"][0]["locpot"]
+        t_id = self.mmdb.insert_task(doc, use_gridfs=True)
+
+        self.assertTrue(np.array_equal(self.mmdb.get_chgcar(t_id).data["total"],
+                                       chgcar.data["total"]))
+        for axis in range(3):
+            slab = self.mmdb.get_volumetric_slice(t_id, "chgcar", axis, (3, 10))
+            self.assertTrue(np.array_equal(slab, np.take(chgcar.data["total"], range(3, 10), axis)))
+            self.assertTrue(np.allclose(
+                self.mmdb.get_volumetric_planar_average(t_id, "locpot", axis),
+                locpot.get_average_along_axis(axis)))
+
+        data = self.mmdb.get_volumetric_memmap(t_id, "chgcar", cache_dir=self.scratch_dir)
+        self.assertTrue(np.array_equal(data, chgcar.data["total"]))
+        self.assertTrue(np.array_equal(self.mmdb.get_volumetric_slice(t_id, "chgcar", 1, (0, 2)),
+                                       chgcar.data["total"][:, 0:2, :]))
+
+    def test_gridfs_cache(self):
+        self.mmdb.gridfs_cache = GridFSCache(os.path.join(self.scratch_dir, "cache"))
+        doc = VaspDrone(store_volumetric_data=[]).assimilate(
+            os.path.join(test_files, "Si_static", "outputs"))
+        t_id = self.mmdb.insert_task(copy.deepcopy(doc), use_gridfs=True)
+        dos = self.mmdb.get_dos(t_id)
+        self.assertIs(self.mmdb.get_dos(t_id), dos)
+        self.assertEqual(len(os.listdir(os.path.join(self.scratch_dir, "cache"))), 1)
+
+        # overwriting the task invalidates its cached data
+        self.assertEqual(self.mmdb.insert_task(copy.deepcopy(doc), use_gridfs=True), t_id)
+        self.assertEqual(len(os.listdir(os.path.join(self.scratch_dir, "cache"))), 0)
+        self.assertIsNot(self.mmdb.get_dos(t_id), dos)
+        self.assertAlmostEqual(self.mmdb.get_dos(t_id).efermi, dos.efermi)
+
+        # the data of a task overwritten by another instance is read again
+        dos = self.mmdb.get_dos(t_id)
+        other = VaspCalcDb.from_db_file(os.path.join(db_dir, "db.json"))
+        self.assertEqual(other.insert_task(doc, use_gridfs=True), t_id)
+        self.assertIsNot(self.mmdb.get_dos(t_id), dos)
+
+    def test_retrieve_tasks(self):
+        drone = VaspDrone(store_volumetric_data=["chgcar", "locpot"])
+        doc = drone.assimilate(os.path.join(test_files, "Si_static", "outputs"))
+        t_id = self.mmdb.insert_task(doc, use_gridfs=True)
+
+        task = self.mmdb.retrieve_task(t_id)
+        calc = task["calcs_reversed"][0]
+        self.assertIn("input", task)
+        self.assertAlmostEqual(calc["dos"]["efermi"], 5.6335, 3)
+        self.assertAlmostEqual(calc["chgcar"].data["total"].sum() / calc["chgcar"].ngridpts, 8.0, 4)
+        self.assertIn("locpot", calc)
+
+        task = self.mmdb.retrieve_task(t_id, properties=["output.energy", "calcs_reversed.output"],
+                                       with_bs=False, with_volumetric=["chgcar"])
+        self.assertEqual(set(task), {"_id", "task_id", "output", "calcs_reversed"})
+        calc = task["calcs_reversed"][0]
+        self.assertIn("chgcar", calc)
+        self.assertIn("dos", calc)
+        self.assertNotIn("locpot", calc)
+        self.assertNotIn("input", calc)
+        self.assertIsNone(self.mmdb.retrieve_task(t_id + 1))
+
+        tasks = list(self.mmdb.retrieve_tasks({}, properties=["calcs_reversed"], with_dos=False,
+                                              with_volumetric=False, batch_size=1))
+        self.assertEqual(len(tasks), 1)
+        self.assertNotIn("dos", tasks[0]["calcs_reversed"][0])
+        self.assertNotIn("chgcar", tasks[0]["calcs_reversed"][0])
+
+    def test_trajectory(self):
+        drone = VaspDrone(runs=["relax1", "relax2"], store_volumetric_data=[],
+                          stream_ionic_steps=True)
+        doc = drone.assimilate(os.path.join(test_files, "Si_structure_optimization_relax2"))
+        trajectory = doc["calcs_reversed"][0]["trajectory"]
+        t_id = self.mmdb.insert_task(doc, use_gridfs=True)
+        self.assertNotIn("trajectory", self.mmdb.collection.find_one({"task_id": t_id})
+                         ["calcs_reversed"][0])
+        db_trajectory = self.mmdb.get_trajectory(t_id)
+        self.assertEqual(db_trajectory["species"], trajectory["species"])
+        self.assertTrue(np.array_equal(db_trajectory["frac_coords"], trajectory["frac_coords"]))
+
+
+class VolumetricDataEncodingTest(unittest.TestCase):
+
+    def test_encode_decode(self):
+        chgcar = Chgcar.from_file(os.path.join(test_files, "Si_static", "outputs", "CHGCAR.gz"))
+        header, buffer = encode_volumetric_data(chgcar, "float64")
+        self.assertEqual(len(buffer), 8 * chgcar.ngridpts * len(chgcar.data))
+        cc = decode_volumetric_data(header, buffer)
+        self.assertIsInstance(cc, Chgcar)
+        self.assertTrue(np.array_equal(cc.data["total"], chgcar.data["total"]))
+
+        header, buffer = encode_volumetric_data(chgcar.as_dict(), "float32")
+        self.assertEqual(len(buffer), 4 * chgcar.ngridpts * len(chgcar.data))
+        cc = decode_volumetric_data(header, buffer)
+        self.assertTrue(np.allclose(cc.data["total"], chgcar.data["total"]))
+
+        header, buffer = encode_chunked_volumetric_data(chgcar, block_size=5, compression="zlib")
+        self.assertEqual(len(header["block_offsets"]["total"]),
+                         len(get_volumetric_blocks(chgcar.dim, 5)) + 1)
+        cc = decode_chunked_volumetric_data(header, buffer)
+        self.assertTrue(np.array_equal(cc.data["total"], chgcar.data["total"]))
+
+    def test_encode_decode_trajectory(self):
+        trajectory = {"species": ["Si", "Si"], "frac_coords": np.random.rand(5, 2, 3),
+                      "e_0_energy": np.random.rand(5)}
+        header, buffer = encode_trajectory(trajectory, "float32")
+        self.assertEqual(len(buffer), 4 * 35)
+        decoded = decode_trajectory(header, buffer)
+        self.assertEqual(decoded["species"], ["Si", "Si"])
+        self.assertEqual(decoded["frac_coords"].shape, (5, 2, 3))
+        self.assertTrue(np.allclose(decoded["e_0_energy"], trajectory["e_0_energy"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,8 +4,10 @@
 
 import os
 import unittest
+from unittest.mock import patch
 
-from pymatgen.io.vasp import Outcar, Oszicar
+from pymatgen import Structure
+from pymatgen.io.vasp import Outcar, Oszicar, Vasprun
 
 from atomate.vasp.drones import VaspDrone
 
@@ -112,6 +114,22 @@ class VaspToDbTaskDroneTest(unittest.TestCase):
             self.assertTrue(d["is_metal"])
             self.assertEqual(doc["calcs_reversed"][0]["bandstructure"]["@class"],"BandStructureSymmLine")
 
+    def test_single_vasprun_parse(self):
+        nscf_line = os.path.join(module_dir, "..", "test_files", "Si_nscf_line", "outputs")
+        for mode in ["auto", "line"]:
+            drone = VaspDrone(bandstructure_mode=mode)
+            with patch("atomate.vasp.drones.Vasprun", wraps=Vasprun) as vasprun:
+                doc = drone.assimilate(nscf_line)
+            # the projected eigenvalues are parsed along with the rest of the file
+            self.assertEqual(vasprun.call_count, 1)
+            self.assertTrue(vasprun.call_args[1]["parse_projected_eigen"])
+            calc = doc["calcs_reversed"][0]
+            self.assertEqual(calc["bandstructure"]["@class"], "BandStructureSymmLine")
+            self.assertNotIn("projected_eigenvalues", calc["output"])
+            timings = calc["parse_timings"]
+            self.assertGreaterEqual(timings["total"], timings["vasprun"] + timings["bandstructure"])
+            self.assertEqual(drone._vasprun_cache, {})
+
     def test_detect_output_file_paths(self):
         drone = VaspDrone()
         doc = drone.assimilate(self.Si_static)
@@ -167,3 +185,77 @@ class VaspToDbTaskDroneTest(unittest.TestCase):
         doc = drone.assimilate(self.Si_static)
         pot_spec = doc['calcs_reversed'][0]['input']["potcar_spec"]
         self.assertIsNone(pot_spec[0]["hash"])  # check a hash was not loaded
+
+    def test_file_fingerprints(self):
+        self.assertNotIn("file_fingerprints",
+                         VaspDrone(runs=["relax1", "relax2"]).assimilate(self.relax2))
+        # the volumetric data objects of the reused calculations are copies
+        drone = VaspDrone(runs=["relax1", "relax2"], store_file_fingerprints=True,
+                          store_volumetric_data=[])
+        doc = drone.assimilate(self.relax2)
+        fingerprints = {fp["file"]: fp for fp in doc["file_fingerprints"]}
+        self.assertEqual(fingerprints["vasprun.xml.relax1.gz"]["task"], "relax1")
+        self.assertEqual(fingerprints["OUTCAR.relax2.gz"]["task"], "relax2")
+        self.assertEqual(fingerprints["INCAR.orig.gz"]["task"], "root")
+        self.assertEqual(fingerprints["OUTCAR.relax2.gz"]["size"],
+                         os.path.getsize(os.path.join(self.relax2, "OUTCAR.relax2.gz")))
+
+        # nothing changed: the previous doc is returned without parsing
+        self.assertIs(drone.assimilate(self.relax2, previous_doc=doc), doc)
+
+        # only the relax2 files changed: relax1 is reused from the previous doc
+        previous_doc = dict(doc, file_fingerprints=[dict(fp) for fp in doc["file_fingerprints"]])
+        for fp in previous_doc["file_fingerprints"]:
+            if fp["task"] == "relax2":
+                # the hash is only recomputed for a file whose size or mtime changed
+                fp["md5"] = "outdated"
+                fp["mtime"] -= 1
+        self.assertEqual(VaspDrone.get_changed_tasks(doc["file_fingerprints"],
+                                                     previous_doc["file_fingerprints"]), {"relax2"})
+        new_doc = drone.assimilate(self.relax2, previous_doc=previous_doc)
+        self.assertIsNot(new_doc, previous_doc)
+        self.assertEqual(new_doc["calcs_reversed"][1], doc["calcs_reversed"][1])
+        self.assertEqual(new_doc["run_stats"], doc["run_stats"])
+        self.assertEqual(new_doc["input"], doc["input"])
+        self.assertAlmostEqual(new_doc["output"]["energy"], doc["output"]["energy"])
+
+    def test_stream_ionic_steps(self):
+        doc = VaspDrone(runs=["relax1", "relax2"]).assimilate(self.relax2)
+        drone = VaspDrone(runs=["relax1", "relax2"], stream_ionic_steps=True, ionic_step_skip=2)
+        stream_doc = drone.assimilate(self.relax2)
+        self.assertAlmostEqual(stream_doc["output"]["energy"], doc["output"]["energy"])
+        self.assertEqual(stream_doc["output"]["forces"], doc["output"]["forces"])
+        self.assertEqual(stream_doc["input"]["potcar_spec"], doc["input"]["potcar_spec"])
+
+        # relax1 has 3 ionic steps: the first and the last are kept, the first without structure
+        calc, stream_calc = doc["calcs_reversed"][1], stream_doc["calcs_reversed"][1]
+        steps = stream_calc["output"]["ionic_steps"]
+        self.assertEqual(len(steps), 2)
+        self.assertEqual(stream_calc["output"]["nionic_steps"], 3)
+        self.assertNotIn("structure", steps[0])
+        self.assertEqual(steps[0]["e_fr_energy"], calc["output"]["ionic_steps"][0]["e_fr_energy"])
+        self.assertEqual(steps[-1], calc["output"]["ionic_steps"][-1])
+
+        trajectory = stream_calc["trajectory"]
+        self.assertEqual(trajectory["species"], ["Si", "Si"])
+        self.assertEqual(trajectory["frac_coords"].shape, (3, 2, 3))
+        self.assertEqual(trajectory["stress"].shape, (3, 3, 3))
+        for i, step in enumerate(calc["output"]["ionic_steps"]):
+            self.assertTrue(np.allclose(trajectory["forces"][i], step["forces"]))
+            self.assertTrue(np.allclose(trajectory["lattice"][i],
+                                        step["structure"]["lattice"]["matrix"]))
+            self.assertAlmostEqual(trajectory["e_wo_entrp"][i], step["e_wo_entrp"])
+
+        # by default only the last ionic step is kept, the others can keep more fields
+        stream_calc = VaspDrone(runs=["relax1", "relax2"], stream_ionic_steps=True).assimilate(
+            self.relax2)["calcs_reversed"][1]
+        self.assertEqual(stream_calc["output"]["ionic_steps"], calc["output"]["ionic_steps"][-1:])
+        self.assertEqual(stream_calc["has_vasp_completed"], calc["has_vasp_completed"])
+        drone = VaspDrone(runs=["relax1", "relax2"], stream_ionic_steps=True, ionic_step_skip=1,
+                          ionic_step_fields=["e_0_energy", "forces", "structure"])
+        steps = drone.assimilate(self.relax2)["calcs_reversed"][1]["output"]["ionic_steps"]
+        self.assertEqual(len(steps), 3)
+        self.assertEqual(sorted(steps[1]), ["e_0_energy", "forces", "structure"])
+        self.assertTrue(np.allclose(steps[1]["forces"], calc["output"]["ionic_steps"][1]["forces"]))
+        self.assertEqual(Structure.from_dict(steps[1]["structure"]),
+                         Structure.from_dict(calc["output"]["ionic_steps"][1]["structure"]))
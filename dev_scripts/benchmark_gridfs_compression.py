@@ -0,0 +1,50 @@
+"""
+Compare the compression ratio and encode/decode speed of the GridFS codecs of VaspCalcDb
+on the DOS and CHGCAR test fixtures.
+
+Usage: python benchmark_gridfs_compression.py [repeats]
+"""
+
+import os
+import sys
+import json
+import time
+
+from monty.json import MontyEncoder
+from pymatgen.io.vasp import Vasprun, Chgcar
+
+from atomate.vasp.database import compress_data, decompress_data, zstandard
+
+module_dir = os.path.dirname(os.path.abspath(__file__))
+SI_STATIC = os.path.join(module_dir, "..", "atomate", "vasp", "test_files", "Si_static", "outputs")
+
+CODECS = [("zlib", 1), ("zlib", 6), ("zlib", 9), ("gzip", 6), ("lzma", 0), ("lzma", 6)]
+if zstandard is not None:
+    CODECS.extend([("zstd", 3), ("zstd", 10), ("zstd", 19)])
+
+
+def benchmark(name, data, repeats=3):
+    print("{}: {:.2f} MB of json".format(name, len(data) / 1e6))
+    print("{:>6} {:>6} {:>8} {:>12} {:>12}".format("codec", "level", "ratio", "encode MB/s",
+                                                 "decode MB/s"))
+    for codec, level in CODECS:
+        t0 = time.time()
+        for i in range(repeats):
+            compressed = compress_data(data, codec, level)
+        t1 = time.time()
+        for i in range(repeats):
+            decompress_data(compressed, codec)
+        t2 = time.time()
+        mb = len(data) * repeats / 1e6
+        print("{:>6} {:>6} {:>8.2f} {:>12.1f} {:>12.1f}".format(
+            codec, level, len(data) / len(compressed), mb / (t1 - t0), mb / (t2 - t1)))
+    print()
+
+
+if __name__ == "__main__":
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    vrun = Vasprun(os.path.join(SI_STATIC, "vasprun.xml.gz"), parse_potcar_file=False)
+    dos = json.dumps(vrun.complete_dos.as_dict(), cls=MontyEncoder).encode()
+    benchmark("DOS", dos, repeats)
+    chgcar = Chgcar.from_file(os.path.join(SI_STATIC, "CHGCAR.gz"))
+    benchmark("CHGCAR", json.dumps(chgcar, cls=MontyEncoder).encode(), repeats)
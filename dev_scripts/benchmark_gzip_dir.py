@@ -0,0 +1,66 @@
+"""
+Compare the time taken to gzip a calculation directory by monty's gzip_dir, as custodian
+and GzipDir did, and by the threaded atomate.utils.fileio.gzip_dir.
+
+The directory is copied before each run and the original is left untouched. Without a
+directory, synthetic CHGCAR-like and WAVECAR-like files are used.
+
+Usage: python benchmark_gzip_dir.py [directory] [nthreads ...]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+import numpy as np
+
+from monty.shutil import gzip_dir as monty_gzip_dir
+
+from atomate.utils.fileio import gzip_dir
+
+
+def create_files(path, size=100000000):
+    # volumetric data as text, and binary wavefunction coefficients
+    values = np.random.rand(size // 36, 2)
+    np.savetxt(os.path.join(path, "CHGCAR"), values, fmt="%.11E")
+    np.random.rand(size // 16).astype(np.float64).tofile(os.path.join(path, "WAVECAR"))
+    for f in ["INCAR", "KPOINTS", "POSCAR", "OUTCAR"]:
+        with open(os.path.join(path, f), "w") as f_out:
+            f_out.write("{}\n".format(f) * 1000)
+
+
+def benchmark(source, name, gzip):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, "run")
+        shutil.copytree(source, path)
+        size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+        t0 = time.time()
+        gzip(path)
+        t = time.time() - t0
+        size_gz = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+        print("{:>16}: {:.2f} s, {:.1f} MB/s, ratio {:.2f}".format(
+            name, t, size / 1e6 / t, size / size_gz))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else None
+    nthreads = [int(n) for n in sys.argv[2:]] or [1, 2, 4, 8]
+    data_dir = None
+    if source is None:
+        data_dir = tempfile.mkdtemp()
+        source = os.path.join(data_dir, "run")
+        os.mkdir(source)
+        create_files(source)
+    try:
+        benchmark(source, "monty", monty_gzip_dir)
+        for n in nthreads:
+            benchmark(source, "nthreads={}".format(n),
+                      lambda path: gzip_dir(path, nthreads=n))
+    finally:
+        if data_dir:
+            shutil.rmtree(data_dir)
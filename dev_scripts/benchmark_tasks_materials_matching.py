@@ -0,0 +1,96 @@
+"""
+Time TasksMaterialsBuilder._match_material with and without the structure fingerprint
+pre-filter, on a synthetic materials collection of polymorph variants.
+
+The materials are split in groups of the same formula and space group, as for common
+prototypes, and the tasks to match are slightly distorted copies of random materials.
+
+Usage: python benchmark_tasks_materials_matching.py [db_file] [n_materials] [group_size] [n_tasks]
+
+The "benchmark_materials", "benchmark_counter", "benchmark_tasks" and
+"benchmark_materials_processed_tasks" collections of the
+database are dropped when done.
+"""
+
+import os
+import sys
+import time
+import random
+
+import numpy as np
+
+from pymatgen import Structure, Lattice
+
+from atomate.utils.utils import get_database
+from atomate.vasp.builders.tasks_materials import TasksMaterialsBuilder
+from atomate.vasp.builders.utils import get_structure_fingerprint
+
+module_dir = os.path.dirname(os.path.abspath(__file__))
+DB_FILE = os.path.join(module_dir, "..", "atomate", "common", "test_files", "db.json")
+
+
+def random_structure(n_formula_units):
+    # random lattice and coordinates at 10 A^3 per site: no symmetry, the cell is primitive
+    nsites = 3 * n_formula_units
+    abc = np.random.uniform(1, 3, 3)
+    angles = np.random.uniform(70, 110, 3)
+    lattice = Lattice.from_parameters(*abc, *angles)
+    lattice = lattice.scale(10 * nsites)
+    return Structure(lattice, ["Si", "O", "O"] * n_formula_units, np.random.rand(nsites, 3))
+
+
+def create_materials(materials, n_materials, group_size, batch_size=1000):
+    t0 = time.time()
+    docs = []
+    for i in range(n_materials):
+        structure = random_structure(random.choice([1, 2]))
+        docs.append({"material_id": "m-{}".format(i), "formula_reduced_abc": "O2 Si",
+                     "sg_number": i // group_size, "structure": structure.as_dict(),
+                     "_tasksbuilder": {"fingerprint": get_structure_fingerprint(structure)}})
+        if len(docs) == batch_size:
+            materials.insert_many(docs)
+            docs = []
+    if docs:
+        materials.insert_many(docs)
+    print("Created {} materials in {:.1f} s".format(n_materials, time.time() - t0))
+
+
+def create_task(materials, n_materials):
+    m = materials.find_one({"material_id": "m-{}".format(random.randrange(n_materials))})
+    structure = Structure.from_dict(m["structure"])
+    structure.apply_strain(np.random.uniform(-0.02, 0.02, 3))
+    structure.perturb(0.05)
+    return {"formula_reduced_abc": m["formula_reduced_abc"],
+            "output": {"spacegroup": {"number": m["sg_number"]},
+                       "structure": structure.as_dict()}}, m["material_id"]
+
+
+def benchmark(builder, tasks):
+    t0 = time.time()
+    n_matched = 0
+    for taskdoc, m_id in tasks:
+        n_matched += builder._match_material(taskdoc) == m_id
+    t = time.time() - t0
+    print("use_fingerprints={}: {:.3f} s per task, {}/{} tasks matched".format(
+        builder.use_fingerprints, t / len(tasks), n_matched, len(tasks)))
+
+
+if __name__ == "__main__":
+    db_file = sys.argv[1] if len(sys.argv) > 1 else DB_FILE
+    n_materials = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    group_size = int(sys.argv[3]) if len(sys.argv) > 3 else 500
+    n_tasks = int(sys.argv[4]) if len(sys.argv) > 4 else 20
+
+    db = get_database(db_file, admin=True)
+    try:
+        builder = TasksMaterialsBuilder(db.benchmark_materials, db.benchmark_counter,
+                                        db.benchmark_tasks)
+        create_materials(db.benchmark_materials, n_materials, group_size)
+        tasks = [create_task(db.benchmark_materials, n_materials) for _ in range(n_tasks)]
+        for use_fingerprints in [True, False]:
+            builder.use_fingerprints = use_fingerprints
+            benchmark(builder, tasks)
+    finally:
+        for c in ["benchmark_materials", "benchmark_counter", "benchmark_tasks",
+                  "benchmark_materials_processed_tasks"]:
+            db.drop_collection(c)